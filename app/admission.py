@@ -0,0 +1,159 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict
+from fastapi import HTTPException
+
+from .config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT,
+    LLM_CONCURRENCY_OVERRIDES,
+    EMBED_MAX_CONCURRENCY,
+    EMBED_MAX_QUEUE,
+    EMBED_QUEUE_TIMEOUT,
+    ADMISSION_MAX_WAITING
+)
+from .metrics import metrics
+
+class AdmissionRejected(HTTPException):
+    """Raised when a request cannot be admitted in time; carries a Retry-After hint"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+# Requests waiting in any limiter's queue; each of them holds a worker thread
+_total_waiting = 0
+_total_waiting_lock = threading.Lock()
+
+def _reserve_waiter() -> bool:
+    global _total_waiting
+    with _total_waiting_lock:
+        if _total_waiting >= ADMISSION_MAX_WAITING:
+            return False
+        _total_waiting += 1
+        return True
+
+def _release_waiter():
+    global _total_waiting
+    with _total_waiting_lock:
+        _total_waiting -= 1
+
+class Limiter:
+    """Concurrency limit with a bounded wait queue and a wait deadline"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, timeout: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        # Moving average of how long a slot is held, used for Retry-After
+        self._avg_service_time = 1.0
+
+    def _retry_after(self) -> float:
+        return self._avg_service_time * (self._waiting + 1) / self.max_concurrency
+
+    def expected_wait(self) -> float:
+        """Seconds a new request would wait for a slot, estimated like Retry-After"""
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                return 0.0
+            return self._retry_after()
+
+    def check(self):
+        """Reject now what acquire() would reject, or time out, without taking a slot"""
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                return
+            if self._waiting >= self.max_queue:
+                metrics.inc("admission_rejected_total", limiter=self.name, reason="queue_full")
+                raise AdmissionRejected(429, f"Too many pending requests for {self.name}", self._retry_after())
+            if _total_waiting >= ADMISSION_MAX_WAITING:
+                metrics.inc("admission_rejected_total", limiter=self.name, reason="threads")
+                raise AdmissionRejected(429, "Too many pending requests", self._retry_after())
+            if self._retry_after() > self.timeout:
+                metrics.inc("admission_rejected_total", limiter=self.name, reason="expected_timeout")
+                raise AdmissionRejected(503, f"Timed out waiting for {self.name}", self._retry_after())
+
+    def _publish(self):
+        metrics.set_gauge("admission_in_flight", self._active, limiter=self.name)
+        metrics.set_gauge("admission_queue_depth", self._waiting, limiter=self.name)
+
+    def acquire(self):
+        """Take a slot, waiting in the queue up to the deadline"""
+        start = time.monotonic()
+        with self._cond:
+            if self._active >= self.max_concurrency or self._waiting:
+                if self._waiting >= self.max_queue:
+                    metrics.inc("admission_rejected_total", limiter=self.name, reason="queue_full")
+                    raise AdmissionRejected(429, f"Too many pending requests for {self.name}", self._retry_after())
+                if not _reserve_waiter():
+                    metrics.inc("admission_rejected_total", limiter=self.name, reason="threads")
+                    raise AdmissionRejected(429, "Too many pending requests", self._retry_after())
+
+                self._waiting += 1
+                self._publish()
+                try:
+                    deadline = start + self.timeout
+                    while self._active >= self.max_concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            metrics.inc("admission_rejected_total", limiter=self.name, reason="timeout")
+                            raise AdmissionRejected(503, f"Timed out waiting for {self.name}", self._retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    _release_waiter()
+
+            self._active += 1
+            self._publish()
+        metrics.observe("admission_wait_seconds", time.monotonic() - start, limiter=self.name)
+
+    def release(self, held_for: float = None):
+        with self._cond:
+            self._active -= 1
+            if held_for is not None:
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * held_for
+            self._publish()
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of the block"""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+# Limiters are created lazily, one per provider/model or embedding purpose
+_limiters: Dict[str, Limiter] = {}
+_limiters_lock = threading.Lock()
+
+def _get_limiter(name: str, max_concurrency: int, max_queue: int, timeout: float) -> Limiter:
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = Limiter(name, max_concurrency, max_queue, timeout)
+        return _limiters[name]
+
+def llm_limiter(provider: str, model_name: str = None) -> Limiter:
+    """Limiter for generations against one provider/model"""
+    model = model_name or "default"
+    max_concurrency = LLM_CONCURRENCY_OVERRIDES.get(
+        f"{provider}:{model}",
+        LLM_CONCURRENCY_OVERRIDES.get(provider, LLM_MAX_CONCURRENCY)
+    )
+    return _get_limiter(f"llm:{provider}:{model}", max_concurrency, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+
+def embedding_limiter(purpose: str) -> Limiter:
+    """Limiter for local embedding work; purpose is "query" or "index" so ingestion cannot starve search"""
+    return _get_limiter(f"embed:{purpose}", EMBED_MAX_CONCURRENCY, EMBED_MAX_QUEUE, EMBED_QUEUE_TIMEOUT)
@@ -0,0 +1,334 @@
+"""
+Resumable bulk ingestion of a directory of documents.
+
+    python -m app.bulk_ingest ./corpus --tenant acme
+
+Files are extracted and chunked in worker processes, embedded in batches and
+upserted by parallel writers, with bounded queues between the stages. Every
+file whose chunks are all stored is appended to a checkpoint manifest, so an
+interrupted run resumes without redoing finished files. Point ids are derived
+from the tenant, file path and chunk number, so the chunks of a file that was
+cut off halfway are overwritten rather than duplicated when it is redone. A file
+that changed since it was ingested has its old chunks deleted first, so chunks
+it no longer has do not linger and its new ones are not near-duplicates of them.
+Near-duplicate chunks are dropped before embedding when DEDUP_MODE is on.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+from .dedup import deduplicator
+from .document_processing import process_pdf_content, process_text_document
+
+PDF_EXTENSIONS = {".pdf"}
+TEXT_EXTENSIONS = {".txt", ".md"}
+MANIFEST_NAME = ".ingest_manifest.jsonl"
+# Namespace of the deterministic point ids
+POINT_NAMESPACE = uuid.UUID("e75f35dc-3d91-4494-a3ba-e469ee269ef5")
+
+def discover(root: str) -> List[dict]:
+    """Supported files under root, as {path, size, mtime_ns} with paths relative to root"""
+    files = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if os.path.splitext(name)[1].lower() not in PDF_EXTENSIONS | TEXT_EXTENSIONS:
+                continue
+            full_path = os.path.join(directory, name)
+            stat = os.stat(full_path)
+            files.append({
+                "path": os.path.relpath(full_path, root),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            })
+    return sorted(files, key=lambda f: f["path"])
+
+def file_key(entry: dict) -> str:
+    """A file is redone when its size or modification time changed"""
+    return f"{entry['path']}:{entry['size']}:{entry['mtime_ns']}"
+
+def load_manifest(path: str) -> Dict[str, dict]:
+    """Finished files by file_key; a line cut off by an interruption is ignored"""
+    finished = {}
+    if not os.path.exists(path):
+        return finished
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            finished[file_key(entry)] = entry
+    return finished
+
+def extract(root: str, relative_path: str) -> List[Document]:
+    """Extract and chunk one file (runs in a worker process)"""
+    with open(os.path.join(root, relative_path), "rb") as f:
+        content = f.read()
+    if os.path.splitext(relative_path)[1].lower() in PDF_EXTENSIONS:
+        return process_pdf_content(content, relative_path)
+    text = content.decode("utf-8", errors="replace")
+    return process_text_document(text, {"source": relative_path, "type": "text"})
+
+class Progress:
+    """Throughput and ETA, estimated from the bytes of finished files"""
+
+    def __init__(self, total_files: int, total_bytes: int, interval: float = 2.0):
+        self.total_files = total_files
+        self.total_bytes = max(1, total_bytes)
+        self.interval = interval
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.duplicates = 0
+        self.started = time.monotonic()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def file_done(self, size: int, chunks: int):
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            self.chunks += chunks
+        self.report()
+
+    def duplicates_dropped(self, count: int):
+        with self._lock:
+            self.duplicates += count
+
+    def file_failed(self):
+        with self._lock:
+            self.failed += 1
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.bytes / elapsed
+        eta = (self.total_bytes - self.bytes) / rate if rate else float("inf")
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+        line = (
+            f"{self.files}/{self.total_files} files, {self.chunks} chunks "
+            f"({self.chunks / elapsed:.1f} chunks/s, {rate / 1e6:.2f} MB/s), "
+            f"{self.failed} failed, ETA {eta_text}"
+        )
+        if self.duplicates:
+            line += f", {self.duplicates} near-duplicates dropped"
+        end = "\r" if sys.stderr.isatty() and not force else "\n"
+        print(line, end=end, file=sys.stderr, flush=True)
+
+class BulkIngest:
+    """extract (processes) -> embed (one thread, batched) -> upsert (writer threads)"""
+
+    def __init__(self, root: str, tenant_id: str, manifest_path: str, extract_workers: int = 4,
+                 batch_size: int = 64, upsert_workers: int = 2, queue_size: int = 8):
+        self.root = root
+        self.tenant_id = tenant_id
+        self.manifest_path = manifest_path
+        self.extract_workers = extract_workers
+        self.batch_size = batch_size
+        self.upsert_workers = upsert_workers
+        self.chunk_queue: queue.Queue = queue.Queue(maxsize=queue_size * batch_size)
+        self.point_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        # Chunks still to be stored per file, and the files being worked on
+        self.pending: Dict[str, int] = {}
+        self.entries: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.error = None
+        self.progress = None
+
+    def point_id(self, entry: dict, index: int) -> str:
+        return str(uuid.uuid5(POINT_NAMESPACE, f"{self.tenant_id}:{entry['path']}:{index}"))
+
+    def _finish_file(self, key: str):
+        entry = self.entries.pop(key)
+        chunks = entry["chunks"]
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps({**entry, "finished_at": time.time()}) + "\n")
+        self.progress.file_done(entry["size"], chunks)
+
+    def _chunks_stored(self, counts: Counter):
+        finished = []
+        with self.lock:
+            for key, count in counts.items():
+                self.pending[key] -= count
+                if self.pending[key] == 0:
+                    del self.pending[key]
+                    finished.append(key)
+            for key in finished:
+                self._finish_file(key)
+
+    def _discard(self, ids: List[str], points=None):
+        """Undo what a batch that will not be stored left behind: its dedup signatures and docstore records"""
+        from .vector_store import discard_records
+
+        deduplicator.forget(ids)
+        discard_records(ids, points)
+
+    def _embed_stage(self):
+        from .vector_store import build_points
+
+        batch = []
+        def flush():
+            if batch:
+                ids = [pid for _, _, pid in batch]
+                if self.error is not None:
+                    self._discard(ids)
+                else:
+                    try:
+                        points = build_points([doc for _, doc, _ in batch], self.tenant_id, ids=ids)
+                        self.point_queue.put((points, ids, Counter(key for key, _, _ in batch)))
+                    except Exception as e:
+                        self.error = e
+                        self._discard(ids)
+            batch.clear()
+
+        while True:
+            item = self.chunk_queue.get()
+            if item is None:
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                flush()
+        flush()
+        for _ in range(self.upsert_workers):
+            self.point_queue.put(None)
+
+    def _upsert_stage(self):
+        from .vector_store import upsert_points
+
+        while True:
+            item = self.point_queue.get()
+            if item is None:
+                return
+            points, ids, counts = item
+            if self.error is not None:
+                self._discard(ids, points)
+                continue
+            try:
+                upsert_points(points, self.tenant_id)
+                self._chunks_stored(counts)
+            except Exception as e:
+                self.error = e
+                self._discard(ids, points)
+
+    def run(self) -> int:
+        """Ingest every unfinished file; returns the exit code"""
+        from .vector_store import create_hybrid_collection, delete_source
+
+        if not create_hybrid_collection():
+            print("Could not create or open the collection", file=sys.stderr)
+            return 1
+
+        finished = load_manifest(self.manifest_path)
+        files = discover(self.root)
+        todo = [f for f in files if file_key(f) not in finished]
+        print(f"{len(files)} files found, {len(files) - len(todo)} already ingested, {len(todo)} to do", file=sys.stderr)
+        changed = {entry["path"] for entry in finished.values()} & {f["path"] for f in todo}
+        if changed:
+            print(f"Deleting the old chunks of {len(changed)} changed files", file=sys.stderr)
+            for path in sorted(changed):
+                delete_source(self.tenant_id, path)
+        self.progress = Progress(len(todo), sum(f["size"] for f in todo))
+
+        embedder = threading.Thread(target=self._embed_stage, name="ingest-embed", daemon=True)
+        writers = [threading.Thread(target=self._upsert_stage, name=f"ingest-upsert-{i}", daemon=True)
+                   for i in range(self.upsert_workers)]
+        embedder.start()
+        for writer in writers:
+            writer.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+                # Keep a bounded number of files in flight so memory stays flat
+                in_flight = []
+                for entry in todo:
+                    in_flight.append((entry, pool.submit(extract, self.root, entry["path"])))
+                    if len(in_flight) >= 2 * self.extract_workers:
+                        self._feed(*in_flight.pop(0))
+                    if self.error is not None:
+                        break
+                for entry, future in in_flight:
+                    if self.error is not None:
+                        future.cancel()
+                        continue
+                    self._feed(entry, future)
+        except KeyboardInterrupt:
+            print("\nInterrupted; finished files are recorded, rerun to resume", file=sys.stderr)
+            return 130
+        finally:
+            self.chunk_queue.put(None)
+
+        embedder.join()
+        for writer in writers:
+            writer.join()
+        self.progress.report(force=True)
+
+        if self.error is not None:
+            print(f"Ingestion stopped: {self.error}; rerun to resume", file=sys.stderr)
+            return 1
+        return 0 if not self.progress.failed else 2
+
+    def _feed(self, entry: dict, future):
+        """Hand the chunks of one extracted file to the embed stage"""
+        try:
+            documents = future.result()
+        except Exception as e:
+            # Not recorded as finished, so it is retried on the next run
+            print(f"\nFailed to extract {entry['path']}: {e}", file=sys.stderr)
+            self.progress.file_failed()
+            return
+
+        # Chunks keep their deterministic ids, so a file redone after an interruption is not
+        # taken for a duplicate of its own earlier chunks
+        ids = [self.point_id(entry, index) for index in range(len(documents))]
+        documents, ids, dropped = deduplicator.filter(documents, self.tenant_id, ids)
+        self.progress.duplicates_dropped(dropped)
+
+        key = file_key(entry)
+        with self.lock:
+            self.entries[key] = {**entry, "chunks": len(documents), "duplicates": dropped}
+            if not documents:
+                self._finish_file(key)
+                return
+            self.pending[key] = len(documents)
+        for doc, point_id in zip(documents, ids):
+            self.chunk_queue.put((key, doc, point_id))
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a directory of PDF and text files")
+    parser.add_argument("directory")
+    parser.add_argument("--tenant", default=None, help="Tenant to ingest for (default: DEFAULT_TENANT)")
+    parser.add_argument("--manifest", default=None, help=f"Checkpoint file (default: <directory>/{MANIFEST_NAME})")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per embedding batch")
+    parser.add_argument("--upsert-workers", type=int, default=2)
+    args = parser.parse_args()
+
+    from .vector_store import validate_tenant
+
+    ingest = BulkIngest(
+        root=args.directory,
+        tenant_id=validate_tenant(args.tenant),
+        manifest_path=args.manifest or os.path.join(args.directory, MANIFEST_NAME),
+        extract_workers=args.extract_workers,
+        batch_size=args.batch_size,
+        upsert_workers=args.upsert_workers,
+    )
+    sys.exit(ingest.run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import re
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different spellings share a key"""
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+class SingleFlight:
+    """Run at most one in-flight call per key; concurrent callers share its result"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, shared). The leader's work runs as its own task so a
+        disconnecting leader does not cancel the followers waiting on it."""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        else:
+            logger.debug(f"Coalesced request onto in-flight call {key!r}")
+        return await asyncio.shield(task), shared
+
+class _Broadcast:
+    """Replayable event log of one producer, read by any number of subscribers"""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.done = False
+        self.error: BaseException = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    def publish(self, event: Any):
+        self.events.append(event)
+        self.changed.set()
+
+    def finish(self, error: BaseException = None):
+        self.done = True
+        self.error = error
+        self.changed.set()
+
+class StreamFlight:
+    """Single-flight for streams: followers attach to the leader's event stream
+    and replay what was already produced before following live"""
+
+    def __init__(self):
+        self._streams: Dict[Hashable, _Broadcast] = {}
+
+    async def _produce(self, key: Hashable, broadcast: _Broadcast, source: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for event in source():
+                broadcast.publish(event)
+            broadcast.finish()
+        except asyncio.CancelledError:
+            broadcast.finish(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            broadcast.finish(e)
+        finally:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Whether a stream for key is running, so a subscriber would not start one"""
+        return key in self._streams
+
+    async def subscribe(self, key: Hashable, source: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Yield every event of the stream for key, starting a producer if none is running"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(self._produce(key, broadcast, source))
+        else:
+            logger.debug(f"Attached stream subscriber to in-flight stream {key!r}")
+
+        broadcast.subscribers += 1
+        position = 0
+        try:
+            while True:
+                while position < len(broadcast.events):
+                    yield broadcast.events[position]
+                    position += 1
+                if broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                broadcast.changed.clear()
+                if position < len(broadcast.events) or broadcast.done:
+                    continue
+                await broadcast.changed.wait()
+        finally:
+            broadcast.subscribers -= 1
+            # Nobody is listening any more: stop paying for the generation
+            if broadcast.subscribers == 0 and not broadcast.done:
+                broadcast.task.cancel()
@@ -1,4 +1,5 @@
 import os
+import math
 import requests
 import logging
 from typing import List, Dict
@@ -14,24 +15,253 @@ logger = logging.getLogger(__name__)
 API_TITLE = "RAG API"
 API_DESCRIPTION = "RAG system with hybrid search"
 
+# Logging: one JSON object per line ("json") or plain lines ("text"). LOG_LEVELS overrides
+# the level per logger, e.g. "app.vector_store=DEBUG,httpx=WARNING". Debug events on hot
+# paths (every search, every generation) are only logged for a sample of requests
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = dict(
+    (name.strip(), level.strip().upper())
+    for name, _, level in (item.partition("=") for item in os.getenv("LOG_LEVELS", "").split(","))
+    if name.strip() and level.strip()
+)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+
 # Qdrant Configuration
+# "remote" (server at QDRANT_URL), or embedded storage for tests, benchmarks and single-node
+# installs: "local" (persisted under QDRANT_PATH) or "memory" (lost when the process exits)
+QDRANT_MODE = os.getenv("QDRANT_MODE", "remote")
+QDRANT_PATH = os.getenv("QDRANT_PATH", "qdrant_data")
 QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
 QDRANT_PORT = os.getenv("QDRANT_PORT", "6333")
 QDRANT_URL = f"http://{QDRANT_HOST}:{QDRANT_PORT}"
+# gRPC sends vectors as packed binary instead of JSON float arrays
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "30"))        # seconds per request
+QDRANT_RETRIES = int(os.getenv("QDRANT_RETRIES", "2"))         # retries of transient failures
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "8"))     # gRPC channels / HTTP connections
+# Large uploads are split into batches, sent up to QDRANT_UPSERT_PARALLEL at a time by the async client
+QDRANT_UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", "256"))
+QDRANT_UPSERT_PARALLEL = int(os.getenv("QDRANT_UPSERT_PARALLEL", "2"))
 
 # Collection Configuration
 COLLECTION_NAME = "hybrid_documents"
 
+# Multi-tenancy: tenants share COLLECTION_NAME, partitioned by an is_tenant payload index.
+# A tenant whose point count passes TENANT_DEDICATED_THRESHOLD (0 = never) moves to its own collection
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+TENANT_DEDICATED_THRESHOLD = int(os.getenv("TENANT_DEDICATED_THRESHOLD", "0"))
+
+# Versioned collections: COLLECTION_NAME and the tenant collections are aliases onto
+# "<name>.v<N>" collections. Clearing or reindexing builds a new version and swaps the
+# aliases atomically; versions no alias points at are deleted INDEX_GC_DELAY_SECONDS
+# later, so searches already running against them can finish
+INDEX_GC_DELAY_SECONDS = float(os.getenv("INDEX_GC_DELAY_SECONDS", "30"))
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "256"))   # chunks re-embedded per batch
+
+# Embedding Configuration
+# Any fastembed model; smaller or quantized ONNX ones (e.g. BAAI/bge-small-en-v1.5,
+# nomic-ai/nomic-embed-text-v1.5-Q) cut CPU cost a lot. The dense vector is named after its
+# model and sized from it, so a collection built with another model needs POST /admin/reindex
+DENSE_MODEL_NAME = os.getenv("DENSE_MODEL_NAME", "thenlper/gte-large")
+SPARSE_MODEL_NAME = os.getenv("SPARSE_MODEL_NAME", "Qdrant/minicoil-v1")
+# A dense model fastembed does not list, e.g. an int8-quantized ONNX export on Hugging Face:
+# DENSE_MODEL_NAME is then its repo, DENSE_MODEL_FILE the ONNX file in it (DENSE_MODEL_DIM required)
+DENSE_MODEL_FILE = os.getenv("DENSE_MODEL_FILE", "")
+DENSE_MODEL_DIM = int(os.getenv("DENSE_MODEL_DIM", "0")) or None
+DENSE_MODEL_POOLING = os.getenv("DENSE_MODEL_POOLING", "mean")   # "mean" or "cls"
+
+def _available_cpus() -> int:
+    """Cores this process may use: its CPU affinity, capped by a cgroup v2 CPU quota (docker --cpus)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+# CPU threading: ONNX Runtime would size its thread pool from the host's cores and oversubscribe
+# a CPU-limited container. EMBED_THREADS caps the intra-op threads of each model (0 = available
+# cores); EMBED_PARALLEL > 1 embeds large document batches in that many single-threaded worker
+# processes (0 = one per available core). Queries always run in-process
+AVAILABLE_CPUS = _available_cpus()
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0")) or AVAILABLE_CPUS
+EMBED_PARALLEL = int(os.getenv("EMBED_PARALLEL", "1")) or AVAILABLE_CPUS
+
+# Shared embedding service: when set, API workers send embedding requests over this Unix
+# socket to one process (python -m app.embedding_service) that owns the models
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET", "")
+# Seconds an API worker waits on the service for each send or receive before failing the request
+EMBED_SERVICE_TIMEOUT = float(os.getenv("EMBED_SERVICE_TIMEOUT", "60"))
+# Micro-batching in the service: wait up to this long to fill a batch of at most this many texts
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+EMBED_BATCH_MAX_TEXTS = int(os.getenv("EMBED_BATCH_MAX_TEXTS", "256"))
+
+# Server mode (python -m app.server --workers N): state every API worker must agree on (collection
+# layout, corpus version, model registry, reindex progress) is kept in a shared store, and
+# changes made by one worker reach the others within SHARED_STATE_POLL_INTERVAL seconds.
+# "sqlite" (SHARED_STATE_PATH, for the workers of one host), "redis" (SHARED_STATE_URL, for
+# replicas on several hosts) or "memory" (one process; the default unless several workers run on
+# a Qdrant server, so a single process never restores the layout of a reindex it crashed during)
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+SHARED_STATE_BACKEND = os.getenv(
+    "SHARED_STATE_BACKEND", "sqlite" if QDRANT_MODE == "remote" and API_WORKERS > 1 else "memory"
+)
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.sqlite")
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "redis://localhost:6379/0")
+SHARED_STATE_POLL_INTERVAL = float(os.getenv("SHARED_STATE_POLL_INTERVAL", "0.5"))
+# A lock (or a running reindex) not renewed for this long belongs to a worker that died
+SHARED_LOCK_TIMEOUT = float(os.getenv("SHARED_LOCK_TIMEOUT", "600"))
+# On shutdown, how long in-flight requests may take to finish
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "30"))
+
+# Index snapshot bundles (see app/snapshots.py)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+
+# Retrieval Configuration
+DEFAULT_RETRIEVAL_LIMIT = 4
+
+# Retrieval modes: "fast" (sparse only, the dense model is skipped), "balanced" (hybrid
+# prefetch), "deep" (wider hybrid prefetch re-ranked by a cross-encoder) or "auto"
+# (chosen per query from its length and shape)
+DEFAULT_RETRIEVAL_MODE = os.getenv("DEFAULT_RETRIEVAL_MODE", "balanced")
+HYBRID_PREFETCH_LIMIT = int(os.getenv("HYBRID_PREFETCH_LIMIT", "20"))
+DEEP_PREFETCH_LIMIT = int(os.getenv("DEEP_PREFETCH_LIMIT", "100"))
+# Fused candidates handed to the cross-encoder in deep mode
+DEEP_RERANK_CANDIDATES = int(os.getenv("DEEP_RERANK_CANDIDATES", "30"))
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "Xenova/ms-marco-MiniLM-L-6-v2")
+# Auto mode: keyword lookups of at most this many words go fast, questions of at least this many go deep
+AUTO_FAST_MAX_WORDS = int(os.getenv("AUTO_FAST_MAX_WORDS", "3"))
+AUTO_DEEP_MIN_WORDS = int(os.getenv("AUTO_DEEP_MIN_WORDS", "20"))
+
+# Sources returned with answers: "none", "snippet" (first SOURCE_SNIPPET_CHARS characters) or "full"
+DEFAULT_SOURCES_MODE = os.getenv("DEFAULT_SOURCES_MODE", "snippet")
+SOURCE_SNIPPET_CHARS = int(os.getenv("SOURCE_SNIPPET_CHARS", "500"))
+# Responses of at least this many bytes are gzipped for clients that accept it (0 = off)
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1000"))
+
+# Request coalescing: identical concurrent queries share one pipeline run
+QUERY_COALESCING = os.getenv("QUERY_COALESCING", "true").lower() == "true"
+
+# Admission control: per provider/model concurrency with a bounded, deadline-limited wait queue
+def _parse_limits(value: str) -> Dict[str, int]:
+    """Parse "provider:model=N,provider=N" into a dict"""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, limit = item.rsplit("=", 1)
+            limits[key.strip()] = int(limit)
+    return limits
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_CONCURRENCY_OVERRIDES = _parse_limits(os.getenv("LLM_CONCURRENCY_LIMITS", "groq=8"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "2"))
+EMBED_MAX_QUEUE = int(os.getenv("EMBED_MAX_QUEUE", "32"))
+EMBED_QUEUE_TIMEOUT = float(os.getenv("EMBED_QUEUE_TIMEOUT", "30"))
+# Queued requests wait on a worker thread (run_in_threadpool, asyncio.to_thread, sync graph nodes).
+# Both pools get WORKER_THREADS threads, and past ADMISSION_MAX_WAITING waiters across every
+# queue new ones get 429 at once, so waiting never takes the threads running admitted work
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "64"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", str(WORKER_THREADS // 2)))
+
+# Latency-budgeted fallback for generation: when the primary model produces no
+# token within the budget (or fails), the fallback is hedged in or failed over to
+FALLBACK_PROVIDER = os.getenv("FALLBACK_PROVIDER", "")
+FALLBACK_MODEL = os.getenv("FALLBACK_MODEL") or None
+FALLBACK_URL = os.getenv("FALLBACK_URL") or None  # Ollama-compatible server for the fallback
+LATENCY_BUDGET_MS = int(os.getenv("LATENCY_BUDGET_MS", "0")) or None
+HEDGE_MODE = os.getenv("HEDGE_MODE", "hedge")  # "hedge" or "failover"
+
+# Reasoning models: their <think> block is split from the answer and returned as "reasoning".
+# Generation stops thinking after max_reasoning_tokens (estimated; per request, default below,
+# unset = unlimited, 0 = no reasoning) and is resumed after a closed block, so the model answers
+_max_reasoning_tokens = os.getenv("DEFAULT_MAX_REASONING_TOKENS", "")
+DEFAULT_MAX_REASONING_TOKENS = int(_max_reasoning_tokens) if _max_reasoning_tokens else None
+# Models whose chat templates open the <think> block themselves (substrings of the model name),
+# so their output is read as reasoning until a bare </think>. Models that write <think> out
+# (or whose thinking Ollama returns separately, like qwen3 and gpt-oss) do not belong here:
+# their direct answers would be held back as reasoning. Models seen to emit a bare </think>
+# are added at runtime
+REASONING_MODELS = [m.strip().lower() for m in os.getenv(
+    "REASONING_MODELS", "deepseek-r1,qwq,magistral,phi4-reasoning").split(",") if m.strip()]
+
+# Graph routing: retrievals whose best score is below MIN_RELEVANCE_SCORE are answered
+# with NO_CONTEXT_RESPONSE without calling the LLM; small talk can skip retrieval entirely
+MIN_RELEVANCE_SCORE = float(os.getenv("MIN_RELEVANCE_SCORE", "0"))
+SMALL_TALK_ROUTING = os.getenv("SMALL_TALK_ROUTING", "false").lower() == "true"
+
+# Conversation mode: per-thread history persisted by a LangGraph SQLite checkpointer.
+# Once history exceeds HISTORY_TOKEN_LIMIT (estimated), older turns are folded into a
+# rolling summary and only the last HISTORY_KEEP_MESSAGES messages are kept verbatim
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.sqlite")
+HISTORY_TOKEN_LIMIT = int(os.getenv("HISTORY_TOKEN_LIMIT", "2000"))
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", "4"))
+
 # Text Splitter Configuration
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 
+# Parent-child chunking: documents are split into large parent windows, kept in a local
+# docstore, and only their small child chunks are embedded. Retrieval matches children and
+# generation reads the parents of the final top-k
+PARENT_CHILD_CHUNKING = os.getenv("PARENT_CHILD_CHUNKING", "false").lower() == "true"
+PARENT_CHUNK_SIZE = int(os.getenv("PARENT_CHUNK_SIZE", "2000"))
+PARENT_CHUNK_OVERLAP = int(os.getenv("PARENT_CHUNK_OVERLAP", "200"))
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "300"))
+CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", "50"))
+
+# Local docstore backend: "sqlite" (compressed records in DOCSTORE_PATH) or "segment"
+# (append-only compressed segment files with an offset index in DOCSTORE_DIR, read through mmap)
+DOCSTORE_BACKEND = os.getenv("DOCSTORE_BACKEND", "sqlite")
+DOCSTORE_PATH = os.getenv("DOCSTORE_PATH", "docstore.sqlite")
+DOCSTORE_DIR = os.getenv("DOCSTORE_DIR", "docstore")
+DOCSTORE_SEGMENT_BYTES = int(os.getenv("DOCSTORE_SEGMENT_BYTES", str(64 << 20)))
+# Keep chunk text in the docstore instead of the Qdrant payload; it is hydrated after retrieval
+EXTERNAL_CHUNK_TEXT = os.getenv("EXTERNAL_CHUNK_TEXT", "false").lower() == "true"
+
+# Near-duplicate chunks at ingestion, found with MinHash LSH over word shingles (per tenant):
+# "off", "skip" (not indexed) or "link" (not indexed, recorded against the chunk they duplicate)
+DEDUP_MODE = os.getenv("DEDUP_MODE", "off")
+DEDUP_PATH = os.getenv("DEDUP_PATH", "dedup.sqlite")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))   # estimated Jaccard similarity
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "5"))  # words per shingle
+
+# LLM provider of requests that name none: "ollama", "groq" or "fake" (canned answers, for
+# tests and benchmarks without any LLM server; Ollama is then never contacted)
+DEFAULT_PROVIDER = os.getenv("DEFAULT_PROVIDER", "ollama")
+# Answers of the fake provider, separated by "|" and returned in turn
+FAKE_LLM_RESPONSES = [
+    r for r in os.getenv("FAKE_LLM_RESPONSES", "This is a canned answer from the fake LLM provider.").split("|") if r
+]
+FAKE_MODEL_CONFIGS = [{"name": "Fake", "tag": "fake", "provider": "fake", "is_active": True}]
+
 # Ollama Configuration
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
 OLLAMA_LIST_LLMS = f"{OLLAMA_URL}/api/tags"
 
+# Model used when Ollama cannot be asked for its models
+FALLBACK_OLLAMA_MODEL = {
+    "name": "Llama 3.2",
+    "tag": "llama3.2",
+    "provider": "ollama",
+    "is_active": True,
+    "url": OLLAMA_URL
+}
+
 def get_ollama_models() -> List[Dict]:
     """Dynamically fetch available Ollama models"""
+    if DEFAULT_PROVIDER == "fake":
+        return [FALLBACK_OLLAMA_MODEL]
     try:
         response = requests.get(OLLAMA_LIST_LLMS, timeout=10)
         response.raise_for_status()
@@ -59,17 +289,31 @@ def get_ollama_models() -> List[Dict]:
     except Exception as e:
         logger.error(f"Error fetching Ollama models: {str(e)}")
         # Return fallback model if Ollama is not available
-        return [{
-            "name": "Llama 3.2",
-            "tag": "llama3.2",
-            "provider": "ollama",
-            "is_active": True,
-            "url": OLLAMA_URL
-        }]
+        return [FALLBACK_OLLAMA_MODEL]
 
 # Dynamic Ollama model configurations
 OLLAMA_MODEL_CONFIGS = get_ollama_models()
 
+# Model warm-up and keep-alive: warm models are preloaded (and their static system prompt
+# prefilled) at startup and every OLLAMA_WARMUP_INTERVAL seconds (0 = startup only)
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() == "true" and DEFAULT_PROVIDER != "fake"
+OLLAMA_WARMUP_MODELS = [m.strip() for m in os.getenv("OLLAMA_WARMUP_MODELS", "").split(",") if m.strip()]
+OLLAMA_WARMUP_INTERVAL = float(os.getenv("OLLAMA_WARMUP_INTERVAL", "0"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Per-model keep-alive, e.g. "llama3.2=-1,qwq=5m" (-1 keeps the model loaded forever)
+OLLAMA_KEEP_ALIVE_OVERRIDES = dict(
+    item.strip().rsplit("=", 1) for item in os.getenv("OLLAMA_KEEP_ALIVE_OVERRIDES", "").split(",") if "=" in item
+)
+# Fixed context size: changing num_ctx between requests forces Ollama to reload the model
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "0")) or None
+# A generation whose model load took longer than this counts as a cold start
+OLLAMA_COLD_LOAD_SECONDS = 0.1
+
+def ollama_keep_alive(model_tag: str):
+    """Keep-alive for an Ollama model: a duration string like "30m", or seconds (-1 = forever)"""
+    keep_alive = OLLAMA_KEEP_ALIVE_OVERRIDES.get(model_tag, OLLAMA_KEEP_ALIVE)
+    return int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive
+
 GROQ_MODEL_CONFIGS = [
     {"name": "G-QwQ 32B", "tag": "qwen-qwq-32b", "provider": "groq", "is_active": True},
     {"name": "G-DeepSeek R1 Distill Llama 70B", "tag": "deepseek-r1-distill-llama-70b", "provider": "groq", "is_active": True},
@@ -78,6 +322,45 @@ GROQ_MODEL_CONFIGS = [
     {"name": "G-Mistral Saba 24B", "tag": "mistral-saba-24b", "provider": "groq", "is_active": True}
 ]
 
+# Automatic model routing for model_name="auto" (see app/model_router.py). Each request goes to
+# a tier from its question and retrieved context size; MODEL_TIERS lists the candidates of each
+# tier, cheapest first, as "tier=provider:model|provider,..." (no model = the provider's default)
+AUTO_MODEL = "auto"
+MODEL_TIER_NAMES = ("small", "medium", "large")
+
+def _parse_tiers(value: str) -> Dict[str, List[Dict]]:
+    """Parse "small=ollama,medium=ollama|groq:llama-3.3-70b-versatile" into candidates per tier"""
+    tiers = {}
+    for item in value.split(","):
+        if "=" in item:
+            tier, candidates = item.split("=", 1)
+            tiers[tier.strip()] = [
+                {"provider": provider.strip(), "model_name": model.strip() or None}
+                for provider, _, model in (c.partition(":") for c in candidates.split("|") if c.strip())
+            ]
+    return tiers
+
+if DEFAULT_PROVIDER == "fake":
+    _default_tiers = "small=fake,medium=fake,large=fake"
+elif os.getenv("GROQ_API_KEY"):
+    _default_tiers = ("small=ollama,medium=ollama|groq:llama-3.3-70b-versatile,"
+                      "large=groq:llama-3.3-70b-versatile|groq:deepseek-r1-distill-llama-70b")
+else:
+    _default_tiers = "small=ollama,medium=ollama,large=ollama"
+MODEL_TIERS = _parse_tiers(os.getenv("MODEL_TIERS", _default_tiers))
+# Questions up to this many words over at most this much context (estimated tokens) go small,
+# from these on large; analytical questions (why, compare, explain...) go one tier up
+ROUTER_SMALL_MAX_WORDS = int(os.getenv("ROUTER_SMALL_MAX_WORDS", "12"))
+ROUTER_SMALL_MAX_CONTEXT_TOKENS = int(os.getenv("ROUTER_SMALL_MAX_CONTEXT_TOKENS", "1500"))
+ROUTER_LARGE_MIN_WORDS = int(os.getenv("ROUTER_LARGE_MIN_WORDS", "40"))
+ROUTER_LARGE_MIN_CONTEXT_TOKENS = int(os.getenv("ROUTER_LARGE_MIN_CONTEXT_TOKENS", "6000"))
+# A cheaper candidate is used unless its expected latency is this much above the fastest one
+ROUTER_LATENCY_SLACK_SECONDS = float(os.getenv("ROUTER_LATENCY_SLACK_SECONDS", "1.0"))
+# Latency statistics older than this are dropped, so a slow model is tried again
+ROUTER_STATS_TTL_SECONDS = float(os.getenv("ROUTER_STATS_TTL_SECONDS", "300"))
+# Providers billed per token; their estimated tokens are counted in router_billed_tokens_total
+BILLED_PROVIDERS = [p.strip() for p in os.getenv("BILLED_PROVIDERS", "groq").split(",") if p.strip()]
+
 # System Templates
 SYSTEM_TEMPLATE = """
 You are an expert QA Assistant with deep analytical capabilities. Your role is to provide comprehensive, well-structured answers using only the provided context as your source of information.
@@ -111,23 +394,30 @@ If the context exists but doesn't contain sufficient information to answer the q
 "I don't have enough information in the provided context to answer this question comprehensively. The available documents don't seem to cover [specific topic]. Could you please provide more relevant documents or clarify what specific aspect you'd like me to focus on?"
 """
 
-# Template for when no context is available
-NO_CONTEXT_TEMPLATE = """
-You are a helpful RAG assistant. The user has asked a question but no relevant documents were found in the knowledge base.
-
-Your task is to politely inform the user that you don't have the necessary information and guide them on next steps.
-
-Respond with:
-"I don't have any relevant information in my knowledge base to answer your question about '{query}'. 
+# Canned response used when retrieval finds nothing usable (no LLM call)
+NO_CONTEXT_RESPONSE = """I don't have any relevant information in my knowledge base to answer your question about '{query}'.
 
 To help you better, could you please:
 1. 📄 Upload documents related to your question using the sidebar
 2. 🔍 Provide more specific details about what you're looking for
 3. ✏️ Clarify or rephrase your question
 
-Once you provide relevant documents, I'll be able to give you a comprehensive answer based on that information!"
+Once you provide relevant documents, I'll be able to give you a comprehensive answer based on that information!"""
 
-Be helpful, friendly, and encouraging while clearly explaining the limitation.
+# Template for conversational messages that do not need retrieval
+SMALL_TALK_TEMPLATE = """
+You are a friendly RAG assistant that answers questions about the user's uploaded documents.
+The user's message is small talk (a greeting, thanks or similar). Reply briefly and warmly in one or two sentences, and offer to help with questions about their documents.
+"""
+
+# Template for compacting conversation history into a rolling summary
+SUMMARY_TEMPLATE = """
+Summarize the conversation below between a user and a document QA assistant. Keep the facts, names,
+numbers and open questions a follow-up question might refer to. Be concise: at most 200 words.
+
+{existing_summary}
+CONVERSATION:
+{conversation}
 """
 
 HUMAN_TEMPLATE = """
@@ -165,15 +455,12 @@ If the context doesn't contain sufficient information to fully answer the questi
 Remember: Base your entire response solely on the provided context. Do not add information from outside sources.
 """
 
-# Template for when context is available
+# Template for when context is available. The static instructions come first and the
+# variable context and question last, so the prompt prefix Ollama can reuse from its KV
+# cache (system prompt + instructions) stays byte-identical across requests
 CONTEXT_HUMAN_TEMPLATE = """
-CONTEXT INFORMATION:
-{context_str}
-
-QUESTION: {query}
-
 ANALYSIS INSTRUCTIONS:
-Please provide a comprehensive answer to the question above using the context information provided. 
+Please provide a comprehensive answer to the question below using the context information provided. 
 
 Your response should:
 1. Be thorough and detailed, covering all relevant aspects mentioned in the context
@@ -189,4 +476,9 @@ If the context doesn't contain sufficient information to fully answer the questi
 - Provide the best possible answer with the available information
 
 Remember: Base your entire response solely on the provided context. Do not add information from outside sources.
-""" 
\ No newline at end of file
+
+CONTEXT INFORMATION:
+{context_str}
+
+QUESTION: {query}
+"""
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""
+Near-duplicate chunk detection at ingestion.
+
+Every chunk gets a MinHash signature of its word shingles. The signatures are
+cut into bands and stored in an LSH index in a local SQLite database, so
+chunks that share a band bucket with an indexed chunk are candidates, and a
+candidate whose estimated Jaccard similarity reaches DEDUP_THRESHOLD is a
+near-duplicate. Chunks are only compared within their tenant.
+
+Near-duplicates are not embedded or stored. In "link" mode they are recorded
+against the canonical chunk (the first one indexed) with their metadata, so
+the other places a text appears are not lost.
+"""
+
+import os
+import re
+import json
+import zlib
+import logging
+import sqlite3
+import hashlib
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from .config import DEDUP_MODE, DEDUP_PATH, DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_SHINGLE_SIZE
+
+DEDUP_MODES = ("off", "skip", "link")
+# Permutations are a * x + b modulo a Mersenne prime, which stays inside uint64
+_PRIME = (1 << 31) - 1
+# Fixed seed: stored signatures must stay comparable across restarts
+_SEED = 1
+_WORD = re.compile(r"\w+")
+
+logger = logging.getLogger(__name__)
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) whose LSH threshold (1/bands)^(1/rows) is closest to threshold without exceeding it,
+    so near-duplicates are rarely missed; false candidates are filtered by their estimated similarity"""
+    best = (num_perm, 1)
+    best_distance = float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        estimate = (1 / bands) ** (1 / rows)
+        if estimate <= threshold and threshold - estimate < best_distance:
+            best, best_distance = (bands, rows), threshold - estimate
+    return best
+
+class MinHasher:
+    """MinHash signatures of word shingles"""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE):
+        self.num_perm = num_perm
+        self.shingle_size = max(1, shingle_size)
+        generator = np.random.RandomState(_SEED)
+        self._a = generator.randint(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        size = self.shingle_size
+        # A text shorter than one shingle is a single shingle
+        grams = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        return np.fromiter((zlib.crc32(g.encode()) % _PRIME for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingles(text)
+        return ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0).astype(np.uint32)
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard similarity estimated from two signatures"""
+    return float(np.mean(a == b))
+
+class Deduplicator:
+    """Persistent MinHash LSH index of the indexed chunks of every tenant"""
+
+    def __init__(self, path: str, mode: str = DEDUP_MODE, threshold: float = DEDUP_THRESHOLD,
+                 num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"DEDUP_MODE must be one of {', '.join(DEDUP_MODES)}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _settings(self) -> str:
+        return json.dumps({"num_perm": self.hasher.num_perm, "shingle_size": self.hasher.shingle_size,
+                           "bands": self.bands, "rows": self.rows, "seed": _SEED})
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Autocommit; filter() opens its own transaction
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(
+                "CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY CHECK (id = 0), value TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS signatures ("
+                "id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, signature BLOB NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS signatures_tenant ON signatures (tenant_id);"
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "tenant_id TEXT NOT NULL, band INTEGER NOT NULL, bucket INTEGER NOT NULL, id TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (tenant_id, band, bucket);"
+                "CREATE INDEX IF NOT EXISTS buckets_id ON buckets (id);"
+                "CREATE TABLE IF NOT EXISTS duplicates ("
+                "id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, canonical_id TEXT NOT NULL, "
+                "similarity REAL NOT NULL, metadata TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical_id);"
+                "CREATE INDEX IF NOT EXISTS duplicates_tenant ON duplicates (tenant_id);"
+            )
+            stored = self._connection.execute("SELECT value FROM settings").fetchone()
+            if stored and stored[0] != self._settings():
+                # Signatures of other MinHash settings cannot be compared with new ones
+                logger.warning(f"Dedup settings changed; starting a new index in {self.path}")
+                self._clear(self._connection)
+            self._connection.execute("INSERT OR REPLACE INTO settings VALUES (0, ?)", (self._settings(),))
+        return self._connection
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        keys = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8)
+            keys.append(int.from_bytes(digest.digest(), "big", signed=True))
+        return keys
+
+    def _find_duplicate(self, connection: sqlite3.Connection, tenant_id: str, point_id: str,
+                        signature: np.ndarray, keys: List[int]) -> Optional[Tuple[str, float]]:
+        """(canonical id, similarity) of the most similar indexed chunk at or above the threshold"""
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(row[0] for row in connection.execute(
+                "SELECT id FROM buckets WHERE tenant_id = ? AND band = ? AND bucket = ?", (tenant_id, band, key)
+            ))
+        # Re-indexing a chunk under its own id (a resumed bulk ingest, a retry) is not a duplicate
+        candidates.discard(point_id)
+        best = None
+        for candidate in candidates:
+            row = connection.execute("SELECT signature FROM signatures WHERE id = ?", (candidate,)).fetchone()
+            score = similarity(signature, np.frombuffer(row[0], dtype=np.uint32))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (candidate, score)
+        return best
+
+    def filter(self, documents: List[Document], tenant_id: str,
+               ids: List[str]) -> Tuple[List[Document], List[str], int]:
+        """Drop the near-duplicates among documents, of each other or of indexed chunks, and add the
+        rest to the index; returns the kept documents, their ids and how many were dropped.
+
+        The kept chunks count as indexed from here on, so concurrent uploads (also from other
+        processes) do not both keep the same text; call forget() if indexing them fails.
+        """
+        if not self.enabled or not documents:
+            return documents, ids, 0
+        signatures = [self.hasher.signature(doc.page_content) for doc in documents]
+        kept_documents, kept_ids, links = [], [], []
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for doc, point_id, signature in zip(documents, ids, signatures):
+                    keys = self._band_keys(signature)
+                    duplicate = self._find_duplicate(connection, tenant_id, point_id, signature, keys)
+                    if duplicate:
+                        links.append((point_id, tenant_id, duplicate[0], duplicate[1], json.dumps(doc.metadata)))
+                        continue
+                    connection.execute("DELETE FROM buckets WHERE id = ?", (point_id,))
+                    connection.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?, ?)",
+                                       (point_id, tenant_id, signature.tobytes()))
+                    connection.executemany("INSERT INTO buckets VALUES (?, ?, ?, ?)",
+                                           [(tenant_id, band, key, point_id) for band, key in enumerate(keys)])
+                    kept_documents.append(doc)
+                    kept_ids.append(point_id)
+                if self.mode == "link":
+                    connection.executemany("INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?)", links)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return kept_documents, kept_ids, len(documents) - len(kept_documents)
+
+    def forget(self, ids: Iterable[str]):
+        """Remove chunks that were kept by filter() but could not be indexed, or were deleted since"""
+        if not self.enabled:
+            return
+        rows = [(point_id,) for point_id in ids]
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("DELETE FROM buckets WHERE id = ?", rows)
+            connection.executemany("DELETE FROM signatures WHERE id = ?", rows)
+            connection.executemany("DELETE FROM duplicates WHERE canonical_id = ?", rows)
+            connection.executemany("DELETE FROM duplicates WHERE id = ?", rows)
+            connection.execute("COMMIT")
+
+    def duplicates_of(self, canonical_id: str) -> List[dict]:
+        """Chunks linked to canonical_id in link mode: their id, similarity and metadata"""
+        if not self.exists():
+            return []
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, similarity, metadata FROM duplicates WHERE canonical_id = ?", (canonical_id,)
+            ).fetchall()
+        return [{"id": pid, "similarity": score, "metadata": json.loads(metadata)} for pid, score, metadata in rows]
+
+    def exists(self) -> bool:
+        return self._connection is not None or os.path.exists(self.path)
+
+    def delete_tenant(self, tenant_id: str):
+        if not self.exists():
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            for table in ("buckets", "signatures", "duplicates"):
+                connection.execute(f"DELETE FROM {table} WHERE tenant_id = ?", (tenant_id,))
+            connection.execute("COMMIT")
+
+    def _clear(self, connection: sqlite3.Connection):
+        connection.execute("BEGIN IMMEDIATE")
+        for table in ("buckets", "signatures", "duplicates"):
+            connection.execute(f"DELETE FROM {table}")
+        connection.execute("COMMIT")
+
+    def clear(self):
+        if not self.exists():
+            return
+        with self._lock:
+            self._clear(self._connect())
+
+    def backup(self, path: str):
+        """Write a consistent copy of the index to path"""
+        with self._lock:
+            target = sqlite3.connect(path)
+            try:
+                self._connect().backup(target)
+            finally:
+                target.close()
+
+    def restore(self, path: str):
+        """Replace the contents of the index with a copy made by backup"""
+        with self._lock:
+            source = sqlite3.connect(path)
+            try:
+                source.backup(self._connect())
+            finally:
+                source.close()
+
+deduplicator = Deduplicator(DEDUP_PATH)
@@ -0,0 +1,381 @@
+import os
+import json
+import mmap
+import fcntl
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import zlib
+from typing import Dict, Iterable, List, Tuple
+from langchain_core.documents import Document
+
+from .config import DOCSTORE_BACKEND, DOCSTORE_PATH, DOCSTORE_DIR, DOCSTORE_SEGMENT_BYTES
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec of a stored record, kept per record so a store survives zstandard being (un)installed
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+def _compress(data: bytes) -> Tuple[int, bytes]:
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=3).compress(data)
+    return CODEC_ZLIB, zlib.compress(data, 6)
+
+def _decompress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Docstore record is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def _encode_record(doc: Document) -> Tuple[int, bytes]:
+    return _compress(json.dumps({"t": doc.page_content, "m": doc.metadata}).encode())
+
+def _decode_record(codec: int, data: bytes) -> Document:
+    record = json.loads(_decompress(codec, data))
+    return Document(page_content=record["t"], metadata=record["m"])
+
+class DocStore:
+    """Documents by id (parent chunks, chunk text) in a local SQLite database.
+
+    Each record (text and metadata) is compressed on its own, with the same codecs
+    as SegmentDocStore. Stores written before records were compressed kept them
+    uncompressed in a "parents" table; they are migrated when opened or restored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened on first use, so deployments that keep everything in Qdrant never create the file
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._create_tables(self._connection)
+        return self._connection
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, codec INTEGER NOT NULL, data BLOB NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS records_tenant ON records (tenant_id)")
+        legacy = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'parents'"
+        if connection.execute(legacy).fetchone():
+            with connection:
+                # Other workers may open the store at the same time; one of them migrates it
+                connection.execute("BEGIN IMMEDIATE")
+                if connection.execute(legacy).fetchone():
+                    rows = connection.execute("SELECT id, tenant_id, text, metadata FROM parents").fetchall()
+                    connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", [
+                        (doc_id, tenant, *_encode_record(Document(page_content=text, metadata=json.loads(metadata))))
+                        for doc_id, tenant, text, metadata in rows
+                    ])
+                    connection.execute("DROP TABLE parents")
+
+    def exists(self) -> bool:
+        return self._connection is not None or os.path.exists(self.path)
+
+    def put_many(self, documents: Iterable[Tuple[str, str, Document]]):
+        """Store (id, tenant_id, document) triples, replacing existing ids"""
+        rows = [(doc_id, tenant, *_encode_record(doc)) for doc_id, tenant, doc in documents]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", rows)
+
+    def get_many(self, ids: List[str]) -> Dict[str, Document]:
+        """Fetch documents by id in one query; missing ids are left out"""
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT id, codec, data FROM records WHERE id IN ({placeholders})", list(ids)
+            ).fetchall()
+        return {doc_id: _decode_record(codec, data) for doc_id, codec, data in rows}
+
+    def delete_tenant(self, tenant_id: str):
+        if not self.exists():
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM records WHERE tenant_id = ?", (tenant_id,))
+
+    def delete_many(self, ids: List[str]):
+        if not ids or not self.exists():
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany("DELETE FROM records WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def promote_staged(self, prefix: str):
+        """Replace all records by the ones staged under prefix; unstaged records are deleted"""
+        if not self.exists():
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                _promote_staged(connection, "records", prefix)
+
+    def drop_staged(self, prefix: str):
+        """Delete the records staged under prefix"""
+        if not self.exists():
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM records WHERE substr(id, 1, ?) = ?", (len(prefix), prefix))
+
+    def clear(self):
+        if not self.exists():
+            return
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM records")
+
+    def backup(self, path: str):
+        """Write a consistent copy of the store to path"""
+        with self._lock:
+            target = sqlite3.connect(path)
+            try:
+                self._connect().backup(target)
+            finally:
+                target.close()
+
+    def restore(self, path: str):
+        """Replace the contents of the store with a copy made by backup (of this or an older version)"""
+        with self._lock:
+            source = sqlite3.connect(path)
+            try:
+                source.backup(self._connect())
+            finally:
+                source.close()
+            self._create_tables(self._connection)
+
+def _promote_staged(connection: sqlite3.Connection, table: str, prefix: str):
+    staged = "substr(id, 1, ?) = ?"
+    # Whole namespace swap: a record the new version did not stage belongs to a chunk it no longer has
+    connection.execute(f"DELETE FROM {table} WHERE NOT {staged}", (len(prefix), prefix))
+    connection.execute(f"UPDATE {table} SET id = substr(id, ?) WHERE {staged}", (len(prefix) + 1, len(prefix), prefix))
+
+class SegmentDocStore:
+    """Documents by id in append-only compressed segment files, read through mmap.
+
+    Each record is compressed on its own (zstd when installed, zlib otherwise) and
+    appended to the current segment; an SQLite index maps ids to (segment, offset,
+    length). Replaced and deleted records stay in their segment until the store
+    is cleared.
+
+    Several processes (API workers, bulk_ingest) may write at once: the active
+    segment is kept in the index, and writers append under the index's write
+    lock and an flock on the segment, taking offsets from the file itself.
+    Segment numbers are never reused, so maps other processes hold of cleared
+    segments are never read again.
+    """
+
+    INDEX_NAME = "index.sqlite"
+
+    def __init__(self, directory: str, max_segment_bytes: int = 64 << 20):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self._index = None
+        # Read-only maps per segment; remapped when the active segment has grown
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:05d}.zst")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._index is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._index = sqlite3.connect(os.path.join(self.directory, self.INDEX_NAME), check_same_thread=False)
+            self._index.execute("PRAGMA journal_mode=WAL")
+            self._index.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, segment INTEGER NOT NULL, "
+                "offset INTEGER NOT NULL, length INTEGER NOT NULL, codec INTEGER NOT NULL)"
+            )
+            self._index.execute("CREATE INDEX IF NOT EXISTS records_tenant ON records (tenant_id)")
+            # The segment new records are appended to, shared by every writing process
+            self._index.execute(
+                "CREATE TABLE IF NOT EXISTS active (id INTEGER PRIMARY KEY CHECK (id = 0), segment INTEGER NOT NULL)"
+            )
+            with self._index:
+                self._index.execute(
+                    "INSERT OR IGNORE INTO active SELECT 0, COALESCE(MAX(segment), 0) FROM records"
+                )
+        return self._index
+
+    def _active_segment(self, index: sqlite3.Connection) -> int:
+        """The segment to append to, moving on to a new one when it is full; the caller holds the write lock"""
+        segment = index.execute("SELECT segment FROM active").fetchone()[0]
+        path = self._segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) >= self.max_segment_bytes:
+            segment += 1
+            index.execute("UPDATE active SET segment = ?", (segment,))
+        return segment
+
+    def _close_files(self):
+        for segment_map in self._maps.values():
+            segment_map.close()
+        self._maps.clear()
+
+    def _read(self, segment: int, offset: int, length: int) -> bytes:
+        segment_map = self._maps.get(segment)
+        # len() is the mapped length; size() would be the file's, which grows as records are appended
+        if segment_map is None or len(segment_map) < offset + length:
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._segment_path(segment), "rb") as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = segment_map
+        return segment_map[offset:offset + length]
+
+    def exists(self) -> bool:
+        return self._index is not None or os.path.exists(os.path.join(self.directory, self.INDEX_NAME))
+
+    def put_many(self, documents: Iterable[Tuple[str, str, Document]]):
+        """Store (id, tenant_id, document) triples, replacing existing ids"""
+        records = [(doc_id, tenant_id, *_encode_record(doc)) for doc_id, tenant_id, doc in documents]
+        with self._lock:
+            index = self._connect()
+            # Other processes append too: hold the index's write lock while choosing the
+            # segment and writing, and take offsets from the file rather than our own count
+            index.execute("BEGIN IMMEDIATE")
+            try:
+                segment = self._active_segment(index)
+                rows = []
+                with open(self._segment_path(segment), "ab") as writer:
+                    fcntl.flock(writer.fileno(), fcntl.LOCK_EX)
+                    offset = writer.seek(0, os.SEEK_END)
+                    for doc_id, tenant_id, codec, data in records:
+                        writer.write(data)
+                        rows.append((doc_id, tenant_id, segment, offset, len(data), codec))
+                        offset += len(data)
+                    # Records must be on disk before the index points at them
+                    writer.flush()
+                index.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)", rows)
+                index.execute("COMMIT")
+            except BaseException:
+                index.execute("ROLLBACK")
+                raise
+
+    def get_many(self, ids: List[str]) -> Dict[str, Document]:
+        """Fetch documents by id with one index query; missing ids are left out"""
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        documents = {}
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT id, segment, offset, length, codec FROM records WHERE id IN ({placeholders})", list(ids)
+            ).fetchall()
+            for doc_id, segment, offset, length, codec in rows:
+                documents[doc_id] = _decode_record(codec, self._read(segment, offset, length))
+        return documents
+
+    def delete_tenant(self, tenant_id: str):
+        if not self.exists():
+            return
+        with self._lock:
+            index = self._connect()
+            with index:
+                index.execute("DELETE FROM records WHERE tenant_id = ?", (tenant_id,))
+
+    def delete_many(self, ids: List[str]):
+        """Delete records by id; their bytes stay in the segments until a clear"""
+        if not ids or not self.exists():
+            return
+        with self._lock:
+            index = self._connect()
+            with index:
+                index.executemany("DELETE FROM records WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def promote_staged(self, prefix: str):
+        """Replace all records by the ones staged under prefix; unstaged records are deleted,
+        their bytes stay in the segments until a clear"""
+        if not self.exists():
+            return
+        with self._lock:
+            index = self._connect()
+            with index:
+                _promote_staged(index, "records", prefix)
+
+    def drop_staged(self, prefix: str):
+        """Delete the records staged under prefix; their bytes stay in the segments until a clear"""
+        if not self.exists():
+            return
+        with self._lock:
+            index = self._connect()
+            with index:
+                index.execute("DELETE FROM records WHERE substr(id, 1, ?) = ?", (len(prefix), prefix))
+
+    def clear(self):
+        if not self.exists():
+            return
+        with self._lock:
+            index = self._connect()
+            with index:
+                index.execute("DELETE FROM records")
+                # A fresh segment number: other processes may still map the removed files
+                index.execute("UPDATE active SET segment = segment + 1")
+                self._close_files()
+                for name in os.listdir(self.directory):
+                    if name.startswith("segment-"):
+                        os.remove(os.path.join(self.directory, name))
+
+    def backup(self, path: str):
+        """Write a consistent copy of the store to path (a tar of the index and segments)"""
+        with self._lock:
+            index = self._connect()
+            with tempfile.TemporaryDirectory() as workdir:
+                index_copy = os.path.join(workdir, self.INDEX_NAME)
+                target = sqlite3.connect(index_copy)
+                try:
+                    index.backup(target)
+                finally:
+                    target.close()
+                with tarfile.open(path, "w") as bundle:
+                    bundle.add(index_copy, arcname=self.INDEX_NAME)
+                    for name in sorted(os.listdir(self.directory)):
+                        if name.startswith("segment-"):
+                            bundle.add(os.path.join(self.directory, name), arcname=name)
+
+    def restore(self, path: str):
+        """Replace the contents of the store with a copy made by backup"""
+        with self._lock:
+            self._close_files()
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+            if os.path.isdir(self.directory):
+                shutil.rmtree(self.directory)
+            os.makedirs(self.directory)
+            with tarfile.open(path, "r") as bundle:
+                for member in bundle.getmembers():
+                    name = os.path.basename(member.name)
+                    if member.isfile() and (name == self.INDEX_NAME or name.startswith("segment-")):
+                        with bundle.extractfile(member) as source, open(os.path.join(self.directory, name), "wb") as target:
+                            shutil.copyfileobj(source, target, 1 << 20)
+            self._connect()
+
+def create_docstore(backend: str = DOCSTORE_BACKEND):
+    """Docstore for the configured backend: "sqlite" or "segment" (compressed segment files)"""
+    if backend == "segment":
+        return SegmentDocStore(DOCSTORE_DIR, DOCSTORE_SEGMENT_BYTES)
+    return DocStore(DOCSTORE_PATH)
+
+docstore = create_docstore()
@@ -3,14 +3,35 @@ from typing import List
 import PyPDF2
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from .config import CHUNK_SIZE, CHUNK_OVERLAP
+from .config import (
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    PARENT_CHILD_CHUNKING,
+    PARENT_CHUNK_SIZE,
+    PARENT_CHUNK_OVERLAP,
+    CHILD_CHUNK_SIZE,
+    CHILD_CHUNK_OVERLAP
+)
 
-# Initialize text splitter
+# Initialize text splitter; in parent-child mode it produces the parent windows
 text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP
+    chunk_size=PARENT_CHUNK_SIZE if PARENT_CHILD_CHUNKING else CHUNK_SIZE,
+    chunk_overlap=PARENT_CHUNK_OVERLAP if PARENT_CHILD_CHUNKING else CHUNK_OVERLAP
+)
+
+# Splits a parent window into the child chunks that are embedded
+child_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=CHILD_CHUNK_SIZE,
+    chunk_overlap=CHILD_CHUNK_OVERLAP
 )
 
+def split_into_children(parent: Document, parent_id: str) -> List[Document]:
+    """Split a parent chunk into child chunks that point back to it"""
+    return [
+        Document(page_content=chunk, metadata={**parent.metadata, "parent_id": parent_id})
+        for chunk in child_splitter.split_text(parent.page_content)
+    ]
+
 def process_text_document(content: str, metadata: dict = None) -> List[Document]:
     """Process a text document into chunks"""
     if metadata is None:
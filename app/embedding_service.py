@@ -0,0 +1,147 @@
+"""
+Shared embedding service.
+
+One process owns the dense and sparse models and serves every API worker over a
+Unix socket, so the models are loaded (and their memory paid for) once per host
+rather than once per worker. Concurrent requests are micro-batched per operation.
+
+    EMBEDDING_SERVICE_SOCKET=/tmp/embeddings.sock python -m app.embedding_service
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from .config import EMBEDDING_SERVICE_SOCKET, EMBED_BATCH_MAX_WAIT_MS, EMBED_BATCH_MAX_TEXTS
+from .embeddings import HEADER_LENGTH, LocalEmbedder, encode_embeddings
+from .logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("embed_documents", "embed_queries", "embed_sparse_queries")
+
+class EmbeddingService:
+    """Micro-batches embedding requests and runs them on a single model thread"""
+
+    def __init__(self, embedder, max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS, max_texts: int = EMBED_BATCH_MAX_TEXTS):
+        self.embedder = embedder
+        self.max_wait = max_wait_ms / 1000
+        self.max_texts = max(1, max_texts)
+        # The models use all cores themselves; one thread keeps batches from competing
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self.queues: Dict[str, asyncio.Queue] = {}
+
+    async def embed(self, op: str, texts: List[str]):
+        """Queue texts for the next batch of op and wait for their embeddings"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[op].put((texts, future))
+        return await future
+
+    async def _batcher(self, op: str):
+        queue = self.queues[op]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_texts:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            await self._run_batch(op, batch)
+
+    async def _run_batch(self, op: str, batch: list):
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        start = time.monotonic()
+        try:
+            dense, sparse = await asyncio.get_running_loop().run_in_executor(
+                self.executor, getattr(self.embedder, op), texts
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        logger.debug(f"{op}: {len(texts)} texts from {len(batch)} requests in {time.monotonic() - start:.3f}s")
+
+        offset = 0
+        for item_texts, future in batch:
+            end = offset + len(item_texts)
+            if not future.done():
+                future.set_result((dense[offset:end], sparse[offset:end]))
+            offset = end
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve requests from one client connection until it closes"""
+        try:
+            while True:
+                try:
+                    (length,) = HEADER_LENGTH.unpack(await reader.readexactly(HEADER_LENGTH.size))
+                except asyncio.IncompleteReadError:
+                    return
+                request = json.loads(await reader.readexactly(length))
+                op = request.get("op")
+                try:
+                    if op not in OPERATIONS:
+                        raise ValueError(f"Unknown operation: {op}")
+                    dense, sparse = await self.embed(op, request.get("texts", []))
+                    header, body = encode_embeddings(dense, sparse)
+                except Exception as e:
+                    header, body = {"error": str(e)}, b""
+                self._write(writer, header, body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _write(self, writer: asyncio.StreamWriter, header: dict, body: bytes):
+        payload = json.dumps(header).encode()
+        writer.write(HEADER_LENGTH.pack(len(payload)) + payload)
+        if body:
+            writer.write(body)
+
+    async def serve(self, socket_path: str):
+        for op in OPERATIONS:
+            self.queues[op] = asyncio.Queue()
+        batchers = [asyncio.create_task(self._batcher(op)) for op in OPERATIONS]
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        logger.info(f"Embedding service listening on {socket_path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in batchers:
+                task.cancel()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding service for API workers")
+    parser.add_argument("--socket", default=EMBEDDING_SERVICE_SOCKET or "/tmp/embeddings.sock")
+    parser.add_argument("--max-wait-ms", type=float, default=EMBED_BATCH_MAX_WAIT_MS)
+    parser.add_argument("--max-texts", type=int, default=EMBED_BATCH_MAX_TEXTS)
+    args = parser.parse_args()
+
+    configure_logging()
+    service = EmbeddingService(LocalEmbedder(), args.max_wait_ms, args.max_texts)
+    try:
+        asyncio.run(service.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
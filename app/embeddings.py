@@ -0,0 +1,226 @@
+import json
+import queue
+import socket
+import struct
+from typing import List, Tuple
+import numpy as np
+from fastapi import HTTPException
+from qdrant_client.models import SparseVector
+
+from .config import (
+    DENSE_MODEL_NAME,
+    SPARSE_MODEL_NAME,
+    DENSE_MODEL_FILE,
+    DENSE_MODEL_DIM,
+    DENSE_MODEL_POOLING,
+    RERANK_MODEL_NAME,
+    EMBED_THREADS,
+    EMBED_PARALLEL,
+    EMBEDDING_SERVICE_SOCKET,
+    EMBED_SERVICE_TIMEOUT
+)
+
+# Wire format shared with app.embedding_service: every message is a 4-byte big-endian
+# header length, a JSON header, then (responses only) a binary body of
+#   dense float32[n, dim] | sparse indices int32[...] | sparse values float32[...]
+HEADER_LENGTH = struct.Struct(">I")
+
+def send_message(sock: socket.socket, header: dict, body: bytes = b""):
+    payload = json.dumps(header).encode()
+    sock.sendall(HEADER_LENGTH.pack(len(payload)) + payload)
+    if body:
+        sock.sendall(body)
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Embedding service closed the connection")
+        received += count
+    return buffer
+
+def recv_message(sock: socket.socket) -> Tuple[dict, bytearray]:
+    (length,) = HEADER_LENGTH.unpack(_recv_exact(sock, HEADER_LENGTH.size))
+    header = json.loads(_recv_exact(sock, length))
+    body = _recv_exact(sock, header.get("body_bytes", 0))
+    return header, body
+
+def encode_embeddings(dense: List[np.ndarray], sparse: list) -> Tuple[dict, bytes]:
+    """Pack dense and sparse embeddings into a response header and binary body"""
+    dense_matrix = np.ascontiguousarray(np.stack(dense), dtype=np.float32) if dense else np.zeros((0, 0), np.float32)
+    indices = np.concatenate([s.indices for s in sparse]).astype(np.int32) if sparse else np.zeros(0, np.int32)
+    values = np.concatenate([s.values for s in sparse]).astype(np.float32) if sparse else np.zeros(0, np.float32)
+    body = dense_matrix.tobytes() + indices.tobytes() + values.tobytes()
+    header = {
+        "dense_shape": list(dense_matrix.shape),
+        "sparse_lengths": [len(s.indices) for s in sparse],
+        "body_bytes": len(body),
+    }
+    return header, body
+
+def decode_embeddings(header: dict, body: bytearray) -> Tuple[List[np.ndarray], List[SparseVector]]:
+    """Unpack a response; dense vectors are zero-copy views into the received buffer"""
+    rows, dim = header["dense_shape"]
+    dense_bytes = rows * dim * 4
+    dense_matrix = np.frombuffer(body, dtype=np.float32, count=rows * dim).reshape(rows, dim)
+    lengths = header["sparse_lengths"]
+    total = sum(lengths)
+    indices = np.frombuffer(body, dtype=np.int32, count=total, offset=dense_bytes)
+    values = np.frombuffer(body, dtype=np.float32, count=total, offset=dense_bytes + total * 4)
+
+    sparse = []
+    start = 0
+    for length in lengths:
+        sparse.append(SparseVector(
+            indices=indices[start:start + length].tolist(),
+            values=values[start:start + length].tolist()
+        ))
+        start += length
+    return list(dense_matrix), sparse
+
+def _model_description(model_class, model_name: str) -> dict:
+    """fastembed's description of a model (dim, requires_idf, ...), or {} for models it does not list"""
+    for description in model_class.list_supported_models():
+        if description["model"].lower() == model_name.lower():
+            return description
+    return {}
+
+def register_dense_model():
+    """Make a DENSE_MODEL_FILE model (e.g. an int8-quantized ONNX export) known to fastembed"""
+    from fastembed import TextEmbedding
+    from fastembed.common.model_description import ModelSource, PoolingType
+    if not DENSE_MODEL_FILE or _model_description(TextEmbedding, DENSE_MODEL_NAME):
+        return
+    if not DENSE_MODEL_DIM:
+        raise ValueError("DENSE_MODEL_DIM is required with DENSE_MODEL_FILE")
+    TextEmbedding.add_custom_model(
+        model=DENSE_MODEL_NAME,
+        pooling=PoolingType.CLS if DENSE_MODEL_POOLING == "cls" else PoolingType.MEAN,
+        normalization=True,
+        sources=ModelSource(hf=DENSE_MODEL_NAME),
+        dim=DENSE_MODEL_DIM,
+        model_file=DENSE_MODEL_FILE,
+    )
+
+def dense_dimension() -> int:
+    """Size of the dense vectors: DENSE_MODEL_DIM, or the dimension fastembed lists for DENSE_MODEL_NAME"""
+    if DENSE_MODEL_DIM:
+        return DENSE_MODEL_DIM
+    from fastembed import TextEmbedding
+    dim = _model_description(TextEmbedding, DENSE_MODEL_NAME).get("dim")
+    if not dim:
+        raise ValueError(f"Unknown dense model {DENSE_MODEL_NAME}; set DENSE_MODEL_DIM")
+    return dim
+
+def sparse_requires_idf() -> bool:
+    """Whether the sparse model's vectors need Qdrant's IDF modifier (miniCOIL, BM25, BM42 do, SPLADE does not)"""
+    from fastembed import SparseTextEmbedding
+    return _model_description(SparseTextEmbedding, SPARSE_MODEL_NAME).get("requires_idf", True) is True
+
+class LocalEmbedder:
+    """Runs the fastembed dense and sparse models in this process"""
+
+    def __init__(self):
+        from fastembed import TextEmbedding, SparseTextEmbedding
+        register_dense_model()
+        self.dense_model = TextEmbedding(DENSE_MODEL_NAME, threads=EMBED_THREADS)
+        self.sparse_model = SparseTextEmbedding(model_name=SPARSE_MODEL_NAME, threads=EMBED_THREADS)
+        # fastembed only fans out batches larger than its batch size, so small uploads stay in-process
+        self.parallel = EMBED_PARALLEL if EMBED_PARALLEL > 1 else None
+
+    def _sparse(self, embeddings) -> List[SparseVector]:
+        return [SparseVector(**embedding.as_object()) for embedding in embeddings]
+
+    def embed_documents(self, texts: List[str]) -> Tuple[List[np.ndarray], List[SparseVector]]:
+        dense = list(self.dense_model.embed(texts, parallel=self.parallel))
+        sparse = self._sparse(self.sparse_model.embed(texts, parallel=self.parallel))
+        return dense, sparse
+
+    def embed_queries(self, texts: List[str]) -> Tuple[List[np.ndarray], List[SparseVector]]:
+        dense = list(self.dense_model.query_embed(texts))
+        sparse = self._sparse(self.sparse_model.query_embed(texts))
+        return dense, sparse
+
+    def embed_sparse_queries(self, texts: List[str]) -> Tuple[List[np.ndarray], List[SparseVector]]:
+        # Sparse-only queries (fast retrieval) never run the dense model
+        return [], self._sparse(self.sparse_model.query_embed(texts))
+
+    def embed_query(self, text: str) -> Tuple[np.ndarray, SparseVector]:
+        dense, sparse = self.embed_queries([text])
+        return dense[0], sparse[0]
+
+    def embed_sparse_query(self, text: str) -> SparseVector:
+        return self.embed_sparse_queries([text])[1][0]
+
+class RemoteEmbedder:
+    """Thin client of the shared embedding service (python -m app.embedding_service)"""
+
+    def __init__(self, socket_path: str, max_idle_connections: int = 8, timeout: float = EMBED_SERVICE_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_idle_connections)
+
+    def _connect(self) -> socket.socket:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # A hung service fails the request instead of holding its thread and embedding slot
+            sock.settimeout(self.timeout or None)
+            sock.connect(self.socket_path)
+            return sock
+
+    def _request(self, op: str, texts: List[str]):
+        sock = self._connect()
+        try:
+            send_message(sock, {"op": op, "texts": texts})
+            header, body = recv_message(sock)
+        except socket.timeout:
+            # The reply may still arrive later, so the connection cannot be reused
+            sock.close()
+            raise HTTPException(status_code=503, detail=f"Embedding service did not answer within {self.timeout}s")
+        except Exception:
+            sock.close()
+            raise
+        try:
+            self._idle.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+        if "error" in header:
+            raise RuntimeError(f"Embedding service error: {header['error']}")
+        return decode_embeddings(header, body)
+
+    def embed_documents(self, texts: List[str]) -> Tuple[List[np.ndarray], List[SparseVector]]:
+        return self._request("embed_documents", texts)
+
+    def embed_queries(self, texts: List[str]) -> Tuple[List[np.ndarray], List[SparseVector]]:
+        return self._request("embed_queries", texts)
+
+    def embed_sparse_queries(self, texts: List[str]) -> Tuple[List[np.ndarray], List[SparseVector]]:
+        return self._request("embed_sparse_queries", texts)
+
+    def embed_query(self, text: str) -> Tuple[np.ndarray, SparseVector]:
+        dense, sparse = self.embed_queries([text])
+        return dense[0], sparse[0]
+
+    def embed_sparse_query(self, text: str) -> SparseVector:
+        return self.embed_sparse_queries([text])[1][0]
+
+class LocalReranker:
+    """Cross-encoder scoring (query, passage) pairs, used by deep retrieval"""
+
+    def __init__(self):
+        from fastembed.rerank.cross_encoder import TextCrossEncoder
+        self.model = TextCrossEncoder(RERANK_MODEL_NAME, threads=EMBED_THREADS)
+
+    def rerank(self, query: str, texts: List[str]) -> List[float]:
+        return [float(score) for score in self.model.rerank(query, texts)]
+
+def get_embedder():
+    """Embedding backend: the shared service when configured, otherwise in-process models"""
+    if EMBEDDING_SERVICE_SOCKET:
+        return RemoteEmbedder(EMBEDDING_SERVICE_SOCKET)
+    return LocalEmbedder()
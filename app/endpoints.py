@@ -1,23 +1,77 @@
 import os
-from typing import List
+import json
+import asyncio
+import shutil
+import tempfile
+import threading
+import contextvars
+from datetime import datetime, timezone
+from typing import List, Optional
 from fastapi import HTTPException, UploadFile, File
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from langchain_core.messages import HumanMessage
 from .models import QueryRequest, QueryResponse, DocumentRequest
-from .config import GROQ_MODEL_CONFIGS, QDRANT_URL, get_ollama_models, OLLAMA_URL
+from .config import (
+    GROQ_MODEL_CONFIGS,
+    FAKE_MODEL_CONFIGS,
+    DEFAULT_PROVIDER,
+    AUTO_MODEL,
+    MODEL_TIERS,
+    FALLBACK_PROVIDER,
+    FALLBACK_MODEL,
+    QDRANT_MODE,
+    QDRANT_URL,
+    get_ollama_models,
+    FALLBACK_OLLAMA_MODEL,
+    OLLAMA_URL,
+    QUERY_COALESCING,
+    DEFAULT_RETRIEVAL_LIMIT,
+    DEFAULT_TENANT,
+    DEFAULT_SOURCES_MODE,
+    DEFAULT_RETRIEVAL_MODE,
+    SOURCE_SNIPPET_CHARS,
+    SNAPSHOT_DIR
+)
 from .vector_store import (
-    index_documents_hybrid, 
-    hybrid_search, 
+    deduplicate,
+    aindex_documents_hybrid, 
+    ahybrid_search, 
+    payload_selector,
+    resolve_retrieval_mode,
     clear_collection, 
-    get_collection_info
+    get_collection_info,
+    get_corpus_version
 )
+from .snapshots import export_snapshot, import_snapshot, SnapshotMismatch
+from .reindex import reindexer
+from .coalescing import SingleFlight, StreamFlight, normalize_question
+from .metrics import metrics
+from .admission import AdmissionRejected, llm_limiter
+from .warmup import warmup_manager
+from .model_router import model_router
 from .document_processing import process_text_document, process_pdf_content
-from .graph import graph, extract_after_think
-from .llm_providers import default_llm
+from .graph import graph, extract_after_think, get_conversation_graph, delete_conversation_thread
+from .llm_providers import get_llm, publish_models
+
+try:
+    import orjson
+    def _ndjson_line(event: dict) -> bytes:
+        return orjson.dumps(event) + b"\n"
+except ImportError:
+    def _ndjson_line(event: dict) -> str:
+        return json.dumps(event) + "\n"
+
+# In-flight query registries used for request coalescing
+query_flight = SingleFlight()
+stream_flight = StreamFlight()
 
 async def health_check():
     """Health check endpoint"""
     try:
         # Test LLM connection
-        test_response = default_llm.invoke([{"role": "user", "content": "Hello"}])
+        test_response = get_llm().invoke([{"role": "user", "content": "Hello"}])
         
         # Test Qdrant connection and get collection info
         collection_info = get_collection_info()
@@ -25,7 +79,9 @@ async def health_check():
         return {
             "status": "healthy",
             "ollama_url": OLLAMA_URL,
-            "qdrant_url": QDRANT_URL,
+            "qdrant_url": QDRANT_URL if QDRANT_MODE == "remote" else None,
+            "qdrant_mode": QDRANT_MODE,
+            "default_provider": DEFAULT_PROVIDER,
             **collection_info
         }
     except Exception as e:
@@ -34,17 +90,27 @@ async def health_check():
             "error": str(e)
         }
 
+async def get_metrics():
+    """Expose in-process metrics (admission queues, latencies, model warm-up, model routing)"""
+    return {**metrics.snapshot(), "warmup": warmup_manager.status, "routing": model_router.status()}
+
 async def get_available_models():
     """Get available models from all providers"""
     # Dynamically fetch Ollama models
-    ollama_models = get_ollama_models()
+    ollama_models = await run_in_threadpool(get_ollama_models)
+    if ollama_models != [FALLBACK_OLLAMA_MODEL]:
+        # The fallback stands in for an unreachable server, it does not replace the known models
+        await run_in_threadpool(publish_models, ollama_models)
     
-    return {
+    models = {
         "ollama": ollama_models,
         "groq": GROQ_MODEL_CONFIGS
     }
+    if DEFAULT_PROVIDER == "fake":
+        models["fake"] = FAKE_MODEL_CONFIGS
+    return models
 
-async def upload_documents(documents: List[DocumentRequest]):
+async def upload_documents(documents: List[DocumentRequest], tenant_id: str = None):
     """Upload and index documents"""
     try:
         all_docs = []
@@ -52,17 +118,21 @@ async def upload_documents(documents: List[DocumentRequest]):
             docs = process_text_document(doc_req.content, doc_req.metadata)
             all_docs.extend(docs)
         
-        # Index documents
-        num_indexed = index_documents_hybrid(all_docs)
+        # Drop near-duplicate chunks, then index the rest
+        all_docs, ids, dropped = await run_in_threadpool(deduplicate, all_docs, tenant_id)
+        num_indexed = await aindex_documents_hybrid(all_docs, tenant_id=tenant_id, ids=ids) if all_docs else 0
         
         return {
             "message": f"Successfully indexed {num_indexed} document chunks",
-            "chunks_created": num_indexed
+            "chunks_created": num_indexed,
+            "duplicates_dropped": dropped
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def upload_pdfs(files: List[UploadFile] = File(...)):
+async def upload_pdfs(files: List[UploadFile] = File(...), tenant_id: str = None):
     """Upload and process PDF files"""
     try:
         all_docs = []
@@ -76,92 +146,394 @@ async def upload_pdfs(files: List[UploadFile] = File(...)):
             docs = process_pdf_content(content, file.filename)
             all_docs.extend(docs)
         
-        # Index all documents
-        num_indexed = index_documents_hybrid(all_docs)
+        # Drop near-duplicate chunks (e.g. pages repeated across versions), then index the rest
+        all_docs, ids, dropped = await run_in_threadpool(deduplicate, all_docs, tenant_id)
+        num_indexed = await aindex_documents_hybrid(all_docs, tenant_id=tenant_id, ids=ids) if all_docs else 0
         
         return {
             "message": f"Successfully processed {len(files)} PDF files and indexed {num_indexed} chunks",
             "files_processed": len(files),
-            "chunks_created": num_indexed
+            "chunks_created": num_indexed,
+            "duplicates_dropped": dropped
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _graph_input(request: QueryRequest) -> dict:
+    """Build the LangGraph input state for a query request"""
+    return {
+        "question": request.question,
+        "provider": request.provider or DEFAULT_PROVIDER,  # Use provider from request
+        "model_name": request.model_name,          # Use model from request
+        "limit": request.limit or DEFAULT_RETRIEVAL_LIMIT,
+        "tenant_id": request.tenant_id,
+        "retrieval_mode": request.retrieval_mode,
+        "latency_budget_ms": request.latency_budget_ms,
+        "context": [],         # Will be filled by search node
+        "scores": [],
+        "route": "rag",
+        "answer": "",          # Will be filled by generate node
+        "served_by": None,
+        "model_tier": None,
+        "include_reasoning": request.include_reasoning,
+        "max_reasoning_tokens": request.max_reasoning_tokens,
+        "reasoning": None,
+        "thought_process": None,
+        "messages": [HumanMessage(content=request.question)]
+    }
+
+def _thread_config(request: QueryRequest) -> dict:
+    """Checkpointer config selecting the conversation thread (namespaced by tenant)"""
+    return {"configurable": {"thread_id": f"{request.tenant_id or DEFAULT_TENANT}:{request.thread_id}"}}
+
+def _with_stop(config: dict, stop) -> dict:
+    """Graph config carrying a stop event; events are not serialized into checkpoint metadata"""
+    return {**config, "configurable": {**config["configurable"], "stop": stop}}
+
+async def _iterate_in_thread(make_iterator):
+    """Consume a blocking iterator in a worker thread, yielding its items asynchronously.
+
+    make_iterator gets a threading.Event that is set when the consumer stops early (client
+    disconnect); the thread then stops at the next item and closes the iterator.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    finished = object()
+    stop = threading.Event()
+    
+    def run():
+        iterator = make_iterator(stop)
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(items.put_nowait, item)
+            else:
+                loop.call_soon_threadsafe(items.put_nowait, finished)
+        except Exception as e:
+            if not stop.is_set():
+                loop.call_soon_threadsafe(items.put_nowait, e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+    
+    loop.run_in_executor(None, contextvars.copy_context().run, run)
+    try:
+        while True:
+            item = await items.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def _query_key(request: QueryRequest) -> tuple:
+    """Coalescing key: requests with equal keys get the same answer"""
+    return (
+        normalize_question(request.question),
+        request.provider or DEFAULT_PROVIDER,
+        request.model_name,
+        request.limit or DEFAULT_RETRIEVAL_LIMIT,
+        request.tenant_id or DEFAULT_TENANT,
+        request.retrieval_mode or DEFAULT_RETRIEVAL_MODE,
+        request.include_reasoning is not False,
+        request.max_reasoning_tokens,
+        # The budget decides hedging and fallback, and so who answers
+        request.latency_budget_ms,
+        get_corpus_version(),
+    )
+
+def _format_source(doc, sources_mode: str) -> dict:
+    """A retrieved chunk as returned to clients, truncated in snippet mode"""
+    content = doc.page_content
+    if sources_mode == "snippet" and len(content) > SOURCE_SNIPPET_CHARS:
+        content = content[:SOURCE_SNIPPET_CHARS] + "..."
+    return {"page_content": content, "metadata": doc.metadata}
+
+def _build_query_response(response: dict, thread_id: str = None, sources_mode: str = None) -> QueryResponse:
+    """Convert the final graph state into a QueryResponse"""
+    answer = response.get("answer", "No answer generated")
+    sources_mode = sources_mode or DEFAULT_SOURCES_MODE
+    
+    # Get sources from context
+    sources = []
+    if "context" in response and sources_mode != "none":
+        scores = response.get("scores") or [None] * len(response["context"])
+        sources = [
+            {**_format_source(doc, sources_mode), "score": score}
+            for doc, score in zip(response["context"], scores)
+        ]
+    
+    return QueryResponse(
+        answer=answer,
+        sources=sources,
+        reasoning=response.get("reasoning"),
+        thought_process=response.get("thought_process"),
+        served_by=response.get("served_by"),
+        model_tier=response.get("model_tier"),
+        route=response.get("route"),
+        retrieval_mode=response.get("retrieval_mode"),
+        thread_id=thread_id
+    )
+
 async def query_documents(request: QueryRequest) -> QueryResponse:
     """Query documents using hybrid search and LLM"""
     try:
-        # Use LangGraph to process the query
-        response = graph.invoke({
-            "question": request.question,
-            "provider": request.provider or "ollama",  # Use provider from request
-            "model_name": request.model_name,          # Use model from request
-            "context": [],         # Will be filled by search node
-            "answer": ""           # Will be filled by generate node
-        })
-        
-        answer = response.get("answer", "No answer generated")
+        # Conversations depend on their own history, so they are never coalesced.
+        # The SQLite checkpointer is synchronous, so the graph runs in a worker thread
+        if request.thread_id:
+            response = await run_in_threadpool(
+                get_conversation_graph().invoke,
+                _graph_input(request),
+                _thread_config(request)
+            )
+            return _build_query_response(response, request.thread_id, request.sources_mode)
         
-        # Get sources from context
-        sources = []
-        if "context" in response:
-            sources = [
-                {
-                    "page_content": doc.page_content[:500] + "..." if len(doc.page_content) > 500 else doc.page_content,
-                    "metadata": doc.metadata
-                }
-                for doc in response["context"]
-            ]
+        # Use LangGraph to process the query; identical concurrent queries share one run
+        if QUERY_COALESCING:
+            response, _ = await query_flight.do(
+                _query_key(request),
+                lambda: graph.ainvoke(_graph_input(request))
+            )
+        else:
+            response = await graph.ainvoke(_graph_input(request))
         
-        return QueryResponse(
-            answer=answer,
-            sources=sources
+        return _build_query_response(response, sources_mode=request.sources_mode)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _graph_stream(request: QueryRequest, graph_input: dict, stop: threading.Event):
+    """Stream (mode, payload) pairs from the stateless or the conversation graph.
+
+    The generate node checks the stop event: the sync node runs on in its worker thread when
+    the stream is cancelled, so setting stop is what ends the generation and frees its slot.
+    """
+    stream_mode = ["custom", "values"]
+    if request.thread_id:
+        conversation = get_conversation_graph()
+        # A disconnect also drops the unanswered turn from the thread
+        return _iterate_in_thread(
+            lambda thread_stop: conversation.stream(graph_input, _with_stop(_thread_config(request), thread_stop),
+                                                    stream_mode=stream_mode)
         )
+    return graph.astream(graph_input, _with_stop({"configurable": {}}, stop), stream_mode=stream_mode)
+
+async def _stream_query_events(request: QueryRequest):
+    """Run the graph, yielding answer tokens as they are generated and a final summary event"""
+    graph_input = _graph_input(request)
+    final_state = graph_input
+    stop = threading.Event()
+    try:
+        async for mode, payload in _graph_stream(request, graph_input, stop):
+            if mode == "custom":
+                # Only the winning model's tokens are written by the generate node
+                if "token" in payload:
+                    yield {"type": "token", "content": payload["token"]}
+                elif "reasoning" in payload:
+                    yield {"type": "reasoning", "content": payload["reasoning"]}
+            else:
+                final_state = payload
+    finally:
+        # Reached on disconnect too (the coalesced producer is cancelled, a direct stream closed)
+        stop.set()
+    
+    done = _build_query_response(final_state, request.thread_id, request.sources_mode)
+    yield {"type": "done", **done.model_dump()}
+
+def _check_llm_admission(request: QueryRequest):
+    """Raise AdmissionRejected if none of the models that could answer the request would admit it"""
+    if request.model_name == AUTO_MODEL:
+        candidates = [candidate for tier in MODEL_TIERS.values() for candidate in tier]
+    else:
+        candidates = [{"provider": request.provider or DEFAULT_PROVIDER, "model_name": request.model_name}]
+    if FALLBACK_PROVIDER:
+        candidates.append({"provider": FALLBACK_PROVIDER, "model_name": FALLBACK_MODEL})
+    rejection = None
+    for candidate in candidates:
+        try:
+            llm_limiter(candidate["provider"], candidate.get("model_name")).check()
+            return
+        except AdmissionRejected as e:
+            rejection = rejection or e
+    if rejection:
+        raise rejection
+
+async def query_documents_stream(request: QueryRequest) -> StreamingResponse:
+    """Stream a query answer as NDJSON events; identical concurrent streams share one generation"""
+    source = lambda: _stream_query_events(request)
+    key = None
+    if QUERY_COALESCING and not request.thread_id:
+        # The final event carries the sources, so their format is part of the key
+        key = _query_key(request) + (request.sources_mode or DEFAULT_SOURCES_MODE,)
+    # Once the response has started its status is sent, so an overloaded model is refused here
+    # with 429/503 and Retry-After; attaching to a running stream needs no generation of its own
+    if key is None or not stream_flight.in_flight(key):
+        _check_llm_admission(request)
+    events = stream_flight.subscribe(key, source) if key is not None else source()
+    
+    async def body():
+        try:
+            async for event in events:
+                yield _ndjson_line(event)
+        except HTTPException as e:
+            yield _ndjson_line({"type": "error", "status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            yield _ndjson_line({"type": "error", "detail": str(e)})
+        finally:
+            # On disconnect: unsubscribe (or stop the direct stream) now rather than when collected
+            await events.aclose()
+    
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+async def delete_conversation(thread_id: str, tenant_id: str = None):
+    """Forget the history of a conversation thread"""
+    try:
+        await run_in_threadpool(delete_conversation_thread, f"{tenant_id or DEFAULT_TENANT}:{thread_id}")
+        return {"message": f"Deleted conversation '{thread_id}'", "status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def clear_collection_endpoint():
-    """Clear all documents from the collection"""
+async def clear_collection_endpoint(tenant_id: str = None):
+    """Clear all documents from the collection, or only those of one tenant"""
     try:
-        result = clear_collection()
+        # Waits for the layout lock, which another worker may hold
+        result = await run_in_threadpool(clear_collection, tenant_id)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def test_hybrid_search_endpoint(query: str = "AI", limit: int = 4):
-    """Test hybrid search functionality"""
+def _temp_bundle(prefix: str) -> str:
+    """A new, uniquely named file under SNAPSHOT_DIR for a bundle passing through the API"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".tar", dir=SNAPSHOT_DIR)
+    os.close(fd)
+    return path
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def export_snapshot_endpoint():
+    """Snapshot the index into a bundle and download it; the bundle is removed once sent"""
+    path = _temp_bundle(".export-")
+    try:
+        filename = f"index-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.tar"
+        manifest = await run_in_threadpool(export_snapshot, path, get_corpus_version())
+        return FileResponse(
+            path,
+            filename=filename,
+            media_type="application/x-tar",
+            headers={"X-Snapshot-Collections": str(len(manifest["collections"]))},
+            background=BackgroundTask(_remove, path)
+        )
+    except SnapshotMismatch as e:
+        _remove(path)
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        _remove(path)
+        raise HTTPException(status_code=500, detail=f"Failed to export snapshot: {str(e)}")
+
+async def import_snapshot_endpoint(file: UploadFile = None, name: str = None):
+    """Restore the index from an uploaded bundle, or from a bundle already in SNAPSHOT_DIR"""
+    if file is None and not name:
+        raise HTTPException(status_code=400, detail="Upload a bundle or name one in the snapshot directory")
+    upload = None
     try:
-        results = hybrid_search(query, limit=limit)
+        if file is not None:
+            # Under a name of its own, so an upload never replaces a bundle kept in the directory
+            path = upload = _temp_bundle(".import-")
+            with open(path, "wb") as target:
+                await run_in_threadpool(shutil.copyfileobj, file.file, target, 1 << 20)
+        else:
+            # Only bundles in the snapshot directory can be named
+            path = os.path.join(SNAPSHOT_DIR, os.path.basename(name))
+            if not os.path.isfile(path):
+                raise HTTPException(status_code=404, detail=f"Snapshot not found: {name}")
+        
+        # Waits for the layout lock, which another worker may hold
+        manifest = await run_in_threadpool(import_snapshot, path)
+        return {
+            "message": f"Restored {len(manifest['collections'])} collections",
+            "collections": [entry["name"] for entry in manifest["collections"]],
+            "corpus_version": get_corpus_version(),
+            "status": "success"
+        }
+    except SnapshotMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to import snapshot: {str(e)}")
+    finally:
+        if upload:
+            _remove(upload)
+
+async def start_reindex_endpoint():
+    """Rebuild the index as a new collection version in the background and swap to it when done"""
+    try:
+        status = await run_in_threadpool(reindexer.start)
+        return {"message": f"Reindex to version {status['version']} started", **status}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to start reindex: {str(e)}")
+
+async def reindex_status_endpoint():
+    """Progress of the running or last reindex, whichever worker runs it"""
+    return await run_in_threadpool(reindexer.current_status)
+
+async def test_hybrid_search_endpoint(query: str = "AI", limit: int = 4, tenant_id: str = None,
+                                      sources_mode: str = "snippet", include: Optional[List[str]] = None,
+                                      exclude: Optional[List[str]] = None, retrieval_mode: str = None):
+    """Test hybrid search functionality; include/exclude select the payload fields Qdrant returns"""
+    try:
+        results = await ahybrid_search(
+            query, limit=limit, tenant_id=tenant_id,
+            with_payload=False if sources_mode == "none" else payload_selector(include, exclude),
+            retrieval_mode=retrieval_mode
+        )
         
         return {
             "query": query,
             "limit": limit,
-            "results": [
-                {
-                    "page_content": doc.page_content[:500] + "..." if len(doc.page_content) > 500 else doc.page_content,
-                    "metadata": doc.metadata
-                }
-                for doc in results
-            ]
+            "retrieval_mode": resolve_retrieval_mode(query, retrieval_mode),
+            "results": [] if sources_mode == "none" else [_format_source(doc, sources_mode) for doc in results]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def test_retriever_endpoint(query: str = "AI", limit: int = 4):
-    """Test basic retriever functionality"""
+async def test_retriever_endpoint(query: str = "AI", limit: int = 4, tenant_id: str = None,
+                                  sources_mode: str = "snippet", include: Optional[List[str]] = None,
+                                  exclude: Optional[List[str]] = None, retrieval_mode: str = None):
+    """Test basic retriever functionality; include/exclude select the payload fields Qdrant returns"""
     try:
         # Use hybrid search as the main retriever
-        results = hybrid_search(query, limit=limit)
+        results = await ahybrid_search(
+            query, limit=limit, tenant_id=tenant_id,
+            with_payload=False if sources_mode == "none" else payload_selector(include, exclude),
+            retrieval_mode=retrieval_mode
+        )
         
         return {
             "query": query,
             "limit": limit,
-            "results": [
-                {
-                    "page_content": doc.page_content[:500] + "..." if len(doc.page_content) > 500 else doc.page_content,
-                    "metadata": doc.metadata
-                }
-                for doc in results
-            ]
+            "retrieval_mode": resolve_retrieval_mode(query, retrieval_mode),
+            "results": [] if sources_mode == "none" else [_format_source(doc, sources_mode) for doc in results]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,94 +1,474 @@
 import re
+import time
+import logging
+import sqlite3
+import threading
 from typing import List, Optional
-from typing_extensions import TypedDict
+from typing_extensions import TypedDict, Annotated
 from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda, RunnableConfig
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, get_buffer_string
 from langgraph.graph import START, StateGraph, END
-from .vector_store import hybrid_search
+from langgraph.graph.message import add_messages
+from langgraph.config import get_stream_writer
+from langgraph.checkpoint.sqlite import SqliteSaver
+from .vector_store import (
+    hybrid_search_with_scores,
+    ahybrid_search_with_scores,
+    expand_parents,
+    resolve_retrieval_mode,
+    CONTEXT_PAYLOAD_FIELDS
+)
+from .admission import AdmissionRejected, llm_limiter
+from .hedging import stream_generation, candidate_label
+from .reasoning import (
+    ReasoningParser,
+    split_reasoning,
+    is_reasoning_model,
+    opens_reasoning,
+    observe_reasoning,
+    REASONING_CLOSED_PREFIX,
+    PREFILL_PROVIDERS
+)
+from .metrics import metrics
+from .logging_config import sampled_debug
 from .llm_providers import get_llm
-from .config import SYSTEM_TEMPLATE, HUMAN_TEMPLATE, NO_CONTEXT_TEMPLATE, CONTEXT_HUMAN_TEMPLATE
+from .model_router import model_router
+from .config import (
+    SYSTEM_TEMPLATE,
+    CONTEXT_HUMAN_TEMPLATE,
+    NO_CONTEXT_RESPONSE,
+    SMALL_TALK_TEMPLATE,
+    DEFAULT_RETRIEVAL_LIMIT,
+    MIN_RELEVANCE_SCORE,
+    SMALL_TALK_ROUTING,
+    FALLBACK_PROVIDER,
+    DEFAULT_PROVIDER,
+    FALLBACK_MODEL,
+    FALLBACK_URL,
+    LATENCY_BUDGET_MS,
+    HEDGE_MODE,
+    DEFAULT_MAX_REASONING_TOKENS,
+    SUMMARY_TEMPLATE,
+    CONVERSATION_DB_PATH,
+    HISTORY_TOKEN_LIMIT,
+    HISTORY_KEEP_MESSAGES,
+    AUTO_MODEL
+)
+
+logger = logging.getLogger(__name__)
 
 # LangGraph State
 class State(TypedDict):
     question: str
     context: List[Document]
+    scores: List[float]
     answer: str
+    route: str
     provider: str
     model_name: Optional[str]
+    limit: Optional[int]
+    tenant_id: Optional[str]
+    retrieval_mode: Optional[str]  # Requested mode in the input, the mode used after search
+    latency_budget_ms: Optional[int]
+    served_by: Optional[str]
+    model_tier: Optional[str]  # Tier the router chose when model_name is "auto"
+    # Reasoning models: requested handling of the <think> block, and what it contained
+    include_reasoning: Optional[bool]
+    max_reasoning_tokens: Optional[int]
+    reasoning: Optional[str]
+    thought_process: Optional[str]
+    # Conversation history (persisted per thread in conversation mode)
+    messages: Annotated[list, add_messages]
+    summary: str
+
+# Messages that are conversational rather than questions about the documents
+SMALL_TALK_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|yo|good (morning|afternoon|evening)|thanks|thank you|thx|cheers|"
+    r"bye|goodbye|see you|how are you|who are you|what can you do|ok|okay|cool|great)\b[\s!.?,]*"
+    r"(there|again|so much|a lot|today)?[\s!.?]*$",
+    re.IGNORECASE
+)
+
+def is_small_talk(question: str) -> bool:
+    """Cheap classifier for greetings, thanks and similar chit-chat"""
+    return len(question.split()) <= 6 and bool(SMALL_TALK_PATTERN.match(question))
+
+def classify(state: State):
+    """Classify the question so small talk can skip retrieval"""
+    return {"route": "small_talk" if is_small_talk(state["question"]) else "rag"}
+
+def route_question(state: State) -> str:
+    """Conditional edge after classify"""
+    return "generate" if state.get("route") == "small_talk" else "search"
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    return len(text) // 4
+
+def _prompt_tokens(messages: list) -> int:
+    """Estimated tokens of prompt messages (dicts or LangChain messages)"""
+    return sum(estimate_tokens(str(m["content"] if isinstance(m, dict) else m.content)) for m in messages)
+
+def _history(state: State) -> list:
+    """Prior conversation turns, excluding the current question"""
+    messages = state.get("messages") or []
+    if messages and isinstance(messages[-1], HumanMessage):
+        messages = messages[:-1]
+    return messages
+
+def _retrieval_query(state: State) -> str:
+    """Follow-ups often refer back ("and its cost?"), so prefix the previous user turn"""
+    previous = [m for m in _history(state) if isinstance(m, HumanMessage)]
+    if previous:
+        return f"{previous[-1].content} {state['question']}"
+    return state["question"]
+
+def _search_result(results, mode: str) -> dict:
+    return {
+        "context": [doc for doc, _ in results],
+        "scores": [score for _, score in results],
+        "retrieval_mode": mode,
+        "route": "rag"
+    }
 
 def search(state: State):
     """Search function for LangGraph"""
     try:
-        retrieved_docs = hybrid_search(state["question"], limit=4)
-        return {"context": retrieved_docs}
+        query = _retrieval_query(state)
+        mode = resolve_retrieval_mode(query, state.get("retrieval_mode"))
+        results = hybrid_search_with_scores(
+            query,
+            limit=state.get("limit") or DEFAULT_RETRIEVAL_LIMIT,
+            tenant_id=state.get("tenant_id"),
+            with_payload=CONTEXT_PAYLOAD_FIELDS,
+            retrieval_mode=mode
+        )
+        return _search_result(results, mode)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return {"context": [], "scores": [], "route": "rag"}
+
+async def asearch(state: State):
+    """Async search, used when the graph runs with ainvoke/astream"""
+    try:
+        query = _retrieval_query(state)
+        mode = resolve_retrieval_mode(query, state.get("retrieval_mode"))
+        results = await ahybrid_search_with_scores(
+            query,
+            limit=state.get("limit") or DEFAULT_RETRIEVAL_LIMIT,
+            tenant_id=state.get("tenant_id"),
+            with_payload=CONTEXT_PAYLOAD_FIELDS,
+            retrieval_mode=mode
+        )
+        return _search_result(results, mode)
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        print(f"Search error: {e}")
-        return {"context": []}
+        logger.error(f"Search error: {e}")
+        return {"context": [], "scores": [], "route": "rag"}
+
+def route_after_search(state: State) -> str:
+    """Conditional edge after search: skip the LLM when nothing usable was retrieved"""
+    context_docs = state.get("context", [])
+    if not any(doc.page_content.strip() for doc in context_docs):
+        return "no_context"
+    scores = state.get("scores") or []
+    # Fast (sparse-only) scores are not on the dense similarity scale the threshold is set for
+    if MIN_RELEVANCE_SCORE and scores and state.get("retrieval_mode") != "fast" and max(scores) < MIN_RELEVANCE_SCORE:
+        return "no_context"
+    return "generate"
+
+def no_context(state: State):
+    """Answer with the canned no-context response without calling the LLM"""
+    answer = NO_CONTEXT_RESPONSE.format(query=state["question"])
+    get_stream_writer()({"token": answer})
+    return {"answer": answer, "route": "no_context", "messages": [AIMessage(content=answer)]}
+
+def _fallback_candidate() -> Optional[dict]:
+    """Configured fallback provider/model, if any"""
+    if not FALLBACK_PROVIDER:
+        return None
+    return {"provider": FALLBACK_PROVIDER, "model_name": FALLBACK_MODEL, "base_url": FALLBACK_URL}
+
+def _stopped(config: Optional[RunnableConfig]) -> bool:
+    """Whether the caller set the run's stop event (configurable "stop"), e.g. on client disconnect"""
+    stop = ((config or {}).get("configurable") or {}).get("stop")
+    return stop is not None and stop.is_set()
 
-def generate(state: State):
+def _cancelled_turn(state: State) -> dict:
+    """Drop the question of a turn nobody waits for, so the thread keeps no trace of it"""
+    messages = state.get("messages") or []
+    removed = [RemoveMessage(id=messages[-1].id)] if messages and isinstance(messages[-1], HumanMessage) else []
+    return {"answer": "", "route": "cancelled", "messages": removed}
+
+def generate(state: State, config: RunnableConfig = None):
     """Generate function for LangGraph"""
+    decision = None
+    started = time.monotonic()
     try:
         # Get provider and model from state
-        provider = state.get("provider", "ollama")
+        provider = state.get("provider") or DEFAULT_PROVIDER
         model_name = state.get("model_name")
         
-        print(f"🔧 Generate function - Provider: {provider}, Model: {model_name}")
-        
-        # Get LLM instance
-        current_llm = get_llm(provider, model_name)
-        
-        # Check if context is available and has meaningful content
-        context_docs = state.get("context", [])
-        has_context = bool(context_docs and any(doc.page_content.strip() for doc in context_docs))
+        # Earlier turns go after the static system prompt: the summary first, then recent messages
+        history = []
+        if state.get("summary"):
+            history.append({"role": "system", "content": f"Summary of the earlier conversation:\n{state['summary']}"})
+        history.extend(_history(state))
         
-        if has_context:
-            # Use RAG prompt with context
+        # Empty retrievals are routed to no_context, so here we either have context or small talk
+        if state.get("route") == "small_talk":
+            messages = [
+                {"role": "system", "content": SMALL_TALK_TEMPLATE},
+                *history,
+                {"role": "user", "content": state["question"]},
+            ]
+        else:
+            # Use RAG prompt with context; in parent-child mode the matched children are
+            # swapped for their parent windows, fetched only now for the final top-k
+            context_docs = expand_parents(state.get("context", []))
             docs_content = "\n\n".join(doc.page_content for doc in context_docs)
             
             messages = [
                 {"role": "system", "content": SYSTEM_TEMPLATE},
+                *history,
                 {"role": "user", "content": CONTEXT_HUMAN_TEMPLATE.format(
                     context_str=docs_content, 
                     query=state["question"]
                 )},
             ]
-        else:
-            # Use no-context prompt
-            messages = [
-                {"role": "system", "content": NO_CONTEXT_TEMPLATE},
-                {"role": "user", "content": f"Question: {state['question']}"},
-            ]
         
-        print(f"📝 Using {'RAG prompt with context' if has_context else 'no-context prompt'}")
+        if model_name == AUTO_MODEL:
+            # The router weighs the question against everything the model has to read
+            decision = model_router.route(state["question"], _prompt_tokens(messages[1:]),
+                                          small_talk=state.get("route") == "small_talk")
+            provider, model_name = decision["provider"], decision["model_name"]
+        
+        sampled_debug(logger, "Generating with %s/%s", provider, model_name, route=state.get("route"))
+        
+        # Stream from the primary model, hedging/failing over to the fallback if it is too slow
+        primary = {"provider": provider, "model_name": model_name}
+        budget_ms = state.get("latency_budget_ms") or LATENCY_BUDGET_MS
+        writer = get_stream_writer()
+        served_by = primary
+        
+        # Reasoning is split from the answer as tokens arrive, and cut short past its cap
+        include_reasoning = state.get("include_reasoning") is not False
+        max_reasoning = state.get("max_reasoning_tokens")
+        if max_reasoning is None:
+            max_reasoning = DEFAULT_MAX_REASONING_TOKENS
+        parser = ReasoningParser()
+        
+        def emit(parts):
+            for kind, text in parts:
+                if kind == "answer":
+                    writer({"token": text})
+                elif include_reasoning:
+                    writer({"reasoning": text})
+        
+        def over_budget() -> bool:
+            return max_reasoning is not None and parser.in_reasoning and estimate_tokens(parser.reasoning) >= max_reasoning
+        
+        def closed_reasoning(reasoning: str) -> dict:
+            return {"role": "assistant", "content": REASONING_CLOSED_PREFIX.format(reasoning=reasoning)}
+        
+        fallback = _fallback_candidate()
+        # No thinking at all: open reasoning models with a closed block right away where the providers continue it
+        skipped = max_reasoning == 0 and all(
+            c["provider"] in PREFILL_PROVIDERS and is_reasoning_model(c) for c in (primary, fallback) if c
+        )
+        if skipped:
+            parser.stop_reasoning()
+        if _stopped(config):
+            return _cancelled_turn(state)
+        capped = False
+        stopped = False
+        ttft = None
+        stream_started = time.monotonic()
+        generation = stream_generation(
+            [*messages, closed_reasoning("")] if skipped else messages,
+            primary,
+            fallback=fallback,
+            budget=budget_ms / 1000 if budget_ms else None,
+            mode=HEDGE_MODE
+        )
+        try:
+            for candidate, chunk in generation:
+                served_by = candidate
+                if _stopped(config):
+                    stopped = True
+                    break
+                if chunk.content:
+                    if ttft is None:
+                        ttft = time.monotonic() - stream_started
+                        # Some reasoning models start inside a block their chat template opened
+                        parser.opened = opens_reasoning(served_by)
+                        # A fallback's first token also waited out the primary's budget
+                        if served_by is primary:
+                            model_router.observe(served_by, ttft)
+                    emit(parser.feed(chunk.content))
+                    if over_budget():
+                        capped = True
+                        break
+        finally:
+            # Stops the provider's stream when thinking was cut short or the caller went away
+            generation.close()
+        if stopped:
+            return _cancelled_turn(state)
         
-        response = current_llm.invoke(messages)
-        return {"answer": response.content}
+        if capped:
+            # Resume after a closed reasoning block, so the model goes straight to the answer
+            emit(parser.stop_reasoning())
+            metrics.inc("llm_reasoning_capped_total", model=candidate_label(served_by))
+            prefill = closed_reasoning(parser.reasoning.strip())
+            # Other providers answer the closed block with a new message, which may think again;
+            # only its answer is kept
+            resumed = (parser if served_by["provider"] in PREFILL_PROVIDERS
+                       else ReasoningParser(opened=opens_reasoning(served_by)))
+            resumption = stream_generation([*messages, prefill], served_by)
+            try:
+                for _, chunk in resumption:
+                    if _stopped(config):
+                        return _cancelled_turn(state)
+                    if chunk.content:
+                        emit([part for part in resumed.feed(chunk.content) if part[0] == "answer"])
+            finally:
+                resumption.close()
+            emit([part for part in resumed.close() if part[0] == "answer"])
+            parser.answer = resumed.answer
+        emit(parser.close())
+        observe_reasoning(served_by, parser)
+        
+        answer = parser.answer.strip()
+        reasoning = parser.reasoning.strip() or None
+        thought_process = None
+        if reasoning:
+            reasoning_tokens = estimate_tokens(reasoning)
+            metrics.observe("llm_reasoning_tokens", reasoning_tokens, model=candidate_label(served_by))
+            thought_process = f"Reasoned for ~{reasoning_tokens} tokens"
+            if capped:
+                thought_process += f", stopped at the {max_reasoning} token limit"
+        elif capped or skipped:
+            thought_process = "Reasoning disabled"
+        if decision:
+            model_router.record(decision, served_by, time.monotonic() - started, ttft,
+                                tokens=_prompt_tokens(messages) + estimate_tokens(parser.reasoning + parser.answer))
+        return {
+            "answer": answer,
+            "reasoning": reasoning if include_reasoning else None,
+            "thought_process": thought_process,
+            "served_by": candidate_label(served_by),
+            "model_tier": decision["tier"] if decision else None,
+            "messages": [AIMessage(content=answer)]
+        }
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        print(f"Generate error: {e}")
-        return {"answer": f"Error generating response: {str(e)}"}
+        logger.error(f"Generate error: {e}")
+        if decision:
+            model_router.record(decision, decision, time.monotonic() - started, error=str(e))
+        answer = f"Error generating response: {str(e)}"
+        # Close the turn, so the next one does not follow two questions in a row
+        return {"answer": answer, "messages": [AIMessage(content=answer)]}
+
+def route_after_answer(state: State) -> str:
+    """Conditional edge after answering: compact history once it grows past the token limit"""
+    if state.get("route") == "cancelled":
+        return END
+    history_tokens = estimate_tokens(get_buffer_string(state.get("messages") or []))
+    if history_tokens > HISTORY_TOKEN_LIMIT and len(state["messages"]) > HISTORY_KEEP_MESSAGES:
+        return "summarize"
+    return END
+
+def summarize(state: State):
+    """Fold older turns into the rolling summary and drop them from the history"""
+    messages = state["messages"]
+    older = messages[:-HISTORY_KEEP_MESSAGES] if HISTORY_KEEP_MESSAGES else messages
+    existing_summary = f"EXISTING SUMMARY:\n{state['summary']}\n" if state.get("summary") else ""
+    prompt = SUMMARY_TEMPLATE.format(
+        existing_summary=existing_summary,
+        conversation=get_buffer_string(older)
+    )
+    
+    try:
+        provider = state.get("provider") or DEFAULT_PROVIDER
+        model_name = state.get("model_name")
+        if model_name == AUTO_MODEL:
+            # Summaries are routine work
+            candidate, _ = model_router.pick("small")
+            provider, model_name = candidate["provider"], candidate.get("model_name")
+        with llm_limiter(provider, model_name).slot():
+            summary = get_llm(provider, model_name).invoke([{"role": "user", "content": prompt}]).content
+        # Reasoning models think before summarizing; only the summary is kept
+        summary = split_reasoning(summary)[1]
+    except Exception as e:
+        # Keep the history as is and try again after the next turn
+        logger.warning(f"Summarize error: {e}")
+        return {}
+    
+    return {"summary": summary, "messages": [RemoveMessage(id=m.id) for m in older]}
 
 def extract_after_think(input_text: str) -> str:
     """Extract content after </think> tag"""
-    match = re.search(r'</think>(.*)', input_text, re.DOTALL)
-    return match.group(1).strip() if match else input_text
+    return split_reasoning(input_text)[1]
 
 # Define the graph
-def create_graph():
-    """Create and compile the LangGraph workflow"""
+def create_graph(checkpointer=None):
+    """Create and compile the LangGraph workflow; with a checkpointer, state persists per thread_id"""
     graph_builder = StateGraph(State)
     
     # Add nodes
-    graph_builder.add_node("search", search)
+    # Sync runs (conversation threads) use search, async runs use the async Qdrant client
+    graph_builder.add_node("search", RunnableLambda(search, afunc=asearch, name="search"))
     graph_builder.add_node("generate", generate)
+    graph_builder.add_node("no_context", no_context)
     
     # Add edges
-    graph_builder.add_edge("search", "generate")
-    graph_builder.add_edge("generate", END)
+    graph_builder.add_conditional_edges("search", route_after_search, ["generate", "no_context"])
+    if checkpointer is None:
+        graph_builder.add_edge("generate", END)
+        graph_builder.add_edge("no_context", END)
+    else:
+        # History only accumulates across turns when persisted, so only then does it need compacting
+        graph_builder.add_node("summarize", summarize)
+        graph_builder.add_conditional_edges("generate", route_after_answer, ["summarize", END])
+        graph_builder.add_conditional_edges("no_context", route_after_answer, ["summarize", END])
+        graph_builder.add_edge("summarize", END)
     
-    # Add entrypoint
-    graph_builder.add_edge(START, "search")
+    # Add entrypoint; the optional classifier lets small talk bypass retrieval
+    if SMALL_TALK_ROUTING:
+        graph_builder.add_node("classify", classify)
+        graph_builder.add_edge(START, "classify")
+        graph_builder.add_conditional_edges("classify", route_question, ["search", "generate"])
+    else:
+        graph_builder.add_edge(START, "search")
     
     # Compile the graph
-    return graph_builder.compile()
+    return graph_builder.compile(checkpointer=checkpointer)
 
 # Create the graph instance
-graph = create_graph() 
\ No newline at end of file
+graph = create_graph()
+
+# Conversation graph, created on first use (requests may race to it from worker threads)
+conversation_graph = None
+conversation_checkpointer = None
+_conversation_lock = threading.Lock()
+
+def get_conversation_graph():
+    """Return the graph compiled with the SQLite checkpointer used for multi-turn conversations"""
+    global conversation_graph, conversation_checkpointer
+    if conversation_graph is None:
+        with _conversation_lock:
+            if conversation_graph is None:
+                connection = sqlite3.connect(CONVERSATION_DB_PATH, check_same_thread=False)
+                conversation_checkpointer = SqliteSaver(connection)
+                conversation_graph = create_graph(checkpointer=conversation_checkpointer)
+    return conversation_graph
+
+def delete_conversation_thread(thread_id: str):
+    """Delete all persisted state of a conversation thread"""
+    get_conversation_graph()
+    conversation_checkpointer.delete_thread(thread_id)
@@ -0,0 +1,198 @@
+import time
+import queue
+import socket
+import logging
+import threading
+import contextvars
+from typing import Dict, Iterator, List, Optional
+
+from .llm_providers import get_llm
+from .admission import llm_limiter
+from .metrics import metrics
+from .config import OLLAMA_COLD_LOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+def candidate_label(candidate: Dict) -> str:
+    """Human-readable provider:model label for a candidate"""
+    return f"{candidate['provider']}:{candidate.get('model_name') or 'default'}"
+
+def _http_client(llm):
+    """The HTTP client a chat model owns (Ollama and Groq create one per model instance), if any"""
+    for client in (getattr(llm, "_client", None), getattr(llm, "client", None)):
+        # ollama.Client._client, or Completions._client (groq.Groq) and its _client
+        while client is not None and not hasattr(client, "stream"):
+            client = getattr(client, "_client", None)
+        if client is not None and hasattr(client, "close"):
+            return client
+    return None
+
+def _abort(response):
+    """Shut down a response's connection; unlike closing it, this wakes a read blocked in another thread"""
+    network_stream = response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    try:
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # Already closed
+        pass
+
+def _stream_candidate(candidate: Dict, messages: list, cancelled: threading.Event, llm=None) -> Iterator:
+    """Stream chunks from one provider/model under its admission slot"""
+    if llm is None:
+        llm = get_llm(candidate["provider"], candidate.get("model_name"), base_url=candidate.get("base_url"))
+    with llm_limiter(candidate["provider"], candidate.get("model_name")).slot():
+        stream = llm.stream(messages)
+        try:
+            for chunk in stream:
+                if cancelled.is_set():
+                    break
+                yield chunk
+        finally:
+            # Closing the generator closes the HTTP response, so the provider stops generating
+            stream.close()
+
+def _load_duration(chunk, default=None):
+    """Ollama reports the model load time (ns) in the metadata of its final chunk"""
+    load_duration = (getattr(chunk, "response_metadata", None) or {}).get("load_duration")
+    return default if load_duration is None else load_duration
+
+def _record_ttft(candidate: Dict, ttft: float, load_duration):
+    """Record time to first token, labelled cold/warm from the model load time"""
+    if load_duration is None:
+        start = "unknown"
+    else:
+        start = "cold" if load_duration / 1e9 > OLLAMA_COLD_LOAD_SECONDS else "warm"
+    metrics.observe("llm_ttft_seconds", ttft, model=candidate_label(candidate), start=start)
+    if start == "cold":
+        metrics.inc("llm_cold_starts_total", model=candidate_label(candidate))
+
+class _Racer(threading.Thread):
+    """Runs one candidate in the background, reporting chunks to a shared queue"""
+
+    def __init__(self, index: int, candidate: Dict, messages: list, events: queue.Queue):
+        super().__init__(daemon=True)
+        self.index = index
+        self.candidate = candidate
+        self.messages = messages
+        self.events = events
+        self.cancelled = threading.Event()
+        # HTTP responses of the candidate, aborted on cancel
+        self._responses = []
+        # Threads start with an empty context; keep the request id for the candidate's logs
+        self._context = contextvars.copy_context()
+
+    def _track(self, response):
+        self._responses.append(response)
+        if self.cancelled.is_set():
+            _abort(response)
+
+    def cancel(self):
+        """Stop the candidate now, also when it is waiting for its next chunk"""
+        self.cancelled.set()
+        for response in list(self._responses):
+            _abort(response)
+
+    def run(self):
+        self._context.run(self._race)
+
+    def _race(self):
+        try:
+            llm = get_llm(self.candidate["provider"], self.candidate.get("model_name"),
+                          base_url=self.candidate.get("base_url"))
+            http = _http_client(llm)
+            if http is not None:
+                http.event_hooks["response"].append(self._track)
+            if self.cancelled.is_set():
+                return
+            for chunk in _stream_candidate(self.candidate, self.messages, self.cancelled, llm):
+                self.events.put(("chunk", self.index, chunk))
+            self.events.put(("done", self.index, None))
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.events.put(("error", self.index, e))
+
+def stream_generation(messages: list, primary: Dict, fallback: Optional[Dict] = None,
+                      budget: Optional[float] = None, mode: str = "hedge") -> Iterator:
+    """Stream the answer from primary, falling back when it is slow or failing.
+
+    Yields (candidate, chunk) pairs. With a fallback, it is started when primary
+    fails or, given a time-to-first-token budget, produces no token in time. In
+    "hedge" mode both then race and the first to produce a token wins; in
+    "failover" mode primary is abandoned. The loser is cancelled.
+    """
+    if fallback is None:
+        started = time.monotonic()
+        ttft = None
+        load_duration = None
+        for chunk in _stream_candidate(primary, messages, threading.Event()):
+            if ttft is None:
+                ttft = time.monotonic() - started
+            load_duration = _load_duration(chunk, load_duration)
+            yield primary, chunk
+        if ttft is not None:
+            _record_ttft(primary, ttft, load_duration)
+        return
+
+    events: queue.Queue = queue.Queue()
+    racers: List[_Racer] = [_Racer(0, primary, messages, events)]
+    started = time.monotonic()
+    racers[0].start()
+    winner: Optional[_Racer] = None
+    ttft = None
+    load_duration = None
+    # Racers that failed or were given up on, with the reason
+    out: Dict[int, Exception] = {}
+
+    def start_fallback(reason: str):
+        logger.info(f"Starting fallback {candidate_label(fallback)} ({reason})")
+        metrics.inc("llm_fallback_total", reason=reason, mode=mode)
+        if mode == "failover" and 0 not in out:
+            racers[0].cancel()
+            out[0] = TimeoutError(f"{candidate_label(primary)} produced no token within {budget}s")
+        racer = _Racer(1, fallback, messages, events)
+        racers.append(racer)
+        racer.start()
+
+    try:
+        while True:
+            timeout = None
+            if winner is None and len(racers) == 1 and budget is not None:
+                timeout = max(0.0, started + budget - time.monotonic())
+            try:
+                kind, index, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                start_fallback("budget")
+                continue
+
+            if winner is None:
+                if index in out:
+                    continue
+                if kind == "error":
+                    out[index] = payload
+                    if len(racers) == 1:
+                        start_fallback("error")
+                    elif len(out) == len(racers):
+                        raise payload
+                    continue
+                winner = racers[index]
+                for racer in racers:
+                    if racer is not winner:
+                        racer.cancel()
+                ttft = time.monotonic() - started
+                metrics.inc("llm_race_won_total", model=candidate_label(winner.candidate), role="primary" if index == 0 else "fallback")
+            elif index != winner.index:
+                continue
+
+            if kind == "chunk":
+                load_duration = _load_duration(payload, load_duration)
+                yield winner.candidate, payload
+            elif kind == "done":
+                _record_ttft(winner.candidate, ttft, load_duration)
+                return
+            else:
+                raise payload
+    finally:
+        for racer in racers:
+            racer.cancel()
@@ -1,28 +1,73 @@
 import os
+import logging
+import itertools
 from langchain_ollama import ChatOllama
 from langchain_groq import ChatGroq
-from .config import OLLAMA_MODEL_CONFIGS, GROQ_MODEL_CONFIGS
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from .config import (
+    OLLAMA_MODEL_CONFIGS,
+    GROQ_MODEL_CONFIGS,
+    OLLAMA_NUM_CTX,
+    DEFAULT_PROVIDER,
+    FAKE_LLM_RESPONSES,
+    ollama_keep_alive
+)
+from .logging_config import sampled_debug
+from .shared_state import state_sync
 
-def get_llm(provider: str = "ollama", model_name: str = None):
-    """Initialize LLM based on provider and model"""
+logger = logging.getLogger(__name__)
+
+# Turn counter of the fake provider; every get_llm() builds a new model, so it lives here
+_fake_turns = itertools.count()
+
+# Shared key of the discovered Ollama models, so every worker serves the same list
+MODELS_KEY = "models"
+
+def _apply_models(value: dict):
+    if value and value.get("ollama"):
+        OLLAMA_MODEL_CONFIGS[:] = value["ollama"]
+
+def publish_models(models: list):
+    """Make models the Ollama model list of every worker"""
+    if models != OLLAMA_MODEL_CONFIGS:
+        OLLAMA_MODEL_CONFIGS[:] = models
+        state_sync.publish(MODELS_KEY, {"ollama": models})
+
+def join_model_registry():
+    """Follow the model list of the other workers, starting from the published one if any"""
+    state_sync.subscribe(MODELS_KEY, _apply_models)
+    shared = state_sync.get(MODELS_KEY)
+    if shared and shared.get("ollama"):
+        _apply_models(shared)
+    else:
+        state_sync.publish(MODELS_KEY, {"ollama": list(OLLAMA_MODEL_CONFIGS)})
+
+def get_llm(provider: str = DEFAULT_PROVIDER, model_name: str = None, base_url: str = None):
+    """Initialize LLM based on provider and model; base_url overrides the Ollama server"""
     if provider == "ollama":
-        model_config = next((m for m in OLLAMA_MODEL_CONFIGS if m["name"] == model_name), OLLAMA_MODEL_CONFIGS[0])
-        print("-------------------OLLAMA-----------------------------")
+        model_config = next((m for m in OLLAMA_MODEL_CONFIGS if model_name in (m["name"], m["tag"])), None)
+        if model_config is None:
+            # Models on an explicitly given server need not be in the discovered list
+            model_config = {"tag": model_name, "url": base_url} if base_url and model_name else OLLAMA_MODEL_CONFIGS[0]
+        sampled_debug(logger, "Using Ollama model %s", model_config["tag"], url=base_url or model_config["url"])
 
         return ChatOllama(
-            base_url=model_config["url"],
+            base_url=base_url or model_config["url"],
             model=model_config["tag"],
-            temperature=0.5
+            temperature=0.5,
+            keep_alive=ollama_keep_alive(model_config["tag"]),
+            num_ctx=OLLAMA_NUM_CTX
         )
     elif provider == "groq":
-        print("------------------------------------------------GROQ")
+        sampled_debug(logger, "Using Groq model %s", model_name)
         return ChatGroq(
             api_key=os.getenv("GROQ_API_KEY"),
             model_name=model_name or "llama-3.3-70b-versatile",
             temperature=0.5
         )
+    elif provider == "fake":
+        # Canned answers, streamed character by character, for tests without an LLM server
+        answer = FAKE_LLM_RESPONSES[next(_fake_turns) % len(FAKE_LLM_RESPONSES)]
+        return FakeListChatModel(responses=[answer])
     else:
-        raise ValueError(f"Unsupported provider: {provider}")
-
-# Initialize default LLM
-default_llm = get_llm() 
\ No newline at end of file
+        raise ValueError(f"Unsupported provider: {provider}") 
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Structured logging.
+
+configure_logging() sends every logger (including uvicorn's) to one stderr handler
+that writes JSON lines, with per-logger levels from LOG_LEVELS. Each HTTP request
+gets a request id (the X-Request-ID header, or a new one) that is kept in a context
+variable, so every record logged while serving the request carries it, also from
+graph nodes and worker threads. Debug events on hot paths go through
+sampled_debug(), which costs one level check unless debug is enabled for the logger
+and the request was picked by LOG_DEBUG_SAMPLE_RATE.
+"""
+
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+from .config import LOG_FORMAT, LOG_LEVEL, LOG_LEVELS, LOG_DEBUG_SAMPLE_RATE
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+# Whether this request's debug events are logged; None outside requests
+_debug_sampled: ContextVar[Optional[bool]] = ContextVar("debug_sampled", default=None)
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+def start_request(request_id: str = None) -> str:
+    """Give the current context a request id (a new one unless given) and its sampling decision"""
+    request_id = request_id or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    _debug_sampled.set(random.random() < LOG_DEBUG_SAMPLE_RATE)
+    return request_id
+
+def sampled_debug(logger: logging.Logger, msg: str, *args, **fields):
+    """logger.debug for hot paths: only for sampled requests, and nothing is formatted otherwise"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    sampled = _debug_sampled.get()
+    if sampled is None:
+        sampled = random.random() < LOG_DEBUG_SAMPLE_RATE
+    if sampled:
+        logger.debug(msg, *args, extra=fields)
+
+class RequestIdFilter(logging.Filter):
+    """Adds the request id of the current context to every record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, request id and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", "-") != "-":
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+def configure_logging():
+    """Route all logging to one structured stderr handler; safe to call more than once"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    # uvicorn installs its own plain-text handlers; send its records through ours instead
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+class RequestIdMiddleware:
+    """Starts a request context for each HTTP request and returns its id in X-Request-ID"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope["headers"]).get(REQUEST_ID_HEADER.encode())
+        # Client-chosen ids are kept short, they end up in every log line
+        request_id = start_request(incoming.decode("latin-1")[:64] if incoming else None)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_id)
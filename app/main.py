@@ -1,23 +1,72 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Form, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import asyncio
+import logging
+import anyio.to_thread
 
-from .config import API_TITLE, API_DESCRIPTION
-from .vector_store import create_hybrid_collection
-from .models import QueryRequest, QueryResponse, DocumentRequest
+# Configured before the other app modules load, so their import-time logs are structured too
+from .logging_config import configure_logging, RequestIdMiddleware
+configure_logging()
+
+from .config import API_TITLE, API_DESCRIPTION, GZIP_MIN_SIZE, DRAIN_TIMEOUT_SECONDS, WORKER_THREADS
+from .vector_store import join_shared_state, validate_tenant, close_clients
+from .llm_providers import join_model_registry
+from .shared_state import state_sync
+from .reindex import reindexer
+from .warmup import warmup_manager
+from .models import QueryRequest, QueryResponse, DocumentRequest, SourcesMode, RetrievalMode
 from .endpoints import (
     health_check,
+    get_metrics,
     get_available_models,
     upload_documents,
     upload_pdfs,
     query_documents,
+    query_documents_stream,
+    delete_conversation,
     clear_collection_endpoint,
+    export_snapshot_endpoint,
+    import_snapshot_endpoint,
+    start_reindex_endpoint,
+    reindex_status_endpoint,
     test_hybrid_search_endpoint,
     test_retriever_endpoint
 )
 
+def _default_response_class():
+    """orjson for JSON responses when installed, unless FastAPI already serializes natively"""
+    try:
+        import orjson  # noqa: F401
+        from fastapi.responses import ORJSONResponse
+    except ImportError:
+        return JSONResponse
+    # Recent FastAPI serializes response models straight to JSON bytes and deprecates ORJSONResponse
+    if getattr(ORJSONResponse, "__deprecated__", None):
+        return JSONResponse
+    return ORJSONResponse
+
+class StreamSafeGZipMiddleware(GZipMiddleware):
+    """GZip that leaves token streams alone; compressing them would buffer tokens"""
+    
+    excluded_paths = ("/query/stream",)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
 # Initialize FastAPI app
-app = FastAPI(title=API_TITLE, description=API_DESCRIPTION)
+app = FastAPI(title=API_TITLE, description=API_DESCRIPTION, default_response_class=_default_response_class())
+
+# Compress large responses (e.g. queries with full sources)
+if GZIP_MIN_SIZE:
+    app.add_middleware(StreamSafeGZipMiddleware, minimum_size=GZIP_MIN_SIZE)
 
 # CORS middleware
 app.add_middleware(
@@ -26,52 +75,114 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Outermost, so every log record of a request carries its id
+app.add_middleware(RequestIdMiddleware)
+
+logger = logging.getLogger(__name__)
+
 # Initialize on startup
 @app.on_event("startup")
 async def startup_event():
     """Initialize the system on startup"""
+    # Admission queues are bounded below these pool sizes (ADMISSION_MAX_WAITING)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="worker")
+    )
+    anyio.to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
     try:
-        # Create collection if it doesn't exist
-        create_hybrid_collection()
-        print("✅ Hybrid RAG system initialized successfully")
+        # Create collection if it doesn't exist, and follow the changes other workers make
+        await run_in_threadpool(join_shared_state)
+        await run_in_threadpool(join_model_registry)
+        await run_in_threadpool(state_sync.start)
+        # Preload Ollama models in the background so the first query is not a cold start
+        warmup_manager.start()
+        logger.info("Hybrid RAG system initialized successfully")
     except Exception as e:
-        print(f"❌ Startup error: {e}")
+        logger.error(f"Startup error: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background work on shutdown; uvicorn has already drained the in-flight requests"""
+    # An unfinished reindex is abandoned, the live version stays in place
+    await run_in_threadpool(reindexer.cancel, DRAIN_TIMEOUT_SECONDS)
+    warmup_manager.stop()
+    state_sync.stop()
+    await close_clients()
 
 # API Endpoints
 @app.get("/health")
 async def health():
     return await health_check()
 
+@app.get("/metrics")
+async def metrics():
+    return await get_metrics()
+
 @app.get("/models")
 async def models():
     return await get_available_models()
 
 @app.post("/upload")
-async def upload(documents: List[DocumentRequest]):
-    return await upload_documents(documents)
+async def upload(documents: List[DocumentRequest], x_tenant_id: Optional[str] = Header(None)):
+    return await upload_documents(documents, validate_tenant(x_tenant_id))
 
 @app.post("/upload-pdfs")
-async def upload_pdf_files(files: List[UploadFile] = File(...)):
-    return await upload_pdfs(files)
+async def upload_pdf_files(files: List[UploadFile] = File(...), x_tenant_id: Optional[str] = Header(None)):
+    return await upload_pdfs(files, validate_tenant(x_tenant_id))
 
 @app.post("/query")
-async def query(request: QueryRequest) -> QueryResponse:
+async def query(request: QueryRequest, x_tenant_id: Optional[str] = Header(None)) -> QueryResponse:
+    request.tenant_id = validate_tenant(x_tenant_id or request.tenant_id)
     return await query_documents(request)
 
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest, x_tenant_id: Optional[str] = Header(None)):
+    request.tenant_id = validate_tenant(x_tenant_id or request.tenant_id)
+    return await query_documents_stream(request)
+
+@app.delete("/conversations/{thread_id}")
+async def conversation_delete(thread_id: str, x_tenant_id: Optional[str] = Header(None)):
+    return await delete_conversation(thread_id, validate_tenant(x_tenant_id))
+
 @app.delete("/clear-collection")
-async def clear_collection():
-    return await clear_collection_endpoint()
+async def clear_collection(tenant_id: Optional[str] = None, x_tenant_id: Optional[str] = Header(None)):
+    # Without a tenant, everything is cleared
+    tenant = x_tenant_id or tenant_id
+    return await clear_collection_endpoint(validate_tenant(tenant) if tenant else None)
+
+@app.post("/admin/snapshot")
+async def snapshot_export():
+    return await export_snapshot_endpoint()
+
+@app.post("/admin/snapshot/import")
+async def snapshot_import(file: Optional[UploadFile] = File(None), name: Optional[str] = Form(None)):
+    return await import_snapshot_endpoint(file, name)
+
+@app.post("/admin/reindex", status_code=202)
+async def reindex_start():
+    return await start_reindex_endpoint()
+
+@app.get("/admin/reindex")
+async def reindex_status():
+    return await reindex_status_endpoint()
 
 @app.get("/test-hybrid-search")
-async def test_hybrid_search(query: str = "AI", limit: int = 4):
-    return await test_hybrid_search_endpoint(query, limit)
+async def test_hybrid_search(query: str = "AI", limit: int = 4, sources_mode: SourcesMode = "snippet",
+                             include: Optional[List[str]] = Query(None), exclude: Optional[List[str]] = Query(None),
+                             retrieval_mode: Optional[RetrievalMode] = None, x_tenant_id: Optional[str] = Header(None)):
+    return await test_hybrid_search_endpoint(query, limit, validate_tenant(x_tenant_id), sources_mode, include, exclude,
+                                             retrieval_mode)
 
 @app.get("/test-retriever")
-async def test_retriever(query: str = "AI", limit: int = 4):
-    return await test_retriever_endpoint(query, limit)
+async def test_retriever(query: str = "AI", limit: int = 4, sources_mode: SourcesMode = "snippet",
+                         include: Optional[List[str]] = Query(None), exclude: Optional[List[str]] = Query(None),
+                         retrieval_mode: Optional[RetrievalMode] = None, x_tenant_id: Optional[str] = Header(None)):
+    return await test_retriever_endpoint(query, limit, validate_tenant(x_tenant_id), sources_mode, include, exclude,
+                                         retrieval_mode)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_graceful_shutdown=DRAIN_TIMEOUT_SECONDS, log_config=None)
@@ -0,0 +1,84 @@
+import threading
+from collections import deque
+from typing import Dict, Tuple
+
+# Number of recent samples kept per histogram for percentile estimates
+HISTOGRAM_WINDOW = 1024
+
+def _series_key(name: str, labels: dict) -> str:
+    """Render a metric name and labels as name{k="v",...}"""
+    if not labels:
+        return name
+    rendered = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+def _percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def _summarize(samples: list, count: int, total: float) -> dict:
+    return {
+        "count": count,
+        "sum": total,
+        "p50": _percentile(samples, 0.50),
+        "p95": _percentile(samples, 0.95),
+        "p99": _percentile(samples, 0.99),
+        "max": max(samples) if samples else 0.0,
+    }
+
+class Metrics:
+    """Thread-safe in-process registry of counters, gauges and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Tuple[deque, list]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                # (recent samples, [count, sum])
+                self._histograms[key] = (deque(maxlen=HISTOGRAM_WINDOW), [0, 0.0])
+            samples, totals = self._histograms[key]
+            samples.append(value)
+            totals[0] += 1
+            totals[1] += value
+
+    def _histogram(self, key: str) -> dict:
+        with self._lock:
+            if key not in self._histograms:
+                return _summarize([], 0, 0.0)
+            samples, (count, total) = self._histograms[key]
+            samples = list(samples)
+        return _summarize(samples, count, total)
+
+    def summary(self, name: str, **labels) -> dict:
+        """Return count/sum/percentiles for one histogram series"""
+        return self._histogram(_series_key(name, labels))
+
+    def snapshot(self) -> dict:
+        """Return all series as plain JSON-serializable data"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histogram_keys = list(self._histograms)
+        histograms = {key: self._histogram(key) for key in histogram_keys}
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+# Process-wide registry
+metrics = Metrics()
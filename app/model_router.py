@@ -0,0 +1,160 @@
+"""
+Automatic model routing.
+
+Queries with model_name "auto" are answered by a model chosen per request. The
+question and the retrieved context decide the tier:
+
+    small    small talk, and short questions over little context
+    medium   everything in between
+    large    long questions or a lot of context
+
+Analytical questions (why, compare, explain...) go one tier up. Each tier lists
+its candidates cheapest first (MODEL_TIERS). The first candidate whose expected
+latency, its recent time to first token plus the wait in its admission queue, is
+within ROUTER_LATENCY_SLACK_SECONDS of the fastest one is used, so the cheap
+model answers unless it is clearly slower right now. Every decision and its
+outcome are recorded in the metrics; the latest ones are shown in GET /metrics.
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from .config import (
+    MODEL_TIER_NAMES,
+    MODEL_TIERS,
+    ROUTER_SMALL_MAX_WORDS,
+    ROUTER_SMALL_MAX_CONTEXT_TOKENS,
+    ROUTER_LARGE_MIN_WORDS,
+    ROUTER_LARGE_MIN_CONTEXT_TOKENS,
+    ROUTER_LATENCY_SLACK_SECONDS,
+    ROUTER_STATS_TTL_SECONDS,
+    BILLED_PROVIDERS
+)
+from .admission import llm_limiter
+from .hedging import candidate_label
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Questions asking for reasoning rather than a lookup
+ANALYTICAL_PATTERN = re.compile(
+    r"\b(why|explain|compare|comparison|contrast|differences?|versus|vs\.?|analy[sz]e|evaluate|"
+    r"pros and cons|trade-?offs?|step by step|implications?|justify|prove)\b",
+    re.IGNORECASE
+)
+# Weight of the newest time to first token in the moving average
+_TTFT_SMOOTHING = 0.3
+# Decisions kept for GET /metrics
+RECENT_DECISIONS = 50
+
+def choose_tier(question: str, context_tokens: int = 0, small_talk: bool = False) -> str:
+    """The tier for a question and the size (estimated tokens) of its context and history"""
+    if small_talk:
+        return "small"
+    words = len(question.split())
+    if words >= ROUTER_LARGE_MIN_WORDS or context_tokens >= ROUTER_LARGE_MIN_CONTEXT_TOKENS:
+        return "large"
+    tier = "small" if words <= ROUTER_SMALL_MAX_WORDS and context_tokens <= ROUTER_SMALL_MAX_CONTEXT_TOKENS else "medium"
+    if ANALYTICAL_PATTERN.search(question) or question.count("?") > 1:
+        tier = MODEL_TIER_NAMES[MODEL_TIER_NAMES.index(tier) + 1]
+    return tier
+
+class ModelRouter:
+    """Picks a model per request and keeps the latency statistics it picks by"""
+
+    def __init__(self, tiers: Dict[str, List[Dict]] = MODEL_TIERS):
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        # Candidate label -> (moving average time to first token, when last updated)
+        self._ttft: Dict[str, Tuple[float, float]] = {}
+        self._recent = deque(maxlen=RECENT_DECISIONS)
+
+    def candidates(self, tier: str) -> List[Dict]:
+        """Candidates of tier, falling back to the nearest configured tier"""
+        index = MODEL_TIER_NAMES.index(tier)
+        # Nearest first, preferring the larger tier at equal distance
+        order = sorted(MODEL_TIER_NAMES, key=lambda name: (abs(MODEL_TIER_NAMES.index(name) - index),
+                                                           -MODEL_TIER_NAMES.index(name)))
+        for name in order:
+            if self.tiers.get(name):
+                return self.tiers[name]
+        raise ValueError("MODEL_TIERS configures no models")
+
+    def observe(self, candidate: Dict, ttft: float):
+        """Record the time to first token of a generation, routed or not"""
+        label = candidate_label(candidate)
+        with self._lock:
+            previous = self._ttft.get(label)
+            if previous and time.time() - previous[1] < ROUTER_STATS_TTL_SECONDS:
+                ttft = (1 - _TTFT_SMOOTHING) * previous[0] + _TTFT_SMOOTHING * ttft
+            self._ttft[label] = (ttft, time.time())
+
+    def expected_latency(self, candidate: Dict) -> float:
+        """Seconds until the candidate's first token; models without recent statistics count as fast,
+        so they get tried"""
+        with self._lock:
+            stats = self._ttft.get(candidate_label(candidate))
+        ttft = stats[0] if stats and time.time() - stats[1] < ROUTER_STATS_TTL_SECONDS else 0.0
+        return ttft + llm_limiter(candidate["provider"], candidate.get("model_name")).expected_wait()
+
+    def pick(self, tier: str) -> Tuple[Dict, float]:
+        """The cheapest candidate of tier within the latency slack of the fastest, and its expected latency"""
+        candidates = self.candidates(tier)
+        latencies = [self.expected_latency(candidate) for candidate in candidates]
+        fastest = min(latencies)
+        for candidate, latency in zip(candidates, latencies):
+            if latency <= fastest + ROUTER_LATENCY_SLACK_SECONDS:
+                return candidate, latency
+        return candidates[0], latencies[0]
+
+    def route(self, question: str, context_tokens: int = 0, small_talk: bool = False) -> Dict:
+        """Decide the model of one request"""
+        tier = choose_tier(question, context_tokens, small_talk)
+        candidate, latency = self.pick(tier)
+        return {
+            "tier": tier,
+            "provider": candidate["provider"],
+            "model_name": candidate.get("model_name"),
+            "context_tokens": context_tokens,
+            "expected_latency": round(latency, 3),
+        }
+
+    def record(self, decision: Dict, served_by: Dict, seconds: float, ttft: Optional[float] = None,
+               tokens: int = 0, error: str = None):
+        """Record the outcome of a routed request: who answered, how fast and at what estimated cost"""
+        routed = candidate_label(decision)
+        served = candidate_label(served_by)
+        metrics.inc("router_decisions_total", tier=decision["tier"], model=routed)
+        metrics.observe("router_latency_seconds", seconds, tier=decision["tier"])
+        if error:
+            metrics.inc("router_failures_total", tier=decision["tier"], model=served)
+        if served_by["provider"] in BILLED_PROVIDERS:
+            metrics.inc("router_billed_tokens_total", tokens, model=served)
+        outcome = {
+            **decision,
+            "served_by": served,
+            "seconds": round(seconds, 3),
+            "ttft": round(ttft, 3) if ttft is not None else None,
+            "tokens": tokens,
+            "error": error,
+        }
+        self._recent.append({"time": time.time(), **outcome})
+        logger.info(f"Routed a {decision['tier']} question to {routed}, served by {served} in {seconds:.2f}s",
+                    extra={"routing": outcome})
+
+    def status(self) -> dict:
+        """Expected latency of every candidate and the latest decisions"""
+        return {
+            "tiers": {
+                tier: [{"model": candidate_label(c), "expected_latency": round(self.expected_latency(c), 3)}
+                       for c in candidates]
+                for tier, candidates in self.tiers.items()
+            },
+            "recent": list(self._recent),
+        }
+
+model_router = ModelRouter()
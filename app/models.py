@@ -1,5 +1,10 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
+
+# How much of each retrieved chunk is returned with an answer
+SourcesMode = Literal["none", "snippet", "full"]
+# Retrieval latency/quality tier (see vector_store.resolve_retrieval_mode)
+RetrievalMode = Literal["fast", "balanced", "deep", "auto"]
 
 class DocumentRequest(BaseModel):
     content: str
@@ -7,11 +12,24 @@ class DocumentRequest(BaseModel):
 
 class QueryRequest(BaseModel):
     question: str
-    provider: Optional[str] = "ollama"
-    model_name: Optional[str] = None
+    provider: Optional[str] = None  # Defaults to DEFAULT_PROVIDER
+    model_name: Optional[str] = None  # "auto" routes each request to a model (see app/model_router.py)
+    limit: Optional[int] = 4
+    latency_budget_ms: Optional[int] = None
+    thread_id: Optional[str] = None  # Enables conversation mode with persisted, summarized history
+    tenant_id: Optional[str] = None  # Also settable with the X-Tenant-ID header
+    sources_mode: Optional[SourcesMode] = None  # Defaults to DEFAULT_SOURCES_MODE
+    retrieval_mode: Optional[RetrievalMode] = None  # Defaults to DEFAULT_RETRIEVAL_MODE
+    include_reasoning: Optional[bool] = True  # Return a reasoning model's thinking with the answer
+    max_reasoning_tokens: Optional[int] = None  # Cap on thinking (0 = none); defaults to DEFAULT_MAX_REASONING_TOKENS
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[dict] = []
     reasoning: Optional[str] = None
-    thought_process: Optional[str] = None 
\ No newline at end of file
+    thought_process: Optional[str] = None
+    served_by: Optional[str] = None
+    model_tier: Optional[str] = None
+    route: Optional[str] = None
+    retrieval_mode: Optional[str] = None
+    thread_id: Optional[str] = None 
\ No newline at end of file
@@ -0,0 +1,196 @@
+import threading
+from typing import Dict, List, Tuple
+
+from .config import REASONING_MODELS
+from .hedging import candidate_label
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+# Assistant prefill that makes a reasoning model skip (the rest of) its thinking
+REASONING_CLOSED_PREFIX = f"{THINK_OPEN}\n{{reasoning}}\n{THINK_CLOSE}\n\n"
+# Providers that continue a trailing assistant message; others answer it with a new message
+PREFILL_PROVIDERS = ("ollama",)
+
+# Candidate labels of models whose output was seen to carry a reasoning block, and of
+# those among them whose block was opened by their chat template (only a </think> showed)
+_seen_reasoning = set()
+_seen_opened = set()
+_seen_lock = threading.Lock()
+
+def _configured(candidate: Dict) -> bool:
+    model = (candidate.get("model_name") or "").lower()
+    return any(pattern in model for pattern in REASONING_MODELS)
+
+def is_reasoning_model(candidate: Dict) -> bool:
+    """Whether a provider/model is configured in REASONING_MODELS or was seen to reason"""
+    if _configured(candidate):
+        return True
+    with _seen_lock:
+        return candidate_label(candidate) in _seen_reasoning
+
+def opens_reasoning(candidate: Dict) -> bool:
+    """Whether a model's output starts inside a reasoning block (configured, or seen to emit a bare </think>)"""
+    if _configured(candidate):
+        return True
+    with _seen_lock:
+        return candidate_label(candidate) in _seen_opened
+
+def observe_reasoning(candidate: Dict, parser: "ReasoningParser"):
+    """Remember a model whose output carried a reasoning block"""
+    if parser.saw_reasoning:
+        with _seen_lock:
+            _seen_reasoning.add(candidate_label(candidate))
+            if parser.closed_implicitly:
+                _seen_opened.add(candidate_label(candidate))
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of tag"""
+    for length in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-length:]):
+            return length
+    return 0
+
+class ReasoningParser:
+    """Splits streamed model output into reasoning and answer as chunks arrive.
+
+    Reasoning models (DeepSeek-R1, QwQ) open their output with a <think>...</think>
+    block. feed() returns ("reasoning" | "answer", text) parts as soon as they are
+    known; only text that may be the start of a tag is held back until the next chunk.
+
+    The chat templates of some reasoning models open the block themselves, so their
+    output starts inside it and only a </think> shows. With opened=True (a model known
+    to do so) output that does not open with <think> is taken as reasoning but held
+    back: it is returned as one reasoning part once </think> (or stop_reasoning())
+    confirms it, or by close() as the answer if no </think> came. Nothing is returned twice.
+    Otherwise it is answer, unless a </think> follows: then everything before the
+    tag was reasoning (parts already returned as answer are not taken back).
+    """
+
+    def __init__(self, opened: bool = False):
+        self.opened = opened
+        self.state = "start"
+        self.buffer = ""
+        self.reasoning = ""
+        self.answer = ""
+        # The output started without <think>, a </think> may still close an implicit block
+        self.implicit = False
+        self.saw_reasoning = False
+        # A </think> closed a block the output never opened
+        self.closed_implicitly = False
+
+    @property
+    def in_reasoning(self) -> bool:
+        return self.state == "reasoning"
+
+    def _reason(self, text: str, parts: list):
+        if self.implicit:
+            # Not confirmed as reasoning yet: kept, not returned
+            self.reasoning += text
+        else:
+            self._emit("reasoning", text, parts)
+
+    def _release(self, parts: list):
+        """Return held reasoning, now confirmed"""
+        if self.implicit and self.reasoning:
+            parts.append(("reasoning", self.reasoning))
+
+    def _emit(self, kind: str, text: str, parts: list):
+        if not text:
+            return
+        if kind == "reasoning":
+            self.reasoning += text
+        else:
+            self.answer += text
+        parts.append((kind, text))
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        parts = []
+        self.buffer += text
+        while self.buffer:
+            if self.state == "start":
+                stripped = self.buffer.lstrip()
+                if stripped.startswith(THINK_OPEN):
+                    self.state = "reasoning"
+                    self.saw_reasoning = True
+                    self.buffer = stripped[len(THINK_OPEN):].lstrip()
+                elif not stripped or THINK_OPEN.startswith(stripped):
+                    # Could still become <think>
+                    break
+                else:
+                    self.state = "reasoning" if self.opened else "answer"
+                    self.implicit = True
+            elif self.state == "reasoning":
+                if not self.reasoning:
+                    self.buffer = self.buffer.lstrip()
+                end = self.buffer.find(THINK_CLOSE)
+                if end >= 0:
+                    self._reason(self.buffer[:end], parts)
+                    self._release(parts)
+                    self.state = "after_reasoning"
+                    self.closed_implicitly = self.implicit
+                    self.implicit = False
+                    self.saw_reasoning = True
+                    self.buffer = self.buffer[end + len(THINK_CLOSE):]
+                    continue
+                held = _partial_tag_length(self.buffer, THINK_CLOSE)
+                self._reason(self.buffer[:len(self.buffer) - held], parts)
+                self.buffer = self.buffer[len(self.buffer) - held:]
+                break
+            elif self.state == "after_reasoning":
+                # The answer starts at its first non-blank character
+                self.buffer = self.buffer.lstrip()
+                if self.buffer:
+                    self.state = "answer"
+            elif self.implicit:
+                end = self.buffer.find(THINK_CLOSE)
+                if end >= 0:
+                    self.reasoning, self.answer = self.answer, ""
+                    self._emit("reasoning", self.buffer[:end], parts)
+                    self.implicit = False
+                    self.saw_reasoning = True
+                    self.closed_implicitly = True
+                    self.state = "after_reasoning"
+                    self.buffer = self.buffer[end + len(THINK_CLOSE):]
+                    continue
+                held = _partial_tag_length(self.buffer, THINK_CLOSE)
+                self._emit("answer", self.buffer[:len(self.buffer) - held], parts)
+                self.buffer = self.buffer[len(self.buffer) - held:]
+                break
+            else:
+                self._emit("answer", self.buffer, parts)
+                self.buffer = ""
+        return parts
+
+    def stop_reasoning(self) -> List[Tuple[str, str]]:
+        """End the reasoning block early; what follows is answer (a held-back partial tag is dropped).
+        Returns the reasoning held back so far, which now counts as reasoning"""
+        parts = []
+        if self.state == "reasoning":
+            self._release(parts)
+        self.buffer = ""
+        self.state = "after_reasoning"
+        self.implicit = False
+        return parts
+
+    def close(self) -> List[Tuple[str, str]]:
+        """Flush held-back text at the end of the stream (an unclosed block counts as reasoning,
+        unless only opened=True assumed it)"""
+        parts = []
+        if self.state == "reasoning" and self.implicit:
+            # No </think>: the model did not reason this time
+            text, self.reasoning = self.reasoning + self.buffer, ""
+            self._emit("answer", text, parts)
+        elif self.state == "reasoning":
+            self._emit("reasoning", self.buffer, parts)
+        elif self.state in ("start", "answer"):
+            self._emit("answer", self.buffer, parts)
+        self.buffer = ""
+        return parts
+
+def split_reasoning(text: str) -> Tuple[str, str]:
+    """(reasoning, answer) of a complete model output"""
+    parser = ReasoningParser()
+    parser.feed(text)
+    parser.close()
+    return parser.reasoning.strip(), parser.answer.strip()
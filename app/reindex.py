@@ -0,0 +1,189 @@
+"""
+Zero-downtime reindexing.
+
+A reindex builds the next version of every index collection (the shared one and
+the dedicated tenant ones) next to the live version, re-embedding the stored
+chunks with the current embedding models, chunking and collection settings. When
+every collection is rebuilt the aliases are swapped to it in one atomic update
+and the old versions are dropped. Searches keep hitting the live version
+throughout, and uploads made meanwhile are written to both versions.
+
+The reindex runs in the worker that received the request; its progress is
+published to the shared state, so every worker reports it.
+
+    POST /admin/reindex      start a reindex in the background
+    GET  /admin/reindex      progress of the running or last reindex
+"""
+
+import time
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from langchain_core.documents import Document
+from qdrant_client.models import Record
+
+from .config import DEFAULT_TENANT, PARENT_CHILD_CHUNKING, REINDEX_BATCH_SIZE
+from .docstore import docstore
+from .metrics import metrics
+from .shared_state import state_sync
+from . import vector_store
+
+logger = logging.getLogger(__name__)
+
+REINDEX_KEY = "reindex"
+
+class ReindexCancelled(Exception):
+    pass
+
+class Reindexer:
+    """Runs one reindex at a time in a background thread and keeps its progress"""
+
+    def __init__(self, batch_size: int = REINDEX_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.status: Dict = {"state": "idle"}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cancel = threading.Event()
+
+    def start(self) -> dict:
+        """Create the new version and rebuild it in the background; raises HTTPException 409 if one is running"""
+        with self._lock:
+            if not vector_store.collection_exists and not vector_store.create_hybrid_collection():
+                raise RuntimeError("Collection not available")
+            version, sources = vector_store.begin_rebuild()
+            self.status = {
+                "state": "running",
+                "version": version,
+                "started_at": time.time(),
+                "collections": {name: {"from": source, "to": vector_store.rebuilding[name], "points": 0}
+                                for name, source in sources.items()},
+                "points": 0,
+                "skipped": 0,
+            }
+            self._publish()
+            self._cancel.clear()
+            self._thread = threading.Thread(target=self._run, args=(version, sources), name="reindex", daemon=True)
+            self._thread.start()
+            return self.status
+
+    def current_status(self) -> dict:
+        """Progress of the running or last reindex of any worker"""
+        return state_sync.get(REINDEX_KEY) or self.status
+
+    def cancel(self, timeout: float = None):
+        """Abandon the running reindex, keeping the live version, and wait for its thread"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._cancel.set()
+        thread.join(timeout)
+
+    def _publish(self):
+        try:
+            state_sync.publish(REINDEX_KEY, self.status)
+        except Exception as e:
+            logger.warning(f"Publishing reindex progress failed: {e}")
+
+    def _run(self, version: int, sources: Dict[str, str]):
+        start = time.monotonic()
+        targets = {name: vector_store.rebuilding[name] for name in sources}
+        try:
+            for name, source in sources.items():
+                self._copy(name, source, targets[name], vector_store.staging_prefix(version))
+            vector_store.finish_rebuild(version)
+        except Exception as e:
+            if isinstance(e, ReindexCancelled):
+                logger.info(f"Reindex to version {version} cancelled")
+                self.status.update(state="cancelled", finished_at=time.time())
+            else:
+                logger.error(f"Reindex to version {version} failed: {e}")
+                self.status.update(state="failed", error=str(e), finished_at=time.time())
+                metrics.inc("reindex_failures_total")
+            if vector_store.rebuilding:
+                vector_store.finish_rebuild(version, swap=False)
+            else:
+                # The alias swap itself failed; collections no alias points at are dropped
+                vector_store.drop_collections(list(targets.values()), delay=0)
+            self._publish()
+            return
+
+        elapsed = time.monotonic() - start
+        self.status.update(state="completed", finished_at=time.time(), seconds=elapsed)
+        self._publish()
+        metrics.observe("reindex_seconds", elapsed)
+        logger.info(f"Reindexed {self.status['points']} points into version {version} in {elapsed:.1f}s")
+
+    def _copy(self, name: str, source: str, target: str, docstore_prefix: str):
+        """Re-embed every point of source into target, staging docstore records under docstore_prefix"""
+        offset = None
+        # Parents re-split so far; each is rebuilt once however many children point at it
+        seen_parents: Set[str] = set()
+        while True:
+            records, offset = vector_store.qdrant_client.scroll(
+                collection_name=source,
+                with_payload=True,
+                with_vectors=False,
+                limit=self.batch_size,
+                offset=offset,
+            )
+            points = self._rebuild_points(records, seen_parents, docstore_prefix)
+            vector_store.write_points(target, points)
+            self.status["collections"][name]["points"] += len(points)
+            self.status["points"] += len(points)
+            self._publish()
+            # Keeps the other workers mirroring their uploads into the new version
+            vector_store.touch_rebuild()
+            if offset is None:
+                return
+            if self._cancel.is_set():
+                raise ReindexCancelled("Reindex cancelled")
+
+    def _rebuild_points(self, records: List[Record], seen_parents: Set[str], docstore_prefix: str) -> list:
+        """Points of the new version for one scrolled batch, built like freshly uploaded documents"""
+        payloads = {str(r.id): r.payload or {} for r in records}
+        # Chunk text is in the payload, or in the docstore when EXTERNAL_CHUNK_TEXT was on
+        external = docstore.get_many([pid for pid, payload in payloads.items() if "document" not in payload])
+
+        documents = defaultdict(list)
+        ids = defaultdict(list)
+        for point_id, payload in payloads.items():
+            tenant_id = payload.get(vector_store.TENANT_FIELD) or DEFAULT_TENANT
+            metadata = payload.get("metadata") or {}
+            parent_id = metadata.get("parent_id")
+            if PARENT_CHILD_CHUNKING and parent_id:
+                # Children are split again from their parent, so child chunk size changes apply
+                if parent_id not in seen_parents:
+                    seen_parents.add(parent_id)
+                    ids[tenant_id].append(parent_id)
+                    documents[tenant_id].append(None)
+                continue
+            if "document" in payload:
+                text = payload["document"]
+            elif point_id in external:
+                text = external[point_id].page_content
+            else:
+                self.status["skipped"] += 1
+                continue
+            ids[tenant_id].append(point_id)
+            documents[tenant_id].append(Document(page_content=text, metadata=metadata))
+
+        points = []
+        for tenant_id, tenant_documents in documents.items():
+            tenant_ids = ids[tenant_id]
+            parents = docstore.get_many([pid for pid, doc in zip(tenant_ids, tenant_documents) if doc is None])
+            kept_documents, kept_ids = [], []
+            for point_id, doc in zip(tenant_ids, tenant_documents):
+                doc = doc or parents.get(point_id)
+                if doc is None:
+                    self.status["skipped"] += 1
+                    continue
+                kept_documents.append(doc)
+                kept_ids.append(point_id)
+            if kept_documents:
+                # Staged: the live version hydrates the same ids with its own chunking until the swap
+                points.extend(vector_store.build_points(kept_documents, tenant_id, kept_ids, docstore_prefix))
+        return points
+
+reindexer = Reindexer()
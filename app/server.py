@@ -0,0 +1,45 @@
+"""
+Server mode: the API in N uvicorn worker processes.
+
+Every worker follows the state the others change (see app/shared_state.py), so a
+clear, reindex or tenant promotion on one worker is seen by all. On SIGTERM the
+workers stop accepting connections, finish their in-flight requests for up to
+DRAIN_TIMEOUT_SECONDS and then stop their background work.
+
+    python -m app.server --workers 4
+"""
+
+import argparse
+
+import uvicorn
+
+from .config import API_WORKERS, QDRANT_MODE, SHARED_STATE_BACKEND, DRAIN_TIMEOUT_SECONDS
+from .logging_config import configure_logging
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API in several worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Embedded Qdrant is locked by one process, and memory state is not seen by the other workers
+        if QDRANT_MODE != "remote":
+            parser.error(f"--workers {args.workers} needs QDRANT_MODE=remote, not {QDRANT_MODE}")
+        if SHARED_STATE_BACKEND == "memory":
+            parser.error(f"--workers {args.workers} needs SHARED_STATE_BACKEND=sqlite or redis")
+
+    configure_logging()
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=DRAIN_TIMEOUT_SECONDS,
+        # Keep the structured logging configured above
+        log_config=None,
+    )
+
+if __name__ == "__main__":
+    main()
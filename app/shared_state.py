@@ -0,0 +1,326 @@
+"""
+State shared by API workers and replicas.
+
+A few pieces of state must be the same in every worker: the collection layout
+(index version, dedicated tenants, the collections a running reindex writes to),
+the corpus version, the model registry and reindex progress. Each is a JSON value
+under a key in a shared store, with a version that every write bumps:
+
+    memory   one process (tests, embedded Qdrant)
+    sqlite   a database file the workers of one host open (SHARED_STATE_PATH)
+    redis    a Redis-compatible server, for replicas on several hosts (SHARED_STATE_URL)
+
+StateSync polls the versions and calls the subscribers of a key when another
+process changed it. Writers that must not interleave across processes (tenant
+promotion, starting a reindex, clearing) hold lock(), a lease in the store that
+expires after SHARED_LOCK_TIMEOUT so a crashed worker cannot hold it forever;
+a live holder renews it, however long its work takes.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import (
+    SHARED_STATE_BACKEND,
+    SHARED_STATE_PATH,
+    SHARED_STATE_URL,
+    SHARED_STATE_POLL_INTERVAL,
+    SHARED_LOCK_TIMEOUT
+)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process as a lock owner
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class MemoryStore:
+    """Shared state of a single process"""
+
+    def __init__(self):
+        self._values: Dict[str, dict] = {}
+        self._versions: Dict[str, int] = {}
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            return self._values.get(key)
+
+    def update(self, key: str, fn: Callable[[dict], dict]) -> Tuple[dict, int]:
+        """Replace the value of key by fn(current value or {}) atomically; returns the value and its version"""
+        with self._lock:
+            value = fn(dict(self._values.get(key) or {}))
+            self._values[key] = value
+            self._versions[key] = self._versions.get(key, 0) + 1
+            return value, self._versions[key]
+
+    def versions(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._versions)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            holder = self._leases.get(name)
+            if holder and holder[0] != owner and holder[1] > time.time():
+                return False
+            self._leases[name] = (owner, time.time() + ttl)
+            return True
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            if self._leases.get(name, ("",))[0] != owner:
+                return False
+            self._leases[name] = (owner, time.time() + ttl)
+            return True
+
+    def release(self, name: str, owner: str):
+        with self._lock:
+            if self._leases.get(name, ("",))[0] == owner:
+                del self._leases[name]
+
+class SqliteStore:
+    """Shared state in an SQLite database, for the worker processes of one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Autocommit; writes open their own transactions. Workers wait for each other's writes
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);"
+            )
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, key: str, fn: Callable[[dict], dict]) -> Tuple[dict, int]:
+        with self._transaction() as connection:
+            row = connection.execute("SELECT value, version FROM state WHERE key = ?", (key,)).fetchone()
+            value = fn(json.loads(row[0]) if row else {})
+            version = row[1] + 1 if row else 1
+            connection.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)", (key, json.dumps(value), version))
+        return value, version
+
+    def versions(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._connect().execute("SELECT key, version FROM state").fetchall())
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT owner, expires FROM locks WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            connection.execute("INSERT OR REPLACE INTO locks VALUES (?, ?, ?)", (name, owner, now + ttl))
+        return True
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE locks SET expires = ? WHERE name = ? AND owner = ?", (time.time() + ttl, name, owner)
+            )
+        return cursor.rowcount > 0
+
+    def release(self, name: str, owner: str):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+# Deletes a lock only if it is still held by the given owner
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# Extends a lock only if it is still held by the given owner
+_RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+class RedisStore:
+    """Shared state in a Redis-compatible server, for replicas on several hosts"""
+
+    def __init__(self, url: str, prefix: str = "rag:"):
+        if redis is None:
+            raise RuntimeError("SHARED_STATE_BACKEND=redis needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.values_key = f"{prefix}state"
+        self.versions_key = f"{prefix}versions"
+        self.lock_prefix = f"{prefix}lock:"
+        self._release = self.client.register_script(_RELEASE_SCRIPT)
+        self._renew = self.client.register_script(_RENEW_SCRIPT)
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self.client.hget(self.values_key, key)
+        return json.loads(value) if value else None
+
+    def update(self, key: str, fn: Callable[[dict], dict]) -> Tuple[dict, int]:
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic: retried when another writer changed the key in between
+                    pipe.watch(self.versions_key)
+                    current = pipe.hget(self.values_key, key)
+                    value = fn(json.loads(current) if current else {})
+                    pipe.multi()
+                    pipe.hset(self.values_key, key, json.dumps(value))
+                    pipe.hincrby(self.versions_key, key, 1)
+                    return value, pipe.execute()[1]
+                except redis.WatchError:
+                    continue
+
+    def versions(self) -> Dict[str, int]:
+        return {k.decode(): int(v) for k, v in self.client.hgetall(self.versions_key).items()}
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(self.client.set(self.lock_prefix + name, owner, nx=True, px=int(ttl * 1000)))
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(self._renew(keys=[self.lock_prefix + name], args=[owner, int(ttl * 1000)]))
+
+    def release(self, name: str, owner: str):
+        self._release(keys=[self.lock_prefix + name], args=[owner])
+
+def open_store(backend: str = SHARED_STATE_BACKEND):
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "sqlite":
+        return SqliteStore(SHARED_STATE_PATH)
+    if backend == "redis":
+        return RedisStore(SHARED_STATE_URL)
+    raise ValueError(f"SHARED_STATE_BACKEND must be memory, sqlite or redis, not {backend!r}")
+
+class StateSync:
+    """Publishes this process's changes to the shared store and applies those of other processes"""
+
+    def __init__(self, store, interval: float = SHARED_STATE_POLL_INTERVAL):
+        self.store = store
+        self.interval = interval
+        # Version of each key this process has applied (or written itself)
+        self._seen: Dict[str, int] = {}
+        self._subscribers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+        self._poll_lock = threading.Lock()
+        self._thread_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, key: str, callback: Callable[[dict], None]):
+        """Call callback(value) whenever another process changes key"""
+        self._subscribers[key].append(callback)
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.store.get(key)
+
+    def publish(self, key: str, value: dict) -> dict:
+        return self.update(key, lambda _: value)
+
+    def update(self, key: str, fn: Callable[[dict], dict]) -> dict:
+        """Atomic read-modify-write of key; the subscribers of this process are not called"""
+        value, version = self.store.update(key, fn)
+        with self._poll_lock:
+            if version == self._seen.get(key, 0) + 1:
+                self._seen[key] = version
+        return value
+
+    def poll(self):
+        """Apply the keys other processes changed since the last poll"""
+        with self._poll_lock:
+            for key, version in self.store.versions().items():
+                if self._seen.get(key) == version:
+                    continue
+                self._seen[key] = version
+                value = self.store.get(key)
+                for callback in self._subscribers.get(key, ()):
+                    try:
+                        callback(value)
+                    except Exception as e:
+                        logger.error(f"Applying shared state {key!r} failed: {e}")
+
+    @contextmanager
+    def lock(self, name: str):
+        """Exclusive across the threads and processes sharing the store; state is up to date inside"""
+        with self._thread_locks[name]:
+            owner = f"{PROCESS_ID}:{uuid.uuid4().hex}"
+            while not self.store.acquire(name, owner, SHARED_LOCK_TIMEOUT):
+                time.sleep(0.05)
+            # Long holders (a tenant move) keep the lease alive; only a dead worker's expires
+            done = threading.Event()
+            keeper = threading.Thread(target=self._keep_lease, args=(name, owner, done), name=f"lease-{name}", daemon=True)
+            keeper.start()
+            try:
+                self.poll()
+                yield
+            finally:
+                done.set()
+                keeper.join()
+                self.store.release(name, owner)
+
+    def _keep_lease(self, name: str, owner: str, done: threading.Event):
+        while not done.wait(SHARED_LOCK_TIMEOUT / 3):
+            try:
+                if not self.store.renew(name, owner, SHARED_LOCK_TIMEOUT):
+                    logger.error(f"Lost the shared lock {name!r}; another worker may hold it")
+                    return
+            except Exception as e:
+                logger.warning(f"Renewing the shared lock {name!r} failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Polling shared state failed: {e}")
+
+    def start(self):
+        """Apply the current shared state, then keep following it in a background thread"""
+        self.poll()
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="shared-state", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+state_sync = StateSync(open_store())
@@ -0,0 +1,287 @@
+"""
+Index snapshot export/import for fast node bring-up.
+
+A bundle is a tar file holding one Qdrant snapshot per collection (the shared
+collection and any dedicated tenant collections, taken from the versions their
+aliases point at), a backup of the local docstore (parent chunks, external chunk
+text) and of the near-duplicate index if there are any, and manifest.json with the collection configs, the
+embedding model names and the corpus version. Restoring a bundle skips
+re-embedding every document, and is refused when the bundle was built with
+different embedding models. The collections are restored as a new version and
+the aliases are swapped to it in one step, as a reindex does.
+
+    python -m app.snapshots export snapshots/index.tar
+    python -m app.snapshots import snapshots/index.tar
+"""
+
+import os
+import json
+import shutil
+import tarfile
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException
+from qdrant_client import QdrantClient
+
+from .config import (
+    QDRANT_MODE,
+    QDRANT_URL,
+    QDRANT_TIMEOUT,
+    COLLECTION_NAME,
+    DENSE_MODEL_NAME,
+    SPARSE_MODEL_NAME,
+    SNAPSHOT_DIR,
+    PARENT_CHILD_CHUNKING,
+    EXTERNAL_CHUNK_TEXT,
+    DOCSTORE_BACKEND
+)
+from .docstore import docstore
+from .dedup import deduplicator
+
+MANIFEST_NAME = "manifest.json"
+DOCSTORE_NAME = "docstore.backup"
+DEDUP_NAME = "dedup.backup"
+BUNDLE_FORMAT = 1
+
+class SnapshotMismatch(Exception):
+    """The bundle cannot be restored into this deployment"""
+
+def embedding_models() -> dict:
+    return {"dense": DENSE_MODEL_NAME, "sparse": SPARSE_MODEL_NAME}
+
+def _client() -> QdrantClient:
+    if QDRANT_MODE != "remote":
+        # Embedded storage has no snapshot API; its QDRANT_PATH directory can be copied instead
+        raise SnapshotMismatch(f"Snapshots need a Qdrant server, this deployment uses QDRANT_MODE={QDRANT_MODE}")
+    # Snapshot files move over REST, so the metadata calls use it too
+    return QdrantClient(url=QDRANT_URL, timeout=QDRANT_TIMEOUT)
+
+def _is_index_collection(name: str) -> bool:
+    """The shared collection and the dedicated tenant collections (see vector_store.is_index_collection)"""
+    # Tenant ids have no dots, so dotted names are versions ("<name>.v<N>")
+    return "." not in name and (name == COLLECTION_NAME or name.startswith(f"{COLLECTION_NAME}__"))
+
+def index_collections(client: QdrantClient) -> Dict[str, str]:
+    """Physical collection behind each logical index collection (see vector_store.index_collections)"""
+    collections = {c.name: c.name for c in client.get_collections().collections if _is_index_collection(c.name)}
+    collections.update({
+        a.alias_name: a.collection_name for a in client.get_aliases().aliases if _is_index_collection(a.alias_name)
+    })
+    return collections
+
+def _next_version(client: QdrantClient) -> int:
+    """A version above every existing physical index collection (see vector_store.next_index_version)"""
+    versions = [0]
+    for c in client.get_collections().collections:
+        name, _, version = c.name.rpartition(".v")
+        if version.isdigit() and _is_index_collection(name):
+            versions.append(int(version))
+    return max(versions) + 1
+
+def export_snapshot(output_path: str, corpus_version: Optional[int] = None) -> dict:
+    """Snapshot every index collection into one bundle at output_path; returns the manifest"""
+    client = _client()
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "embedding_models": embedding_models(),
+        "corpus_version": corpus_version,
+        "parent_child_chunking": PARENT_CHILD_CHUNKING,
+        "external_chunk_text": EXTERNAL_CHUNK_TEXT,
+        "collections": [],
+        "docstore": None,
+        "dedup": None,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, physical in index_collections(client).items():
+            snapshot = client.create_snapshot(collection_name=physical, wait=True)
+            filename = f"{name}.snapshot"
+            try:
+                with httpx.stream("GET", f"{QDRANT_URL}/collections/{physical}/snapshots/{snapshot.name}",
+                                  timeout=None) as response:
+                    response.raise_for_status()
+                    with open(os.path.join(workdir, filename), "wb") as f:
+                        for chunk in response.iter_bytes(1 << 20):
+                            f.write(chunk)
+            finally:
+                client.delete_snapshot(collection_name=physical, snapshot_name=snapshot.name)
+
+            manifest["collections"].append({
+                "name": name,
+                "collection": physical,
+                "file": filename,
+                "checksum": snapshot.checksum,
+                "size": snapshot.size,
+                "points": client.count(collection_name=physical, exact=True).count,
+                "config": client.get_collection(physical).config.model_dump(mode="json"),
+            })
+
+        # Parent chunks and external chunk text live outside Qdrant, so they travel with the collections
+        if docstore.exists():
+            docstore.backup(os.path.join(workdir, DOCSTORE_NAME))
+            manifest["docstore"] = {"backend": DOCSTORE_BACKEND, "file": DOCSTORE_NAME}
+        if deduplicator.exists():
+            deduplicator.backup(os.path.join(workdir, DEDUP_NAME))
+            manifest["dedup"] = {"file": DEDUP_NAME}
+
+        with open(os.path.join(workdir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Write next to the target and rename, so a partial bundle is never left behind
+        partial = f"{output_path}.partial"
+        with tarfile.open(partial, "w") as bundle:
+            bundle.add(os.path.join(workdir, MANIFEST_NAME), arcname=MANIFEST_NAME)
+            for entry in manifest["collections"]:
+                bundle.add(os.path.join(workdir, entry["file"]), arcname=entry["file"])
+            if manifest["docstore"]:
+                bundle.add(os.path.join(workdir, DOCSTORE_NAME), arcname=DOCSTORE_NAME)
+            if manifest["dedup"]:
+                bundle.add(os.path.join(workdir, DEDUP_NAME), arcname=DEDUP_NAME)
+        os.replace(partial, output_path)
+
+    client.close()
+    return manifest
+
+def read_manifest(bundle_path: str) -> dict:
+    with tarfile.open(bundle_path, "r") as bundle:
+        return json.load(bundle.extractfile(MANIFEST_NAME))
+
+def check_manifest(manifest: dict):
+    """Refuse bundles this deployment cannot serve"""
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise SnapshotMismatch(f"Unsupported bundle format: {manifest.get('format')}")
+    if manifest.get("embedding_models") != embedding_models():
+        raise SnapshotMismatch(
+            f"Bundle was built with embedding models {manifest.get('embedding_models')}, "
+            f"this deployment uses {embedding_models()}"
+        )
+    if manifest.get("docstore") and manifest["docstore"]["backend"] != DOCSTORE_BACKEND:
+        raise SnapshotMismatch(
+            f"Bundle docstore uses the {manifest['docstore']['backend']} backend, "
+            f"this deployment uses {DOCSTORE_BACKEND}"
+        )
+
+def _go_live(restored: Dict[str, str], manifest: dict, workdir: str) -> List[str]:
+    """Like a reindex swap: every alias at once, with the docstore and signatures that belong to them.
+    Tenant collections the bundle does not know about lose theirs. When the docstore or signatures
+    cannot be restored, the aliases and both stores are put back as they were, so the restored
+    collections are not left live with the old records. The caller holds layout_lock().
+    Returns the previous physical collections"""
+    from . import vector_store
+
+    aliases = vector_store.index_aliases()
+    stores = [(store, os.path.join(workdir, "previous-" + name))
+              for store, name in ((docstore, DOCSTORE_NAME), (deduplicator, DEDUP_NAME))]
+    for store, path in stores:
+        if store.exists():
+            store.backup(path)
+    try:
+        previous = vector_store.replace_collections(restored)
+        if manifest.get("docstore"):
+            docstore.restore(os.path.join(workdir, DOCSTORE_NAME))
+        if manifest.get("dedup"):
+            deduplicator.restore(os.path.join(workdir, DEDUP_NAME))
+        else:
+            # Signatures of the replaced index would flag new chunks as duplicates of missing ones
+            deduplicator.clear()
+    except BaseException:
+        vector_store.replace_collections(aliases)
+        for store, path in stores:
+            if os.path.exists(path):
+                store.restore(path)
+            else:
+                store.clear()
+        raise
+    return previous
+
+def import_snapshot(bundle_path: str) -> dict:
+    """Restore every collection of a bundle, replacing existing ones; returns the manifest"""
+    # Loads the embedding models, so only restores pay for it
+    from . import vector_store
+    from .shared_state import state_sync
+
+    manifest = read_manifest(bundle_path)
+    check_manifest(manifest)
+    # Checked again under the layout lock; this spares uploading a bundle that cannot be swapped in
+    state_sync.poll()
+    if vector_store.rebuilding:
+        raise HTTPException(status_code=409, detail="A reindex is running; restore once it has finished")
+
+    client = _client()
+    version = max(_next_version(client), vector_store.next_index_version())
+    restored = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir, tarfile.open(bundle_path, "r") as bundle:
+            for entry in manifest["collections"]:
+                collection = f"{entry['name']}.v{version}"
+                member = bundle.getmember(entry["file"])
+                path = os.path.join(workdir, os.path.basename(entry["file"]))
+                with bundle.extractfile(member) as source, open(path, "wb") as target:
+                    shutil.copyfileobj(source, target, 1 << 20)
+
+                params = {"priority": "snapshot", "wait": "true"}
+                if entry.get("checksum"):
+                    params["checksum"] = entry["checksum"]
+                with open(path, "rb") as f:
+                    response = httpx.post(
+                        f"{QDRANT_URL}/collections/{collection}/snapshots/upload",
+                        params=params,
+                        files={"snapshot": (entry["file"], f, "application/octet-stream")},
+                        timeout=None,
+                    )
+                response.raise_for_status()
+                os.remove(path)
+                restored[entry["name"]] = collection
+
+            for key, name in (("docstore", DOCSTORE_NAME), ("dedup", DEDUP_NAME)):
+                if manifest.get(key):
+                    with bundle.extractfile(manifest[key]["file"]) as source, \
+                            open(os.path.join(workdir, name), "wb") as target:
+                        shutil.copyfileobj(source, target, 1 << 20)
+
+            with vector_store.layout_lock():
+                previous = _go_live(restored, manifest, workdir)
+    except BaseException:
+        # Restored collections that did not go live; drop_collections skips the ones that did
+        vector_store.drop_collections(list(restored.values()), delay=0)
+        raise
+    finally:
+        client.close()
+
+    # Searches still running against the replaced collections get INDEX_GC_DELAY_SECONDS to finish
+    vector_store.drop_collections(previous)
+    vector_store.bump_corpus_version(manifest.get("corpus_version") or 0)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or restore the search index")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export_parser = subcommands.add_parser("export", help="Write a snapshot bundle")
+    export_parser.add_argument("output", nargs="?", default=os.path.join(SNAPSHOT_DIR, "index.tar"))
+    import_parser = subcommands.add_parser("import", help="Restore a snapshot bundle")
+    import_parser.add_argument("bundle")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        try:
+            manifest = export_snapshot(args.output)
+        except SnapshotMismatch as e:
+            parser.exit(1, f"Cannot export: {e}\n")
+        print(f"Exported {len(manifest['collections'])} collections to {args.output}")
+    else:
+        try:
+            manifest = import_snapshot(args.bundle)
+        except SnapshotMismatch as e:
+            parser.exit(1, f"Refusing to restore: {e}\n")
+        except HTTPException as e:
+            parser.exit(1, f"Refusing to restore: {e.detail}\n")
+        print(f"Restored {len(manifest['collections'])} collections from {args.bundle}")
+
+if __name__ == "__main__":
+    main()
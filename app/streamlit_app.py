@@ -3,6 +3,7 @@ import requests
 import json
 from typing import List, Dict
 import os
+import uuid
 from dotenv import load_dotenv
 import time
 
@@ -12,6 +13,31 @@ load_dotenv()
 # API endpoint
 API_URL = "http://localhost:8000"
 
+# Cache lifetimes for backend lookups that would otherwise run on every script rerun
+MODELS_CACHE_TTL = 60
+HEALTH_CACHE_TTL = 15
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One pooled HTTP session shared by all reruns and users of this Streamlit process"""
+    return requests.Session()
+
+http = get_http_session()
+
+@st.cache_data(ttl=MODELS_CACHE_TTL, show_spinner=False)
+def fetch_models() -> Dict:
+    """Available models per provider; cached because /models queries Ollama"""
+    response = http.get(f"{API_URL}/models", timeout=15)
+    response.raise_for_status()
+    return response.json()
+
+@st.cache_data(ttl=HEALTH_CACHE_TTL, show_spinner=False)
+def fetch_health() -> Dict:
+    """System health; cached because /health calls the LLM"""
+    response = http.get(f"{API_URL}/health", timeout=60)
+    response.raise_for_status()
+    return response.json()
+
 # Page configuration
 st.set_page_config(
     page_title="RAG Chat Assistant",
@@ -36,6 +62,10 @@ if "selected_provider" not in st.session_state:
 if "selected_model" not in st.session_state:
     st.session_state.selected_model = None
 
+# Conversation thread on the backend; follow-up questions keep their context
+if "thread_id" not in st.session_state:
+    st.session_state.thread_id = str(uuid.uuid4())
+
 # Custom CSS for chat interface
 st.markdown("""
 <style>
@@ -108,22 +138,25 @@ with st.sidebar:
     with col1:
         if st.button("🔍 Health Check", use_container_width=True):
             try:
-                response = requests.get(f"{API_URL}/health")
-                if response.status_code == 200:
-                    health_data = response.json()
-                    if health_data["status"] == "healthy":
-                        st.success("✅ System Online")
-                        st.info(f"📚 Collections: {health_data['collections']}")
-                    else:
-                        st.error("❌ System Issues")
+                health_data = fetch_health()
+                if health_data["status"] == "healthy":
+                    st.success("✅ System Online")
+                    st.info(f"📚 Collections: {health_data['collections']}")
                 else:
-                    st.error("❌ API Offline")
+                    st.error("❌ System Issues")
+            except requests.HTTPError:
+                st.error("❌ API Offline")
             except Exception as e:
                 st.error(f"❌ Connection Error")
     
     with col2:
         if st.button("🗑️ Clear Chat", use_container_width=True):
             st.session_state.messages = []
+            try:
+                http.delete(f"{API_URL}/conversations/{st.session_state.thread_id}")
+            except Exception:
+                pass
+            st.session_state.thread_id = str(uuid.uuid4())
             st.rerun()
     
     st.divider()
@@ -131,19 +164,24 @@ with st.sidebar:
     # Model Selection
     st.header("🤖 Model Selection")
     
-    # Provider Selection
+    # Provider Selection; Auto lets the API pick a model per question
+    providers = ["auto", "ollama", "groq"]
     provider = st.radio(
         "Select Provider",
-        ["ollama", "groq"],
-        index=0 if st.session_state.selected_provider == "ollama" else 1,
+        providers,
+        index=providers.index(st.session_state.selected_provider),
+        format_func=lambda p: "Auto" if p == "auto" else p,
+        help="Auto: simple questions go to a fast, cheap model and complex ones to a larger model",
         key="provider_selector"
     )
     
     # Get available models
-    try:
-        models_response = requests.get(f"{API_URL}/models")
-        if models_response.status_code == 200:
-            available_models = models_response.json()
+    if provider == "auto":
+        st.session_state.selected_provider = provider
+        st.session_state.selected_model = "auto"
+    else:
+        try:
+            available_models = fetch_models()
             
             # Model Selection based on provider
             if provider == "ollama":
@@ -163,8 +201,8 @@ with st.sidebar:
             st.session_state.selected_provider = provider
             st.session_state.selected_model = model_options[selected_model_name]
             
-    except Exception as e:
-        st.error(f"Error loading models: {e}")
+        except Exception as e:
+            st.error(f"Error loading models: {e}")
     
     # Retriever Settings
     st.header("🔧 Retriever Settings")
@@ -184,6 +222,27 @@ with st.sidebar:
         help="Number of documents to retrieve for context"
     )
     
+    retrieval_mode = st.selectbox(
+        "⚡ Retrieval Mode",
+        ["auto", "fast", "balanced", "deep"],
+        index=2,
+        help="fast: keyword (sparse) search only · balanced: hybrid search · deep: wider search re-ranked by a cross-encoder · auto: chosen per question"
+    )
+    
+    reasoning_budgets = {"Unlimited": None, "Short (256 tokens)": 256, "Medium (1024 tokens)": 1024, "Off": 0}
+    reasoning_budget = st.selectbox(
+        "🧠 Model Reasoning",
+        list(reasoning_budgets),
+        help="How long reasoning models (DeepSeek-R1, QwQ) may think before answering; shorter is faster"
+    )
+    
+    # Off by default: stateless questions take the async path and share answers with identical ones
+    conversation_mode = st.checkbox(
+        "💬 Conversation Memory",
+        value=False,
+        help="Let follow-up questions refer to earlier ones; when off, each question stands alone"
+    )
+    
     st.divider()
     
     # Document Upload Section
@@ -198,7 +257,7 @@ with st.sidebar:
                 if st.session_state.get("confirm_clear", False):
                     with st.spinner("Clearing all documents..."):
                         try:
-                            response = requests.delete(f"{API_URL}/clear-collection")
+                            response = http.delete(f"{API_URL}/clear-collection")
                             if response.status_code == 200:
                                 result = response.json()
                                 st.success("✅ All documents cleared!")
@@ -244,12 +303,14 @@ with st.sidebar:
                         for uploaded_file in uploaded_files:
                             files.append(("files", (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")))
                         
-                        response = requests.post(f"{API_URL}/upload-pdfs", files=files)
+                        response = http.post(f"{API_URL}/upload-pdfs", files=files)
                         
                         if response.status_code == 200:
                             result = response.json()
                             st.success(f"✅ Uploaded {result['files_processed']} files!")
                             st.info(f"📄 Created {result['chunks_created']} chunks")
+                            if result.get('duplicates_dropped'):
+                                st.info(f"♻️ Skipped {result['duplicates_dropped']} near-duplicate chunks")
                             st.session_state.documents_uploaded += result['chunks_created']
                             # Add system message to chat
                             st.session_state.messages.append({
@@ -279,12 +340,14 @@ with st.sidebar:
                         "metadata": metadata_dict
                     }
                     
-                    response = requests.post(f"{API_URL}/upload", json=[document])
+                    response = http.post(f"{API_URL}/upload", json=[document])
                     
                     if response.status_code == 200:
                         result = response.json()
                         st.success("✅ Document added!")
                         st.info(f"📄 Created {result['chunks_created']} chunks")
+                        if result.get('duplicates_dropped'):
+                            st.info(f"♻️ Skipped {result['duplicates_dropped']} near-duplicate chunks")
                         st.session_state.documents_uploaded += result['chunks_created']
                         # Add system message to chat
                         st.session_state.messages.append({
@@ -341,13 +404,16 @@ with chat_container:
             # Check if there are retriever logs
             retriever_logs = message.get("retriever_logs", None)
             
-            # Check if there's thinking process
-            if "<think>" in content and "</think>" in content:
+            # Reasoning comes split from the answer; older messages may still carry think tags
+            thinking = message.get("reasoning")
+            answer = content
+            if not thinking and "<think>" in content and "</think>" in content:
                 think_start = content.find("<think>") + len("<think>")
                 think_end = content.find("</think>")
                 thinking = content[think_start:think_end].strip()
                 answer = content[think_end + len("</think>"):].strip()
-                
+            
+            if thinking:
                 st.markdown(f"""
                 <div class="chat-message assistant-message">
                     <strong>🤖 Assistant:</strong><br>
@@ -365,6 +431,10 @@ with chat_container:
                 </div>
                 """, unsafe_allow_html=True)
             
+            # With Auto, show which model the question was routed to
+            if message.get("model_tier"):
+                st.caption(f"Answered by {message['served_by']} ({message['model_tier']} tier)")
+            
             # Display retriever logs if available and enabled
             if retriever_logs and st.session_state.show_retriever_logs:
                 with st.expander("📋 Retriever Logs", expanded=False):
@@ -414,37 +484,18 @@ if send_button and user_input.strip():
     # Show typing indicator
     with st.spinner("🤖 Assistant is thinking..."):
         try:
-            # First, get retriever results if logs are enabled
-            retriever_logs = None
-            if st.session_state.show_retriever_logs:
-                try:
-                    retriever_response = requests.get(
-                        f"{API_URL}/test-hybrid-search", 
-                        params={"query": user_input, "limit": retriever_limit}
-                    )
-                    if retriever_response.status_code == 200:
-                        retriever_data = retriever_response.json()
-                        retriever_logs = {
-                            "query": user_input,
-                            "documents": [
-                                {
-                                    "content": doc["page_content"],
-                                    "metadata": doc["metadata"],
-                                    "score": doc.get("score", "N/A")
-                                }
-                                for doc in retriever_data["results"]
-                            ]
-                        }
-                except Exception as e:
-                    print(f"Error getting retriever logs: {e}")
-            
-            # Send query to API with provider and model
-            response = requests.post(
+            # Send query to API with provider and model; the response carries the
+            # retrieved sources, so the retriever log needs no separate search
+            response = http.post(
                 f"{API_URL}/query",
                 json={
                     "question": user_input,
-                    "provider": st.session_state.selected_provider,
-                    "model_name": st.session_state.selected_model
+                    "provider": None if st.session_state.selected_provider == "auto" else st.session_state.selected_provider,
+                    "model_name": st.session_state.selected_model,
+                    "limit": retriever_limit,
+                    "retrieval_mode": retrieval_mode,
+                    "max_reasoning_tokens": reasoning_budgets[reasoning_budget],
+                    "thread_id": st.session_state.thread_id if conversation_mode else None
                 }
             )
             
@@ -454,11 +505,24 @@ if send_button and user_input.strip():
                 # Add assistant response with retriever logs
                 assistant_message = {
                     "role": "assistant",
-                    "content": result["answer"]
+                    "content": result["answer"],
+                    "reasoning": result.get("reasoning"),
+                    "served_by": result.get("served_by"),
+                    "model_tier": result.get("model_tier")
                 }
                 
-                if retriever_logs:
-                    assistant_message["retriever_logs"] = retriever_logs
+                if st.session_state.show_retriever_logs:
+                    assistant_message["retriever_logs"] = {
+                        "query": user_input,
+                        "documents": [
+                            {
+                                "content": doc["page_content"],
+                                "metadata": doc["metadata"],
+                                "score": doc.get("score", "N/A")
+                            }
+                            for doc in result.get("sources", [])
+                        ]
+                    }
                 
                 st.session_state.messages.append(assistant_message)
             else:
@@ -1,193 +1,1166 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
+import re
+import time
 import uuid
-from qdrant_client import QdrantClient
+import asyncio
+import logging
+import threading
+import grpc
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
 from qdrant_client.models import Distance, VectorParams, PointStruct, models
-from fastembed import TextEmbedding, SparseTextEmbedding
 from langchain_core.documents import Document
 from fastapi import HTTPException
 
-from .config import QDRANT_URL, COLLECTION_NAME
+from .config import (
+    QDRANT_MODE,
+    QDRANT_PATH,
+    QDRANT_URL,
+    QDRANT_GRPC_PORT,
+    QDRANT_PREFER_GRPC,
+    QDRANT_TIMEOUT,
+    QDRANT_RETRIES,
+    QDRANT_POOL_SIZE,
+    QDRANT_UPSERT_BATCH_SIZE,
+    QDRANT_UPSERT_PARALLEL,
+    COLLECTION_NAME,
+    DENSE_MODEL_NAME,
+    DEFAULT_TENANT,
+    TENANT_DEDICATED_THRESHOLD,
+    INDEX_GC_DELAY_SECONDS,
+    SHARED_LOCK_TIMEOUT,
+    PARENT_CHILD_CHUNKING,
+    EXTERNAL_CHUNK_TEXT,
+    DEFAULT_RETRIEVAL_MODE,
+    HYBRID_PREFETCH_LIMIT,
+    DEEP_PREFETCH_LIMIT,
+    DEEP_RERANK_CANDIDATES,
+    AUTO_FAST_MAX_WORDS,
+    AUTO_DEEP_MIN_WORDS
+)
+from .admission import embedding_limiter
+from .embeddings import get_embedder, dense_dimension, sparse_requires_idf, LocalReranker
+from .docstore import docstore
+from .dedup import deduplicator
+from .document_processing import split_into_children
+from .metrics import metrics
+from .logging_config import sampled_debug
+from .shared_state import state_sync
 
-# Initialize Qdrant client
-qdrant_client = QdrantClient(url=QDRANT_URL)
+logger = logging.getLogger(__name__)
 
-# Initialize embedding models
-dense_embedding_model = TextEmbedding("thenlper/gte-large")
-sparse_embedding_model = SparseTextEmbedding(model_name="Qdrant/minicoil-v1")
+def _client_options() -> dict:
+    return {
+        "url": QDRANT_URL,
+        "grpc_port": QDRANT_GRPC_PORT,
+        "prefer_grpc": QDRANT_PREFER_GRPC,
+        "timeout": QDRANT_TIMEOUT,
+        "pool_size": QDRANT_POOL_SIZE,
+    }
+
+class _SerializedClient:
+    """Embedded Qdrant client whose calls run one at a time, since local mode is not thread-safe"""
+
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+        def call(*args, **kwargs):
+            with self._lock:
+                return attribute(*args, **kwargs)
+        return call
+
+class _ThreadedAsyncClient:
+    """Async facade over the embedded client, running its calls in worker threads"""
+
+    def __init__(self, client: _SerializedClient):
+        self._client = client
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+# Initialize Qdrant clients: the sync one for worker threads, the async one for the event loop
+if QDRANT_MODE == "remote":
+    qdrant_client = QdrantClient(**_client_options())
+    async_qdrant_client = AsyncQdrantClient(**_client_options())
+    TRANSPORT = "grpc" if QDRANT_PREFER_GRPC else "rest"
+elif QDRANT_MODE in ("local", "memory"):
+    # Embedded storage can be opened only once per process, so both share one client
+    embedded = QdrantClient(location=":memory:") if QDRANT_MODE == "memory" else QdrantClient(path=QDRANT_PATH)
+    qdrant_client = _SerializedClient(embedded)
+    async_qdrant_client = _ThreadedAsyncClient(qdrant_client)
+    TRANSPORT = "embedded"
+else:
+    raise ValueError(f"Unknown QDRANT_MODE: {QDRANT_MODE} (expected remote, local or memory)")
+
+# Embedding models, in-process or behind the shared embedding service
+embedder = get_embedder()
+
+# Cross-encoder for deep retrieval, loaded on first use
+_reranker = None
+_reranker_lock = threading.Lock()
+
+RETRIEVAL_MODES = ("fast", "balanced", "deep")
+
+# Named vectors: the dense one is named after its model, so a collection built with another
+# model is recognized; the sparse name is kept whatever the sparse model, for existing collections
+DENSE_VECTOR = DENSE_MODEL_NAME
+SPARSE_VECTOR = "miniCOIL"
+
+# Payload fields the pipeline needs from a retrieved point
+CONTEXT_PAYLOAD_FIELDS = ["document", "metadata"]
+
+# Payload field holding the tenant; indexed with is_tenant so each tenant's points are co-located
+TENANT_FIELD = "tenant_id"
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Logical collections (COLLECTION_NAME, dedicated tenant collections) are aliases onto
+# versioned physical collections "<name>.v<N>"; tenant ids cannot contain the dot
+VERSION_SEPARATOR = ".v"
 
 # Global variables
 collection_exists = False
+# Tenants that were promoted to their own collection
+dedicated_tenants = set()
+# Version the aliases point at
+index_version = 0
+# Logical collection -> physical collection being rebuilt; uploads go to both while a reindex runs
+rebuilding: Dict[str, str] = {}
+# When the worker running the reindex last showed it is alive
+rebuild_heartbeat = 0.0
+# Bumped whenever the indexed corpus changes, so cached/coalesced answers never span versions
+corpus_version = 0
 
-def create_hybrid_collection():
+# The layout globals above and the corpus version are shared with the other API workers
+# (see app/shared_state.py); whoever changes the layout holds layout_lock() and publishes it
+LAYOUT_KEY = "collections"
+CORPUS_KEY = "corpus"
+
+def layout_lock():
+    return state_sync.lock(LAYOUT_KEY)
+
+def publish_layout():
+    """Share the collection layout with the other workers; the caller holds layout_lock()"""
+    state_sync.publish(LAYOUT_KEY, {
+        "index_version": index_version,
+        "dedicated_tenants": sorted(dedicated_tenants),
+        "rebuilding": dict(rebuilding),
+        "rebuild_heartbeat": rebuild_heartbeat,
+    })
+
+def _apply_layout(layout: dict):
+    """Adopt the layout another worker published"""
+    global collection_exists, index_version, rebuild_heartbeat
+    index_version = layout["index_version"]
+    dedicated_tenants.intersection_update(layout["dedicated_tenants"])
+    dedicated_tenants.update(layout["dedicated_tenants"])
+    rebuild_heartbeat = layout["rebuild_heartbeat"]
+    rebuilding.clear()
+    # A reindex whose worker died would otherwise refuse clears and mirror uploads forever
+    if time.time() - rebuild_heartbeat < SHARED_LOCK_TIMEOUT:
+        rebuilding.update(layout["rebuilding"])
+    collection_exists = True
+
+def _apply_corpus(state: dict):
+    global corpus_version
+    corpus_version = state["version"]
+
+state_sync.subscribe(LAYOUT_KEY, _apply_layout)
+state_sync.subscribe(CORPUS_KEY, _apply_corpus)
+
+def join_shared_state() -> bool:
+    """Startup: read the collections from Qdrant and publish them, keeping a reindex another worker runs"""
+    with layout_lock():
+        created = create_hybrid_collection()
+        if created:
+            publish_layout()
+    return created
+
+def get_corpus_version() -> int:
+    """Return the current corpus version"""
+    return corpus_version
+
+def bump_corpus_version(minimum: int = 0) -> int:
+    """Mark the corpus as changed in every worker; minimum carries over the version of a restored snapshot"""
+    global corpus_version
+    state = state_sync.update(
+        CORPUS_KEY, lambda state: {"version": max(state.get("version", corpus_version) + 1, minimum)}
+    )
+    corpus_version = state["version"]
+    return corpus_version
+
+TRANSIENT_GRPC_CODES = (
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+)
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a failed Qdrant request is worth retrying"""
+    if isinstance(error, ResponseHandlingException):
+        # Connection errors and timeouts of the REST client
+        return True
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in (502, 503, 504)
+    if isinstance(error, grpc.RpcError):
+        return error.code() in TRANSIENT_GRPC_CODES
+    return False
+
+def _backoff(attempt: int) -> float:
+    return min(2.0, 0.1 * 2 ** attempt)
+
+def _call(op: str, fn, **kwargs):
+    """Run a Qdrant request, retrying transient failures"""
+    for attempt in range(QDRANT_RETRIES + 1):
+        start = time.monotonic()
+        try:
+            result = fn(**kwargs)
+        except Exception as e:
+            if attempt == QDRANT_RETRIES or not _is_transient(e):
+                raise
+            metrics.inc("qdrant_retries_total", op=op)
+            time.sleep(_backoff(attempt))
+            continue
+        metrics.observe("qdrant_request_seconds", time.monotonic() - start, op=op, transport=TRANSPORT)
+        return result
+
+async def _acall(op: str, fn, **kwargs):
+    """Async variant of _call for AsyncQdrantClient methods"""
+    for attempt in range(QDRANT_RETRIES + 1):
+        start = time.monotonic()
+        try:
+            result = await fn(**kwargs)
+        except Exception as e:
+            if attempt == QDRANT_RETRIES or not _is_transient(e):
+                raise
+            metrics.inc("qdrant_retries_total", op=op)
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        metrics.observe("qdrant_request_seconds", time.monotonic() - start, op=op, transport=TRANSPORT)
+        return result
+
+def validate_tenant(tenant_id: str = None) -> str:
+    """Return the tenant id to use, rejecting ids unsafe for collection names"""
+    tenant_id = tenant_id or DEFAULT_TENANT
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise HTTPException(status_code=400, detail=f"Invalid tenant id: {tenant_id!r}")
+    return tenant_id
+
+def dedicated_collection_name(tenant_id: str) -> str:
+    """Name of the collection a large tenant is moved to"""
+    return f"{COLLECTION_NAME}__{tenant_id}"
+
+def tenant_filter(tenant_id: str) -> models.Filter:
+    """Filter matching one tenant's points; the default tenant also owns points indexed before tenancy"""
+    match = models.FieldCondition(key=TENANT_FIELD, match=models.MatchValue(value=tenant_id))
+    if tenant_id == DEFAULT_TENANT:
+        return models.Filter(should=[
+            match,
+            models.IsEmptyCondition(is_empty=models.PayloadField(key=TENANT_FIELD)),
+        ])
+    return models.Filter(must=[match])
+
+def resolve_collection(tenant_id: str) -> str:
+    """Collection holding a tenant's points"""
+    if tenant_id in dedicated_tenants:
+        return dedicated_collection_name(tenant_id)
+    return COLLECTION_NAME
+
+def versioned_collection_name(name: str, version: int) -> str:
+    """Physical collection of one version of a logical collection"""
+    return f"{name}{VERSION_SEPARATOR}{version}"
+
+def split_version(collection_name: str) -> Tuple[str, int]:
+    """(logical name, version) of a physical collection; version 0 for collections created before aliases"""
+    name, separator, version = collection_name.rpartition(VERSION_SEPARATOR)
+    if separator and version.isdigit():
+        return name, int(version)
+    return collection_name, 0
+
+def is_index_collection(name: str) -> bool:
+    """Whether name is a logical index collection: the shared one or a dedicated tenant one"""
+    if split_version(name)[1]:
+        return False
+    return name == COLLECTION_NAME or name.startswith(dedicated_collection_name(""))
+
+def index_aliases() -> Dict[str, str]:
+    """Physical collection behind each aliased logical index collection"""
+    aliases = qdrant_client.get_aliases().aliases
+    return {a.alias_name: a.collection_name for a in aliases if is_index_collection(a.alias_name)}
+
+def index_collections() -> Dict[str, str]:
+    """Physical collection behind every logical index collection, including pre-alias ones named like their logical name"""
+    collections = {
+        name: name for name in (c.name for c in qdrant_client.get_collections().collections)
+        if is_index_collection(name)
+    }
+    collections.update(index_aliases())
+    return collections
+
+def next_index_version() -> int:
+    """A version above every existing physical index collection, so a new build never meets a leftover"""
+    versions = [
+        version for name, version in (split_version(c.name) for c in qdrant_client.get_collections().collections)
+        if is_index_collection(name)
+    ]
+    return max([index_version, *versions]) + 1
+
+def _create_collection(collection_name: str, shared: bool):
     """Create a collection with hybrid vector configuration"""
-    global collection_exists
+    qdrant_client.create_collection(
+        collection_name=collection_name,
+        vectors_config={
+            DENSE_VECTOR: models.VectorParams(
+                size=dense_dimension(),
+                distance=models.Distance.COSINE,
+            ),
+        },
+        sparse_vectors_config={
+            SPARSE_VECTOR: models.SparseVectorParams(
+                modifier=models.Modifier.IDF if sparse_requires_idf() else None
+            ),
+        },
+        # Searches on the shared collection filter by tenant, so also build per-tenant HNSW links
+        hnsw_config=models.HnswConfigDiff(payload_m=16) if shared else None
+    )
+    if shared:
+        _ensure_tenant_index(collection_name)
+
+def _create_aliased_collection(name: str, shared: bool):
+    """Create the current version of a logical collection and point its alias at it"""
+    physical = versioned_collection_name(name, max(index_version, 1))
+    if qdrant_client.collection_exists(physical):
+        # A cleared tenant's collection still waiting to be dropped
+        qdrant_client.delete_collection(collection_name=physical)
+    _create_collection(physical, shared)
+    swap_aliases({name: physical})
+
+def swap_aliases(targets: Dict[str, str], drop: List[str] = ()) -> List[str]:
+    """Point logical collections at new physical ones and remove the drop ones, in one atomic
+    alias update; returns the physical collections that lost their alias"""
+    aliases = index_aliases()
+    names = {c.name for c in qdrant_client.get_collections().collections}
+    for name in [*targets, *drop]:
+        if name in names:
+            # A collection created before aliases holds the logical name, which an alias cannot
+            # share. It has to go first, so searches fail for a moment this one time
+            qdrant_client.delete_collection(collection_name=name)
+    
+    operations = [
+        models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=name))
+        for name in [*targets, *drop] if name in aliases
+    ]
+    operations += [
+        models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=physical, alias_name=name))
+        for name, physical in targets.items()
+    ]
+    if operations:
+        qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+    return [aliases[name] for name in [*targets, *drop] if name in aliases and aliases[name] != targets.get(name)]
+
+def drop_collections(names: List[str], delay: float = INDEX_GC_DELAY_SECONDS):
+    """Delete physical collections no alias points at, after delay seconds so running searches finish"""
+    def drop():
+        try:
+            live = set(index_aliases().values())
+            for name in names:
+                if name not in live and qdrant_client.collection_exists(name):
+                    qdrant_client.delete_collection(collection_name=name)
+                    logger.info(f"Dropped old collection version {name}")
+        except Exception as e:
+            logger.error(f"Error dropping old collection versions: {e}")
+    
+    if not names:
+        return
+    if delay > 0:
+        timer = threading.Timer(delay, drop)
+        timer.daemon = True
+        timer.start()
+    else:
+        drop()
+
+def _ensure_tenant_index(collection_name: str):
+    """Create the is_tenant keyword index on the tenant field if it is missing"""
+    if QDRANT_MODE != "remote":
+        # Embedded storage scans payloads and has no payload indexes
+        return
+    payload_schema = qdrant_client.get_collection(collection_name).payload_schema or {}
+    if TENANT_FIELD not in payload_schema:
+        qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name=TENANT_FIELD,
+            field_schema=models.KeywordIndexParams(
+                type=models.KeywordIndexType.KEYWORD,
+                is_tenant=True,
+            ),
+        )
+
+def _check_dense_vector(collection_name: str):
+    """Warn when the collection was built with another dense model than the configured one"""
+    vectors = qdrant_client.get_collection(collection_name).config.params.vectors or {}
+    params = vectors.get(DENSE_VECTOR) if isinstance(vectors, dict) else None
+    if params is None or params.size != dense_dimension():
+        logger.warning(f"{collection_name} has no {dense_dimension()}-dimensional {DENSE_VECTOR} vector "
+              f"(built with {sorted(vectors) if isinstance(vectors, dict) else 'an unnamed vector'}); "
+              f"dense searches fail until POST /admin/reindex rebuilds it")
+
+def create_hybrid_collection():
+    """Create the shared collection with hybrid vector configuration"""
+    global collection_exists, index_version
     
     try:
         # Check if collection exists
-        collections = qdrant_client.get_collections()
-        collection_names = [col.name for col in collections.collections]
+        collections = index_collections()
+        index_version = max([split_version(physical)[1] for physical in collections.values()], default=0)
+        
+        # Pick up tenants that were promoted to their own collection
+        prefix = dedicated_collection_name("")
+        found = {name[len(prefix):] for name in collections if name.startswith(prefix)}
+        dedicated_tenants.intersection_update(found)
+        dedicated_tenants.update(found)
         
-        if COLLECTION_NAME in collection_names:
-            print(f"Collection {COLLECTION_NAME} already exists")
+        # Versions a finished clear or reindex left behind, e.g. when the process stopped before dropping them
+        live = set(collections.values())
+        drop_collections([
+            c.name for c in qdrant_client.get_collections().collections
+            if c.name not in live and is_index_collection(split_version(c.name)[0])
+            and 0 < split_version(c.name)[1] < index_version
+        ], delay=0)
+        
+        if COLLECTION_NAME in collections:
+            logger.info(f"Collection {COLLECTION_NAME} already exists ({collections[COLLECTION_NAME]})")
+            _ensure_tenant_index(COLLECTION_NAME)
+            _check_dense_vector(COLLECTION_NAME)
             collection_exists = True
             return True
             
         # Create collection with hybrid vectors
-        qdrant_client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config={
-                "thenlper/gte-large": models.VectorParams(
-                    size=1024,
-                    distance=models.Distance.COSINE,
-                ),
-            },
-            sparse_vectors_config={
-                "miniCOIL": models.SparseVectorParams(modifier=models.Modifier.IDF),
-            }
-        )
+        _create_aliased_collection(COLLECTION_NAME, shared=True)
         
-        print(f"Created hybrid collection: {COLLECTION_NAME}")
+        logger.info(f"Created hybrid collection: {COLLECTION_NAME}")
         collection_exists = True
         return True
         
     except Exception as e:
-        print(f"Error creating collection: {e}")
+        logger.error(f"Error creating collection: {e}")
         return False
 
-def index_documents_hybrid(documents: List[Document]):
-    """Index documents with both dense and sparse embeddings"""
+def replace_collections(targets: Dict[str, str]) -> List[str]:
+    """Point the aliases at restored physical collections (a snapshot import), removing the
+    logical collections targets lacks, and publish the layout; the caller holds layout_lock().
+    Returns the previous physical collections, for drop_collections() once searches finished"""
+    global collection_exists, index_version
+    _refuse_while_rebuilding("restore")
+    stale = [name for name in index_collections() if name not in targets]
+    previous = swap_aliases(targets, drop=stale)
+    index_version = max(split_version(physical)[1] for physical in targets.values())
+    prefix = dedicated_collection_name("")
+    dedicated_tenants.clear()
+    dedicated_tenants.update(name[len(prefix):] for name in targets if name.startswith(prefix))
+    collection_exists = True
+    publish_layout()
+    return previous
+
+def _promote_tenant(tenant_id: str):
+    """Move a tenant that outgrew the shared collection into its own collection"""
+    target = dedicated_collection_name(tenant_id)
+    _create_aliased_collection(target, shared=False)
+    
+    offset = None
+    moved = 0
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=tenant_filter(tenant_id),
+            with_payload=True,
+            with_vectors=True,
+            limit=256,
+            offset=offset,
+        )
+        if points:
+            qdrant_client.upsert(
+                collection_name=target,
+                points=[PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points]
+            )
+            moved += len(points)
+        if offset is None:
+            break
+    
+    dedicated_tenants.add(tenant_id)
+    publish_layout()
+    qdrant_client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.FilterSelector(filter=tenant_filter(tenant_id)),
+    )
+    logger.info(f"Moved tenant '{tenant_id}' ({moved} points) to collection {target}")
+
+def _collection_for_upsert(tenant_id: str, incoming: int) -> str:
+    """Collection new points of a tenant go to, promoting the tenant once it passes the size threshold"""
+    # Writes must see promotions and reindexes other workers started a moment ago
+    state_sync.poll()
+    if tenant_id in dedicated_tenants or not TENANT_DEDICATED_THRESHOLD or rebuilding:
+        # A reindex only rebuilds the collections that existed when it started, so promotion waits
+        return resolve_collection(tenant_id)
+    if not _passes_threshold(tenant_id, incoming):
+        return resolve_collection(tenant_id)
+    # Concurrent writers, in any worker, must not promote the same tenant twice; only
+    # uploads that would promote take the lock, and check again holding it
+    with layout_lock():
+        if tenant_id not in dedicated_tenants and not rebuilding and _passes_threshold(tenant_id, incoming):
+            _promote_tenant(tenant_id)
+    return resolve_collection(tenant_id)
+
+def _passes_threshold(tenant_id: str, incoming: int) -> bool:
+    existing = qdrant_client.count(
+        collection_name=COLLECTION_NAME,
+        count_filter=tenant_filter(tenant_id),
+        exact=True,
+    ).count
+    return existing + incoming > TENANT_DEDICATED_THRESHOLD
+
+def _store_parents(documents: List[Document], tenant_id: str, ids: List[str] = None, docstore_prefix: str = ""):
+    """Parent-child mode: keep documents as parents in the docstore, return their children and child ids"""
+    parents = []
+    children = []
+    child_ids = []
+    for idx, doc in enumerate(documents):
+        parent_id = ids[idx] if ids else str(uuid.uuid4())
+        parents.append((parent_id, tenant_id, doc))
+        for child_idx, child in enumerate(split_into_children(doc, parent_id)):
+            children.append(child)
+            # Derived from the parent id, so re-indexing a parent overwrites its children
+            child_ids.append(str(uuid.uuid5(uuid.UUID(parent_id), str(child_idx))))
+    docstore.put_many((docstore_prefix + pid, tenant, doc) for pid, tenant, doc in parents)
+    return children, child_ids
+
+def staging_prefix(version: int) -> str:
+    """Docstore id prefix of the records a reindex to version writes; they replace the live ones on the swap"""
+    return f"v{version}:"
+
+def build_points(documents: List[Document], tenant_id: str, ids: List[str] = None,
+                 docstore_prefix: str = "") -> List[PointStruct]:
+    """Embed documents and build their Qdrant points; ids default to random UUIDs.
+
+    docstore_prefix stages the docstore records (a reindex), so the live version keeps reading its own.
+    """
+    if PARENT_CHILD_CHUNKING:
+        documents, ids = _store_parents(documents, tenant_id, ids, docstore_prefix)
+    texts = [doc.page_content for doc in documents]
+    with embedding_limiter("index").slot():
+        dense_embeddings, sparse_embeddings = embedder.embed_documents(texts)
+    
+    point_ids = ids or [str(uuid.uuid4()) for _ in documents]
+    if EXTERNAL_CHUNK_TEXT:
+        # Qdrant keeps only ids, vectors and filterable metadata; the text goes to the docstore
+        docstore.put_many(
+            (docstore_prefix + point_id, tenant_id, Document(page_content=doc.page_content))
+            for point_id, doc in zip(point_ids, documents)
+        )
+    
+    points = []
+    for point_id, dense_emb, sparse_emb, doc in zip(point_ids, dense_embeddings, sparse_embeddings, documents):
+        payload = {"metadata": doc.metadata, TENANT_FIELD: tenant_id}
+        if not EXTERNAL_CHUNK_TEXT:
+            payload["document"] = doc.page_content
+        points.append(PointStruct(
+            id=point_id,
+            vector={
+                DENSE_VECTOR: dense_emb,
+                SPARSE_VECTOR: sparse_emb,
+            },
+            payload=payload
+        ))
+    return points
+
+def _batches(points: List[PointStruct]) -> List[List[PointStruct]]:
+    size = max(1, QDRANT_UPSERT_BATCH_SIZE)
+    return [points[i:i + size] for i in range(0, len(points), size)]
+
+def write_points(collection_name: str, points: List[PointStruct]):
+    """Upsert points into one collection in batches, bypassing tenant routing"""
+    for batch in _batches(points):
+        _call("upsert", qdrant_client.upsert, collection_name=collection_name, points=batch)
+
+def upsert_points(points: List[PointStruct], tenant_id: str) -> int:
+    """Store a tenant's points in batches; point ids are fixed client-side, so retried batches are idempotent"""
+    collection_name = _collection_for_upsert(tenant_id, len(points))
+    for batch in _batches(points):
+        _call("upsert", qdrant_client.upsert, collection_name=collection_name, points=batch)
+        if collection_name in rebuilding:
+            _call("upsert", qdrant_client.upsert, collection_name=rebuilding[collection_name], points=batch)
+            _stage_mirrored(batch)
+    bump_corpus_version()
+    return len(points)
+
+def _rebuild_prefix() -> Optional[str]:
+    """Staging prefix of the running reindex, if any"""
+    targets = list(rebuilding.values())
+    return staging_prefix(split_version(targets[0])[1]) if targets else None
+
+def _stage_mirrored(points: List[PointStruct]):
+    """Stage the docstore records of points mirrored into a rebuild, so promoting it keeps them"""
+    prefix = _rebuild_prefix()
+    if not prefix:
+        return
+    tenants = {}
+    for point in points:
+        tenant_id = point.payload.get(TENANT_FIELD)
+        if EXTERNAL_CHUNK_TEXT:
+            tenants[str(point.id)] = tenant_id
+        parent_id = point.payload.get("metadata", {}).get("parent_id")
+        if PARENT_CHILD_CHUNKING and parent_id:
+            tenants[parent_id] = tenant_id
+    records = docstore.get_many(list(tenants))
+    docstore.put_many((prefix + record_id, tenants[record_id], doc) for record_id, doc in records.items())
+
+def discard_records(ids: List[str], points: Optional[List[PointStruct]]):
+    """Delete the docstore records build_points wrote for documents that were not indexed after all"""
+    record_ids = list(ids) if PARENT_CHILD_CHUNKING else []
+    if EXTERNAL_CHUNK_TEXT and points:
+        record_ids += [str(point.id) for point in points]
+    # Staged copies too, if the points were mirrored into a running reindex
+    prefix = _rebuild_prefix()
+    if prefix:
+        record_ids += [prefix + record_id for record_id in record_ids]
+    try:
+        docstore.delete_many(record_ids)
+    except Exception as e:
+        logger.warning(f"Could not delete the docstore records of a failed upload: {e}")
+
+def delete_source(tenant_id: str, source: str) -> List[str]:
+    """Delete everything indexed from one source (metadata.source) of a tenant: its points, their
+    docstore records and dedup signatures. Returns the ids the chunks were indexed and deduplicated
+    under (the parent ids in parent-child mode)"""
+    tenant_id = validate_tenant(tenant_id)
+    collection_name = resolve_collection(tenant_id)
+    source_filter = models.Filter(must=[
+        tenant_filter(tenant_id),
+        models.FieldCondition(key="metadata.source", match=models.MatchValue(value=source)),
+    ])
+    point_ids, parent_ids = [], set()
+    offset = None
+    while True:
+        points, offset = _call("scroll", qdrant_client.scroll, collection_name=collection_name,
+                               scroll_filter=source_filter, with_payload=["metadata"], limit=256, offset=offset)
+        for point in points:
+            point_ids.append(str(point.id))
+            parent_id = (point.payload or {}).get("metadata", {}).get("parent_id")
+            if parent_id:
+                parent_ids.add(parent_id)
+        if offset is None:
+            break
+    if not point_ids:
+        return []
+    
+    selector = models.FilterSelector(filter=source_filter)
+    _call("delete", qdrant_client.delete, collection_name=collection_name, points_selector=selector)
+    if collection_name in rebuilding:
+        _call("delete", qdrant_client.delete, collection_name=rebuilding[collection_name], points_selector=selector)
+    # Chunks were deduplicated under the ids they were indexed with: parents in parent-child mode
+    indexed_ids = list(parent_ids) if parent_ids else point_ids
+    record_ids = list(parent_ids) + (point_ids if EXTERNAL_CHUNK_TEXT else [])
+    prefix = _rebuild_prefix()
+    if prefix:
+        record_ids += [prefix + record_id for record_id in record_ids]
+    docstore.delete_many(record_ids)
+    deduplicator.forget(indexed_ids)
+    bump_corpus_version()
+    return indexed_ids
+
+def deduplicate(documents: List[Document], tenant_id: str = None) -> Tuple[List[Document], List[str], int]:
+    """Near-duplicate stage of ingestion: the documents to index, their point ids and how many were dropped"""
+    ids = [str(uuid.uuid4()) for _ in documents]
+    documents, ids, dropped = deduplicator.filter(documents, validate_tenant(tenant_id), ids)
+    if dropped:
+        metrics.inc("ingest_duplicates_dropped_total", dropped, mode=deduplicator.mode)
+        logger.info(f"Dropped {dropped} near-duplicate chunks", extra={"tenant_id": tenant_id})
+    return documents, ids, dropped
+
+def index_documents_hybrid(documents: List[Document], tenant_id: str = None, ids: List[str] = None):
+    """Index documents with both dense and sparse embeddings; ids come from deduplicate() or are random"""
+    tenant_id = validate_tenant(tenant_id)
     if not collection_exists:
         if not create_hybrid_collection():
             raise HTTPException(status_code=500, detail="Failed to create collection")
     
+    # Fixed up front, so the docstore records of a failed upload can be found again
+    ids = ids or [str(uuid.uuid4()) for _ in documents]
+    points = None
     try:
-        # Generate embeddings
-        texts = [doc.page_content for doc in documents]
-        dense_embeddings = list(dense_embedding_model.embed(texts))
-        sparse_embeddings = list(sparse_embedding_model.embed(texts))
+        points = build_points(documents, tenant_id, ids)
+        upsert_points(points, tenant_id)
+        logger.info(f"Indexed {len(points)} documents with hybrid embeddings", extra={"tenant_id": tenant_id})
+        return len(points)
         
-        # Create points for Qdrant
-        points = []
-        for idx, (dense_emb, sparse_emb, doc) in enumerate(zip(dense_embeddings, sparse_embeddings, documents)):
-            point_id = str(uuid.uuid4())
-            point = PointStruct(
-                id=point_id,
-                vector={
-                    "thenlper/gte-large": dense_emb,
-                    "miniCOIL": sparse_emb.as_object(),
-                },
-                payload={
-                    "document": doc.page_content,
-                    "metadata": doc.metadata
-                }
-            )
-            points.append(point)
+    except HTTPException:
+        deduplicator.forget(ids)
+        discard_records(ids, points)
+        raise
+    except Exception as e:
+        deduplicator.forget(ids)
+        discard_records(ids, points)
+        logger.error(f"Error indexing documents: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to index documents: {str(e)}")
+
+async def aindex_documents_hybrid(documents: List[Document], tenant_id: str = None, ids: List[str] = None):
+    """Async index_documents_hybrid: embeds in a worker thread and upserts batches concurrently"""
+    tenant_id = validate_tenant(tenant_id)
+    if not collection_exists:
+        if not await asyncio.to_thread(create_hybrid_collection):
+            raise HTTPException(status_code=500, detail="Failed to create collection")
+    
+    # Fixed up front, so the docstore records of a failed upload can be found again
+    ids = ids or [str(uuid.uuid4()) for _ in documents]
+    points = None
+    try:
+        points = await asyncio.to_thread(build_points, documents, tenant_id, ids)
+        collection_name = await asyncio.to_thread(_collection_for_upsert, tenant_id, len(points))
         
-        # Upsert to Qdrant
-        operation_info = qdrant_client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=points
-        )
+        semaphore = asyncio.Semaphore(max(1, QDRANT_UPSERT_PARALLEL))
+        async def upsert(batch):
+            async with semaphore:
+                await _acall("upsert", async_qdrant_client.upsert, collection_name=collection_name, points=batch)
+                if collection_name in rebuilding:
+                    await _acall("upsert", async_qdrant_client.upsert,
+                                 collection_name=rebuilding[collection_name], points=batch)
+                    await asyncio.to_thread(_stage_mirrored, batch)
+        await asyncio.gather(*(upsert(batch) for batch in _batches(points)))
         
-        print(f"Indexed {len(points)} documents with hybrid embeddings")
+        # A write to the shared store, which may wait for other workers
+        await asyncio.to_thread(bump_corpus_version)
+        logger.info(f"Indexed {len(points)} documents with hybrid embeddings", extra={"tenant_id": tenant_id})
         return len(points)
         
+    except HTTPException:
+        await asyncio.to_thread(deduplicator.forget, ids)
+        await asyncio.to_thread(discard_records, ids, points)
+        raise
     except Exception as e:
-        print(f"Error indexing documents: {e}")
+        await asyncio.to_thread(deduplicator.forget, ids)
+        await asyncio.to_thread(discard_records, ids, points)
+        logger.error(f"Error indexing documents: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to index documents: {str(e)}")
 
-def hybrid_search(query: str, limit: int = 4) -> List[Document]:
+def payload_selector(include: List[str] = None, exclude: List[str] = None):
+    """with_payload value returning only the included, or all but the excluded, payload fields"""
+    if include:
+        return models.PayloadSelectorInclude(include=include)
+    if exclude:
+        return models.PayloadSelectorExclude(exclude=exclude)
+    return True
+
+def hybrid_search(query: str, limit: int = 4, tenant_id: str = None, with_payload=True,
+                  retrieval_mode: str = None) -> List[Document]:
     """Perform hybrid search with prefetch"""
+    results = hybrid_search_with_scores(query, limit=limit, tenant_id=tenant_id, with_payload=with_payload,
+                                        retrieval_mode=retrieval_mode)
+    return [doc for doc, _ in results]
+
+async def ahybrid_search(query: str, limit: int = 4, tenant_id: str = None, with_payload=True,
+                         retrieval_mode: str = None) -> List[Document]:
+    """Async hybrid_search"""
+    results = await ahybrid_search_with_scores(query, limit=limit, tenant_id=tenant_id, with_payload=with_payload,
+                                               retrieval_mode=retrieval_mode)
+    return [doc for doc, _ in results]
+
+# Queries that look like identifiers or exact phrases: error codes, SKUs, "quoted text"
+IDENTIFIER_PATTERN = re.compile(r'^\s*("[^"]+"|\S*[\d_#/.:-]\S*)\s*$')
+QUESTION_WORDS = {"what", "why", "how", "when", "where", "which", "who", "whom", "whose",
+                  "explain", "describe", "is", "are", "can", "does", "do", "should"}
+COMPARISON_PATTERN = re.compile(r"\b(compare|comparison|differences?|versus|vs\.?|trade-?offs?|pros and cons)\b", re.IGNORECASE)
+
+def choose_retrieval_mode(query: str) -> str:
+    """The auto policy: keyword lookups go fast, long or comparative questions go deep"""
+    words = query.split()
+    if IDENTIFIER_PATTERN.match(query):
+        return "fast"
+    if len(words) <= AUTO_FAST_MAX_WORDS and "?" not in query and words[0].lower() not in QUESTION_WORDS:
+        return "fast"
+    if len(words) >= AUTO_DEEP_MIN_WORDS or query.count("?") > 1 or COMPARISON_PATTERN.search(query):
+        return "deep"
+    return "balanced"
+
+def resolve_retrieval_mode(query: str, retrieval_mode: str = None) -> str:
+    """The concrete mode for a query: the requested one, DEFAULT_RETRIEVAL_MODE, or the auto policy"""
+    mode = retrieval_mode or DEFAULT_RETRIEVAL_MODE
+    if mode == "auto":
+        return choose_retrieval_mode(query) if query.strip() else "balanced"
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown retrieval mode: {mode}")
+    return mode
+
+def _embed_query(query: str, mode: str = "balanced"):
+    """Dense and sparse query embeddings, under the query embedding limiter; fast mode skips the dense model"""
+    with embedding_limiter("query").slot():
+        if mode == "fast":
+            return None, embedder.embed_sparse_query(query)
+        return embedder.embed_query(query)
+
+def _search_request(dense_vector, sparse_vector, limit: int, tenant_id: str, with_payload=True,
+                    mode: str = "balanced") -> dict:
+    """query_points arguments for a search of one tenant in the given retrieval mode"""
+    # Only the tenant's own points are searched
+    collection_name = resolve_collection(tenant_id)
+    query_filter = tenant_filter(tenant_id) if collection_name == COLLECTION_NAME else None
+    
+    if mode == "fast":
+        # Sparse only: a single index lookup, no prefetch
+        return {
+            "collection_name": collection_name,
+            "query": sparse_vector,
+            "using": SPARSE_VECTOR,
+            "query_filter": query_filter,
+            "with_payload": with_payload,
+            "limit": limit,
+        }
+    
+    # Deep mode casts a wider net and keeps more fused candidates for the cross-encoder
+    prefetch_limit = DEEP_PREFETCH_LIMIT if mode == "deep" else HYBRID_PREFETCH_LIMIT
+    if mode == "deep":
+        limit = max(limit, DEEP_RERANK_CANDIDATES)
+    
+    # Create prefetch queries
+    prefetch = [
+        models.Prefetch(
+            query=dense_vector,
+            using=DENSE_VECTOR,
+            filter=query_filter,
+            limit=prefetch_limit,
+        ),
+        models.Prefetch(
+            query=sparse_vector,
+            using=SPARSE_VECTOR,
+            filter=query_filter,
+            limit=prefetch_limit,
+        )
+    ]
+    
+    # Hybrid search with re-ranking
+    return {
+        "collection_name": collection_name,
+        "prefetch": prefetch,
+        "query": dense_vector,
+        "using": DENSE_VECTOR,
+        "query_filter": query_filter,
+        "with_payload": with_payload,
+        "limit": limit,
+    }
+
+def _get_reranker() -> LocalReranker:
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = LocalReranker()
+        return _reranker
+
+def _rerank(query: str, scored: List[Tuple[Document, float]], limit: int,
+            keep_text: bool = True) -> List[Tuple[Document, float]]:
+    """Reorder candidates by cross-encoder relevance and keep the top limit.
+
+    Scores stay the hybrid (dense) scores so MIN_RELEVANCE_SCORE means the same in
+    every mode; the cross-encoder score is added to the metadata as rerank_score.
+    """
+    if not scored:
+        return scored
+    start = time.monotonic()
+    with embedding_limiter("query").slot():
+        relevance = _get_reranker().rerank(query, [doc.page_content for doc, _ in scored])
+    metrics.observe("rerank_seconds", time.monotonic() - start)
+    
+    ranked = sorted(zip(scored, relevance), key=lambda item: item[1], reverse=True)[:limit]
+    reranked = []
+    for (doc, score), rerank_score in ranked:
+        metadata = {**doc.metadata, "rerank_score": rerank_score}
+        reranked.append((Document(page_content=doc.page_content if keep_text else "", metadata=metadata), score))
+    return reranked
+
+def _with_document(with_payload):
+    """with_payload extended with the chunk text, which the cross-encoder needs"""
+    if _wants_document(with_payload):
+        return with_payload
+    if with_payload is False:
+        return ["document"]
+    if isinstance(with_payload, models.PayloadSelectorInclude):
+        return models.PayloadSelectorInclude(include=[*with_payload.include, "document"])
+    if isinstance(with_payload, models.PayloadSelectorExclude):
+        return models.PayloadSelectorExclude(exclude=[f for f in with_payload.exclude if f != "document"])
+    return [*with_payload, "document"]
+
+def _wants_document(with_payload) -> bool:
+    """Whether a with_payload value asks for the chunk text"""
+    if isinstance(with_payload, bool):
+        return with_payload
+    if isinstance(with_payload, models.PayloadSelectorInclude):
+        return "document" in with_payload.include
+    if isinstance(with_payload, models.PayloadSelectorExclude):
+        return "document" not in with_payload.exclude
+    return "document" in with_payload
+
+def _scored_documents(results, with_payload=True) -> List[Tuple[Document, float]]:
+    """Convert query_points results to (Document, score) pairs, hydrating text kept in the docstore"""
+    points = results.points
+    texts = {}
+    if _wants_document(with_payload):
+        missing = [str(point.id) for point in points if "document" not in (point.payload or {})]
+        if missing:
+            start = time.monotonic()
+            texts = docstore.get_many(missing)
+            metrics.observe("docstore_fetch_seconds", time.monotonic() - start, store="chunks")
+    
+    retrieved_docs = []
+    for point in points:
+        payload = point.payload or {}
+        text = payload.get("document")
+        if text is None:
+            hydrated = texts.get(str(point.id))
+            text = hydrated.page_content if hydrated else ""
+        doc = Document(page_content=text, metadata=payload.get("metadata", {}))
+        retrieved_docs.append((doc, point.score))
+    return retrieved_docs
+
+def hybrid_search_with_scores(query: str, limit: int = 4, tenant_id: str = None,
+                              with_payload=True, retrieval_mode: str = None) -> List[Tuple[Document, float]]:
+    """Perform hybrid search with prefetch, returning (document, score) pairs.
+
+    with_payload limits the payload fields Qdrant returns (see payload_selector);
+    retrieval_mode is "fast", "balanced", "deep" or "auto" (default DEFAULT_RETRIEVAL_MODE).
+    """
+    tenant_id = validate_tenant(tenant_id)
+    mode = resolve_retrieval_mode(query, retrieval_mode)
     if not collection_exists:
         raise HTTPException(status_code=503, detail="Collection not available")
     
     try:
-        # Generate query embeddings
-        dense_vector = next(dense_embedding_model.query_embed(query))
-        sparse_vector = next(sparse_embedding_model.query_embed(query))
-        
-        # Create prefetch queries
-        prefetch = [
-            models.Prefetch(
-                query=dense_vector,
-                using="thenlper/gte-large",
-                limit=20,
-            ),
-            models.Prefetch(
-                query=models.SparseVector(**sparse_vector.as_object()),
-                using="miniCOIL",
-                limit=20,
-            )
-        ]
+        start = time.monotonic()
+        payload = _with_document(with_payload) if mode == "deep" else with_payload
+        dense_vector, sparse_vector = _embed_query(query, mode)
+        results = _call("query", qdrant_client.query_points,
+                        **_search_request(dense_vector, sparse_vector, limit, tenant_id, payload, mode))
+        sampled_debug(logger, "Hybrid search returned %d points", len(results.points), mode=mode, tenant_id=tenant_id)
+        scored = _scored_documents(results, payload)
+        if mode == "deep":
+            scored = _rerank(query, scored, limit, keep_text=_wants_document(with_payload))
+        metrics.observe("retrieval_seconds", time.monotonic() - start, mode=mode)
+        return scored
         
-        # Perform hybrid search with re-ranking
-        results = qdrant_client.query_points(
-            collection_name=COLLECTION_NAME,
-            prefetch=prefetch,
-            query=dense_vector,
-            using="thenlper/gte-large",
-            with_payload=True,
-            limit=limit,
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in hybrid search: {e}")
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+async def ahybrid_search_with_scores(query: str, limit: int = 4, tenant_id: str = None,
+                                     with_payload=True, retrieval_mode: str = None) -> List[Tuple[Document, float]]:
+    """Async hybrid_search_with_scores: embeds in a worker thread, queries with the async client"""
+    tenant_id = validate_tenant(tenant_id)
+    mode = resolve_retrieval_mode(query, retrieval_mode)
+    if not collection_exists:
+        raise HTTPException(status_code=503, detail="Collection not available")
+    
+    try:
+        start = time.monotonic()
+        payload = _with_document(with_payload) if mode == "deep" else with_payload
+        dense_vector, sparse_vector = await asyncio.to_thread(_embed_query, query, mode)
+        results = await _acall(
+            "query", async_qdrant_client.query_points,
+            **_search_request(dense_vector, sparse_vector, limit, tenant_id, payload, mode)
         )
-        print(results)
-        # Convert to Document objects
-        retrieved_docs = []
-        for point in results.points:
-            doc = Document(
-                page_content=point.payload.get("document", ""),
-                metadata=point.payload.get("metadata", {})
-            )
-            retrieved_docs.append(doc)
-        
-        return retrieved_docs
+        sampled_debug(logger, "Hybrid search returned %d points", len(results.points), mode=mode, tenant_id=tenant_id)
+        # Hydration reads local files, so keep it off the event loop
+        scored = await asyncio.to_thread(_scored_documents, results, payload)
+        if mode == "deep":
+            scored = await asyncio.to_thread(_rerank, query, scored, limit, _wants_document(with_payload))
+        metrics.observe("retrieval_seconds", time.monotonic() - start, mode=mode)
+        return scored
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in hybrid search: {e}")
+        logger.error(f"Error in hybrid search: {e}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
-def clear_collection():
-    """Clear all documents from the collection"""
-    global collection_exists
+def expand_parents(documents: List[Document]) -> List[Document]:
+    """Replace child chunks by their parents, fetched in one docstore lookup, keeping rank order.
+
+    Children of the same parent collapse into one parent; documents without a parent are kept.
+    """
+    parent_ids = [doc.metadata.get("parent_id") for doc in documents]
+    if not any(parent_ids):
+        return documents
+    
+    start = time.monotonic()
+    parents = docstore.get_many(list({pid for pid in parent_ids if pid}))
+    metrics.observe("docstore_fetch_seconds", time.monotonic() - start, store="parents")
+    
+    expanded = []
+    seen = set()
+    for doc, parent_id in zip(documents, parent_ids):
+        if parent_id in seen:
+            continue
+        if parent_id and parent_id in parents:
+            seen.add(parent_id)
+            expanded.append(parents[parent_id])
+        else:
+            expanded.append(doc)
+    return expanded
+
+def clear_tenant(tenant_id: str):
+    """Delete one tenant's documents; cost is proportional to the tenant, not the collection"""
+    tenant_id = validate_tenant(tenant_id)
     
     try:
-        # Check if collection exists
-        collections = qdrant_client.get_collections()
-        collection_names = [col.name for col in collections.collections]
-        
-        if COLLECTION_NAME not in collection_names:
-            return {
-                "message": "Collection does not exist",
-                "status": "success"
-            }
+        with layout_lock():
+            _refuse_while_rebuilding()
+            if tenant_id in dedicated_tenants:
+                drop_collections(swap_aliases({}, drop=[dedicated_collection_name(tenant_id)]))
+                dedicated_tenants.discard(tenant_id)
+                publish_layout()
+            elif collection_exists or create_hybrid_collection():
+                qdrant_client.delete(
+                    collection_name=COLLECTION_NAME,
+                    points_selector=models.FilterSelector(filter=tenant_filter(tenant_id)),
+                )
+        docstore.delete_tenant(tenant_id)
+        deduplicator.delete_tenant(tenant_id)
+        bump_corpus_version()
         
-        # Delete the collection
-        qdrant_client.delete_collection(collection_name=COLLECTION_NAME)
-        collection_exists = False
+        return {
+            "message": f"Successfully cleared documents of tenant '{tenant_id}'",
+            "status": "success"
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error clearing tenant: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to clear tenant: {str(e)}")
+
+def begin_rebuild() -> Tuple[int, Dict[str, str]]:
+    """Create a new version of every index collection and mirror uploads into it until
+    finish_rebuild; returns the version and the physical collection each logical one is rebuilt from"""
+    global rebuild_heartbeat
+    # Holding the layout lock, no tenant is moved halfway through the start, in any worker
+    with layout_lock():
+        if rebuilding:
+            raise HTTPException(status_code=409, detail="A reindex is already running")
+        version = next_index_version()
+        sources = index_collections()
+        targets = {}
+        try:
+            for name in sources:
+                targets[name] = versioned_collection_name(name, version)
+                _create_collection(targets[name], shared=name == COLLECTION_NAME)
+        except Exception:
+            drop_collections(list(targets.values()), delay=0)
+            raise
+        rebuilding.update(targets)
+        rebuild_heartbeat = time.time()
+        publish_layout()
+    return version, sources
+
+def touch_rebuild():
+    """Show the other workers that the reindex running in this worker is alive"""
+    global rebuild_heartbeat
+    with layout_lock():
+        rebuild_heartbeat = time.time()
+        publish_layout()
+
+def finish_rebuild(version: int, swap: bool = True):
+    """Point the aliases at the rebuilt version, or abandon it, and stop mirroring uploads"""
+    global index_version
+    with layout_lock():
+        targets = dict(rebuilding)
+        try:
+            if swap:
+                previous = swap_aliases(targets)
+                index_version = version
+                # The new version's chunk text and parents replace the old version's
+                docstore.promote_staged(staging_prefix(version))
+        except Exception:
+            docstore.drop_staged(staging_prefix(version))
+            raise
+        finally:
+            rebuilding.clear()
+            publish_layout()
+    if not swap:
+        docstore.drop_staged(staging_prefix(version))
+    if swap:
+        # Cached answers were retrieved with the old embeddings
+        bump_corpus_version()
+        drop_collections(previous)
+    else:
+        drop_collections(list(targets.values()), delay=0)
+
+def _refuse_while_rebuilding(action: str = "clear"):
+    if rebuilding:
+        raise HTTPException(status_code=409, detail=f"A reindex is running; {action} once it has finished")
+
+def clear_collection(tenant_id: str = None):
+    """Clear all documents from the collection, or only those of one tenant.
+
+    An empty new version is created and the aliases are swapped to it, so searches never
+    see a missing collection; the old versions are dropped afterwards.
+    """
+    global collection_exists, index_version
+    
+    if tenant_id:
+        return clear_tenant(tenant_id)
+    
+    try:
+        with layout_lock():
+            _refuse_while_rebuilding()
+            version = next_index_version()
+            target = versioned_collection_name(COLLECTION_NAME, version)
+            _create_collection(target, shared=True)
+            
+            # Dedicated tenant collections are part of "all documents"
+            tenant_collections = [name for name in index_collections() if name != COLLECTION_NAME]
+            previous = swap_aliases({COLLECTION_NAME: target}, drop=tenant_collections)
+            index_version = version
+            dedicated_tenants.clear()
+            collection_exists = True
+            publish_layout()
+        docstore.clear()
+        deduplicator.clear()
+        bump_corpus_version()
+        drop_collections(previous)
         
-        # Recreate the collection
-        if create_hybrid_collection():
-            return {
-                "message": f"Successfully cleared collection '{COLLECTION_NAME}' and recreated it",
-                "status": "success"
-            }
-        else:
-            return {
-                "message": f"Cleared collection '{COLLECTION_NAME}' but failed to recreate it",
-                "status": "warning"
-            }
+        return {
+            "message": f"Successfully cleared collection '{COLLECTION_NAME}' (now {target})",
+            "status": "success"
+        }
             
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error clearing collection: {e}")
+        logger.error(f"Error clearing collection: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to clear collection: {str(e)}")
 
+async def close_clients():
+    """Close the Qdrant connections"""
+    if QDRANT_MODE == "remote":
+        await async_qdrant_client.close()
+    qdrant_client.close()
+
 def get_collection_info():
     """Get collection information for health checks"""
     try:
         collections = qdrant_client.get_collections()
         collection_names = [col.name for col in collections.collections]
+        aliases = index_aliases()
         return {
             "collections": collection_names,
-            "hybrid_collection_exists": COLLECTION_NAME in collection_names
+            "aliases": aliases,
+            "hybrid_collection_exists": COLLECTION_NAME in collection_names or COLLECTION_NAME in aliases,
+            "index_version": index_version,
+            "dedicated_tenants": sorted(dedicated_tenants)
         }
     except Exception as e:
         raise Exception(f"Failed to get collection info: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,102 @@
+import time
+import logging
+import threading
+from typing import Dict, List
+import requests
+
+from .config import (
+    OLLAMA_URL,
+    OLLAMA_MODEL_CONFIGS,
+    OLLAMA_WARMUP,
+    OLLAMA_WARMUP_MODELS,
+    OLLAMA_WARMUP_INTERVAL,
+    OLLAMA_NUM_CTX,
+    SYSTEM_TEMPLATE,
+    CONTEXT_HUMAN_TEMPLATE,
+    ollama_keep_alive
+)
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class WarmupManager:
+    """Keeps configured Ollama models loaded and their system prompt prefix cached.
+
+    Each warm-up sends a one-token chat request whose prompt starts with the same
+    system prompt and instructions as the RAG prompt, with the model's keep_alive.
+    Ollama loads the model and keeps that prefix in its KV cache, so the first real
+    query pays neither the model load nor the prefill of the static prefix.
+    """
+
+    def __init__(self, models: List[str], interval: float = 0, base_url: str = OLLAMA_URL):
+        self.models = models
+        self.interval = interval
+        self.base_url = base_url
+        self.status: Dict[str, dict] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def warm(self, model: str) -> bool:
+        """Load one model and prefill the static system prefix"""
+        options = {"num_predict": 1}
+        if OLLAMA_NUM_CTX:
+            options["num_ctx"] = OLLAMA_NUM_CTX
+        start = time.monotonic()
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/chat",
+                json={
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_TEMPLATE},
+                        # Same static instructions the RAG prompt starts with
+                        {"role": "user", "content": CONTEXT_HUMAN_TEMPLATE.format(context_str="", query="Hello")},
+                    ],
+                    "stream": False,
+                    "keep_alive": ollama_keep_alive(model),
+                    "options": options,
+                },
+                timeout=600
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Warm-up of {model} failed: {e}")
+            self.status[model] = {"warm": False, "error": str(e), "at": time.time()}
+            metrics.inc("ollama_warmup_failures_total", model=model)
+            return False
+
+        elapsed = time.monotonic() - start
+        load_seconds = response.json().get("load_duration", 0) / 1e9
+        self.status[model] = {"warm": True, "seconds": elapsed, "load_seconds": load_seconds, "at": time.time()}
+        metrics.observe("ollama_warmup_seconds", elapsed, model=model)
+        logger.info(f"Warmed {model} in {elapsed:.2f}s (model load {load_seconds:.2f}s)")
+        return True
+
+    def warm_all(self):
+        for model in self.models:
+            if self._stop.is_set():
+                return
+            self.warm(model)
+
+    def _run(self):
+        self.warm_all()
+        while self.interval > 0 and not self._stop.wait(self.interval):
+            self.warm_all()
+
+    def start(self):
+        """Warm models in the background so startup is not blocked"""
+        if not self.models or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="ollama-warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+def _default_models() -> List[str]:
+    if OLLAMA_WARMUP_MODELS:
+        return OLLAMA_WARMUP_MODELS
+    # Warm the default model, which serves requests that do not name one
+    return [OLLAMA_MODEL_CONFIGS[0]["tag"]] if OLLAMA_MODEL_CONFIGS else []
+
+warmup_manager = WarmupManager(_default_models() if OLLAMA_WARMUP else [], OLLAMA_WARMUP_INTERVAL)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Storage and hydration cost of keeping chunk text outside Qdrant.
+
+Compares the bytes chunk text adds to Qdrant payloads with the on-disk size of
+the SQLite and compressed segment docstores, and measures how long hydrating
+the top-k of a query takes from each. Text comes from a directory of .txt/.md
+files when given, otherwise from a synthetic English-like corpus.
+
+    python benchmarks/docstore.py --chunks 20000 --k 8
+    python benchmarks/docstore.py --input ./corpus
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+from app.docstore import DocStore, SegmentDocStore, zstandard
+
+WORDS = (
+    "the of and to in is for on that with as by this are from be it at an or which model data "
+    "search vector index query document retrieval system embedding result score dense sparse "
+    "hybrid context answer question user language large token cost latency memory storage "
+    "compression segment payload collection tenant chunk parent child cache request response"
+).split()
+
+def synthetic_chunks(count: int, size: int, rng: random.Random) -> list:
+    chunks = []
+    for _ in range(count):
+        words = []
+        while sum(len(w) + 1 for w in words) < size:
+            words.append(rng.choice(WORDS))
+        chunks.append(" ".join(words).capitalize() + ".")
+    return chunks
+
+def file_chunks(directory: str, size: int) -> list:
+    chunks = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if os.path.splitext(name)[1].lower() in (".txt", ".md"):
+                with open(os.path.join(root, name), encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+                chunks.extend(text[i:i + size] for i in range(0, len(text), size))
+    return chunks
+
+def directory_size(path: str) -> int:
+    if os.path.isfile(path):
+        total = os.path.getsize(path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                total += os.path.getsize(path + suffix)
+        return total
+    return sum(os.path.getsize(os.path.join(root, n)) for root, _, names in os.walk(path) for n in names)
+
+def measure_hydration(store, ids: list, k: int, rounds: int, rng: random.Random) -> list:
+    latencies = []
+    for _ in range(rounds):
+        sample = rng.sample(ids, k)
+        start = time.perf_counter()
+        documents = store.get_many(sample)
+        latencies.append(time.perf_counter() - start)
+        assert len(documents) == k
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Docstore storage and hydration benchmark")
+    parser.add_argument("--input", help="Directory of .txt/.md files to chunk instead of synthetic text")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=8, help="Documents hydrated per query")
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = file_chunks(args.input, args.chunk_size) if args.input else synthetic_chunks(args.chunks, args.chunk_size, rng)
+    ids = [str(uuid.uuid4()) for _ in texts]
+    metadata = {"source": "benchmark.pdf", "type": "pdf"}
+
+    # What the text costs inside Qdrant: payload JSON with and without the document field
+    with_text = sum(len(json.dumps({"document": t, "metadata": metadata, "tenant_id": "default"})) for t in texts)
+    without_text = sum(len(json.dumps({"metadata": metadata, "tenant_id": "default"})) for _ in texts)
+    raw_text = sum(len(t.encode()) for t in texts)
+
+    print(f"{len(texts)} chunks, {raw_text / 1e6:.1f} MB of text")
+    print(f"Qdrant payload with text:    {with_text / 1e6:8.1f} MB")
+    print(f"Qdrant payload without text: {without_text / 1e6:8.1f} MB "
+          f"({(1 - without_text / with_text) * 100:.0f}% smaller)\n")
+
+    codec = "zstd" if zstandard is not None else "zlib"
+    with tempfile.TemporaryDirectory() as workdir:
+        stores = [
+            (f"sqlite ({codec})", DocStore(os.path.join(workdir, "docstore.sqlite")), os.path.join(workdir, "docstore.sqlite")),
+            (f"segment ({codec})", SegmentDocStore(os.path.join(workdir, "segments")), os.path.join(workdir, "segments")),
+        ]
+        print(f"{'docstore':<16} {'size MB':>8} {'write s':>8} {'p50 ms':>8} {'p95 ms':>8}   (hydrating k={args.k})")
+        for name, store, path in stores:
+            start = time.perf_counter()
+            batch = 1000
+            for i in range(0, len(texts), batch):
+                store.put_many(
+                    (doc_id, "default", Document(page_content=text))
+                    for doc_id, text in zip(ids[i:i + batch], texts[i:i + batch])
+                )
+            write_seconds = time.perf_counter() - start
+            latencies = sorted(measure_hydration(store, ids, min(args.k, len(ids)), args.rounds, rng))
+            p95 = latencies[int(0.95 * (len(latencies) - 1))]
+            print(f"{name:<16} {directory_size(path) / 1e6:>8.1f} {write_seconds:>8.2f} "
+                  f"{statistics.median(latencies) * 1000:>8.3f} {p95 * 1000:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Minimal Ollama-compatible server for local testing and benchmarks.
+
+Serves /api/tags, /api/chat, /api/generate and /api/version with a configurable
+time-to-first-token and token rate, so latency-sensitive behaviour (hedging,
+admission control, load tests) can be exercised without a real model.
+
+    python benchmarks/fake_ollama.py --port 11435 --ttft 0.2 --tokens-per-second 50
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE = (
+    "This is a canned answer from the fake Ollama server. "
+    "It streams one word at a time at the configured token rate."
+)
+
+def make_handler(model: str, ttft: float, tokens_per_second: float, response: str, load_time: float, stats: dict):
+    state = {"loaded": load_time <= 0}
+
+    class FakeOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload: dict, status: int = 200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": model, "model": model, "size": 0, "digest": "fake"}]})
+            elif self.path == "/api/version":
+                self._send_json({"version": "0.0.0-fake"})
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            if self.path not in ("/api/chat", "/api/generate"):
+                self._send_json({"error": "not found"}, status=404)
+                return
+
+            request = self._read_json()
+            is_chat = self.path == "/api/chat"
+            stats["requests"] += 1
+            started = time.monotonic()
+
+            # Simulate a cold model load the first time, then the usual prefill delay
+            load_duration = 0.0
+            if not state["loaded"]:
+                time.sleep(load_time)
+                load_duration = load_time
+                state["loaded"] = True
+
+            # An empty generate request only loads the model (Ollama's warm-up idiom)
+            if not is_chat and not request.get("prompt"):
+                self._send_json(self._final(request, is_chat, started, load_duration, 0))
+                return
+
+            time.sleep(ttft)
+            words = response.split(" ")
+            tokens = [w + (" " if i < len(words) - 1 else "") for i, w in enumerate(words)]
+
+            if request.get("stream", True) is False:
+                payload = self._final(request, is_chat, started, load_duration, len(tokens))
+                self._set_content(payload, is_chat, "".join(tokens))
+                self._send_json(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for i, token in enumerate(tokens):
+                    if i and tokens_per_second > 0:
+                        time.sleep(1.0 / tokens_per_second)
+                    chunk = {"model": request.get("model", model), "created_at": _now(), "done": False}
+                    self._set_content(chunk, is_chat, token)
+                    self._write_chunk(chunk)
+                final = self._final(request, is_chat, started, load_duration, len(tokens))
+                self._set_content(final, is_chat, "")
+                self._write_chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+                stats["completed"] += 1
+            except (BrokenPipeError, ConnectionResetError):
+                # Client cancelled the stream (e.g. the losing side of a hedge)
+                stats["aborted"] += 1
+
+        def _write_chunk(self, payload: dict):
+            data = json.dumps(payload).encode() + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _set_content(self, payload: dict, is_chat: bool, text: str):
+            if is_chat:
+                payload["message"] = {"role": "assistant", "content": text}
+            else:
+                payload["response"] = text
+
+        def _final(self, request: dict, is_chat: bool, started: float, load_duration: float, eval_count: int) -> dict:
+            payload = {
+                "model": request.get("model", model),
+                "created_at": _now(),
+                "done": True,
+                "done_reason": "stop" if eval_count else "load",
+                "total_duration": int((time.monotonic() - started) * 1e9),
+                "load_duration": int(load_duration * 1e9),
+                "prompt_eval_count": 0,
+                "eval_count": eval_count,
+            }
+            self._set_content(payload, is_chat, "")
+            return payload
+
+    return FakeOllamaHandler
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def serve(host: str, port: int, model: str, ttft: float, tokens_per_second: float,
+          response: str = DEFAULT_RESPONSE, load_time: float = 0.0) -> ThreadingHTTPServer:
+    """Create a fake Ollama server; call serve_forever() on the result.
+
+    server.stats counts the generation requests, and the streams completed or aborted by the client.
+    """
+    stats = {"requests": 0, "completed": 0, "aborted": 0}
+    handler = make_handler(model, ttft, tokens_per_second, response, load_time, stats)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--load-time", type=float, default=0.0, help="Extra delay on the first request (cold model load)")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE)
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.model, args.ttft, args.tokens_per_second, args.response, args.load_time)
+    print(f"Fake Ollama serving '{args.model}' on http://{args.host}:{args.port} "
+          f"(ttft={args.ttft}s, {args.tokens_per_second} tok/s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+End-to-end HTTP load test of the API with local stand-ins.
+
+Starts app.main:app under uvicorn against embedded Qdrant (QDRANT_MODE=memory)
+and the fake Ollama server from fake_ollama.py, seeds a synthetic corpus, then
+drives a mixed /query, /upload and /test-hybrid-search workload at a target
+request rate from an async client. Arrivals are open-loop: requests are sent on
+schedule whether or not earlier ones finished, and latency is measured from the
+scheduled send time, so queueing in the server shows up instead of slowing the
+client down. Reports p50/p95/p99 latency, throughput and error rate per endpoint
+and the server's RSS and CPU, and flags regressions against a saved baseline.
+
+    python benchmarks/load_test.py --rps 20 --duration 60 --save-baseline load_baseline.json
+    python benchmarks/load_test.py --rps 20 --duration 60 --baseline load_baseline.json
+    python benchmarks/load_test.py --url http://localhost:8000 --rps 5    # an API that is already running
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from fake_ollama import serve as serve_fake_ollama
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = (
+    "the of and to in is for on that with as by this are from be it at an or which model data "
+    "search vector index query document retrieval system embedding result score dense sparse "
+    "hybrid context answer question user language large token cost latency memory storage "
+    "compression segment payload collection tenant chunk parent child cache request response"
+).split()
+QUESTION_STARTS = ["What is", "How does", "Why do we use", "Explain", "When should I use"]
+
+# Endpoints driven by the workload, with the default share of requests
+DEFAULT_MIX = "query=0.5,search=0.4,upload=0.1"
+OPERATIONS = ("query", "search", "upload")
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """"query=0.5,search=0.4,upload=0.1" -> normalized weights"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r} (expected {', '.join(OPERATIONS)})")
+        mix[name.strip()] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("The mix needs a positive weight")
+    return {name: weight / total for name, weight in mix.items() if weight > 0}
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def process_stats(pid: int) -> Optional[Tuple[int, float]]:
+    """(RSS bytes, CPU seconds) of a process, from psutil or /proc; None when neither is available"""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            cpu = process.cpu_times()
+            return process.memory_info().rss, cpu.user + cpu.system
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the parenthesized command name; utime and stime are the 12th and 13th
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return resident_pages * os.sysconf("SC_PAGE_SIZE"), (int(fields[11]) + int(fields[12])) / ticks
+
+class ResourceSampler:
+    """Samples the server's RSS and CPU use in a background thread"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss: List[int] = []
+        self.cpu_percent: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+
+    def _run(self):
+        previous = process_stats(self.pid)
+        previous_at = time.monotonic()
+        while previous is not None and not self._stop.wait(self.interval):
+            current = process_stats(self.pid)
+            now = time.monotonic()
+            if current is None:
+                return
+            self.rss.append(current[0])
+            self.cpu_percent.append(100 * (current[1] - previous[1]) / (now - previous_at))
+            previous, previous_at = current, now
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Optional[dict]:
+        self._stop.set()
+        self._thread.join()
+        if not self.rss:
+            return None
+        return {
+            "rss_peak_mb": max(self.rss) / 2 ** 20,
+            "rss_mean_mb": statistics.mean(self.rss) / 2 ** 20,
+            "cpu_mean_percent": statistics.mean(self.cpu_percent),
+            "cpu_peak_percent": max(self.cpu_percent),
+        }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_api(args, ollama_url: str, log_file) -> subprocess.Popen:
+    """Run app.main:app under uvicorn with embedded Qdrant and the local LLM stand-in"""
+    env = dict(os.environ)
+    env.setdefault("QDRANT_MODE", "memory")
+    env.setdefault("OLLAMA_URL", ollama_url)
+    env.setdefault("DEFAULT_PROVIDER", "fake" if args.llm == "fake" else "ollama")
+    env.setdefault("CONVERSATION_DB_PATH", os.path.join(args.workdir, "conversations.sqlite"))
+    env.setdefault("DOCSTORE_PATH", os.path.join(args.workdir, "docstore.sqlite"))
+    env.setdefault("DOCSTORE_DIR", os.path.join(args.workdir, "docstore"))
+    env.setdefault("QDRANT_PATH", os.path.join(args.workdir, "qdrant_data"))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+
+async def wait_until_ready(client: httpx.AsyncClient, server: Optional[subprocess.Popen], timeout: float):
+    """Poll until the API answers; model loading at startup can take a while"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"API exited during startup with code {server.returncode}")
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"API not ready after {timeout:.0f}s")
+
+async def seed_corpus(client: httpx.AsyncClient, rng: random.Random, documents: int):
+    """Upload a synthetic corpus so searches and queries have something to find"""
+    for start in range(0, documents, 50):
+        batch = [
+            {"content": sentence(rng, 120), "metadata": {"source": f"seed-{i}.txt"}}
+            for i in range(start, min(documents, start + 50))
+        ]
+        response = await client.post("/upload", json=batch, timeout=600)
+        response.raise_for_status()
+
+def make_request(operation: str, rng: random.Random) -> dict:
+    """httpx request arguments for one operation"""
+    if operation == "query":
+        question = f"{rng.choice(QUESTION_STARTS)} {sentence(rng, rng.randint(2, 8))}?"
+        return {"method": "POST", "url": "/query", "json": {"question": question, "sources_mode": "none"}}
+    if operation == "search":
+        return {"method": "GET", "url": "/test-hybrid-search", "params": {"query": sentence(rng, rng.randint(1, 6))}}
+    return {"method": "POST", "url": "/upload",
+            "json": [{"content": sentence(rng, 120), "metadata": {"source": "load-test.txt"}}]}
+
+async def run_load(client: httpx.AsyncClient, args, rng: random.Random) -> Tuple[Dict[str, list], float]:
+    """Send requests at args.rps (Poisson arrivals) for args.duration seconds; returns samples per operation"""
+    samples: Dict[str, list] = {operation: [] for operation in args.mix}
+    operations, weights = list(args.mix), list(args.mix.values())
+    loop = asyncio.get_running_loop()
+
+    async def one(operation: str, scheduled: float):
+        request = make_request(operation, rng)
+        try:
+            response = await client.request(**request, timeout=args.timeout)
+            ok = response.status_code < 400
+            status = response.status_code
+        except httpx.HTTPError as e:
+            ok, status = False, type(e).__name__
+        samples[operation].append({"latency": loop.time() - scheduled, "ok": ok, "status": status})
+
+    tasks = []
+    start = loop.time()
+    scheduled = start
+    while True:
+        scheduled += rng.expovariate(args.rps)
+        if scheduled - start >= args.duration:
+            break
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(rng.choices(operations, weights)[0], scheduled)))
+    await asyncio.gather(*tasks)
+    return samples, loop.time() - start
+
+def summarize(samples: Dict[str, list], elapsed: float) -> dict:
+    """Latency percentiles, throughput and error rate per operation and overall"""
+    def stats(entries: list) -> dict:
+        latencies = [e["latency"] for e in entries if e["ok"]]
+        errors = [e for e in entries if not e["ok"]]
+        result = {
+            "requests": len(entries),
+            "errors": len(errors),
+            "error_rate": len(errors) / len(entries) if entries else 0.0,
+            "throughput_rps": len(latencies) / elapsed,
+        }
+        if latencies:
+            result.update(
+                p50_ms=percentile(latencies, 0.50) * 1000,
+                p95_ms=percentile(latencies, 0.95) * 1000,
+                p99_ms=percentile(latencies, 0.99) * 1000,
+            )
+        if errors:
+            statuses = {}
+            for e in errors:
+                statuses[str(e["status"])] = statuses.get(str(e["status"]), 0) + 1
+            result["error_statuses"] = statuses
+        return result
+
+    endpoints = {operation: stats(entries) for operation, entries in samples.items()}
+    overall = stats([e for entries in samples.values() for e in entries])
+    return {"endpoints": endpoints, "overall": overall}
+
+# (section, metric, True when higher is worse)
+COMPARED_METRICS = [
+    ("latency", "p50_ms", True),
+    ("latency", "p95_ms", True),
+    ("latency", "p99_ms", True),
+    ("latency", "throughput_rps", False),
+    ("latency", "error_rate", True),
+    ("server", "rss_peak_mb", True),
+    ("server", "cpu_mean_percent", True),
+]
+
+def compare(result: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> List[dict]:
+    """Metrics that got worse than the baseline by more than the tolerance"""
+    regressions = []
+    groups = {f"latency:{name}": (result["endpoints"].get(name), baseline["endpoints"].get(name))
+              for name in result["endpoints"]}
+    groups["latency:overall"] = (result["overall"], baseline["overall"])
+    groups["server"] = (result.get("server"), baseline.get("server"))
+
+    for group, (current, previous) in groups.items():
+        if not current or not previous:
+            continue
+        for section, metric, higher_is_worse in COMPARED_METRICS:
+            if not group.startswith(section) or metric not in current or metric not in previous:
+                continue
+            now, before = current[metric], previous[metric]
+            delta = now - before if higher_is_worse else before - now
+            if metric == "error_rate":
+                # Rates near zero make relative changes meaningless; one percentage point is the bar
+                worse = delta > 0.01
+            else:
+                worse = delta > tolerance * abs(before)
+                if metric.endswith("_ms"):
+                    worse = worse and delta > min_delta_ms
+            if worse:
+                regressions.append({"group": group.split(":")[-1], "metric": metric, "baseline": before, "current": now})
+    return regressions
+
+def print_report(result: dict):
+    print(f"\n{'endpoint':<10} {'requests':>9} {'errors':>7} {'rps':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(result["endpoints"].items()) + [("overall", result["overall"])]
+    for name, stats in rows:
+        print(f"{name:<10} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>7.1f} "
+              f"{stats.get('p50_ms', float('nan')):>9.1f} {stats.get('p95_ms', float('nan')):>9.1f} "
+              f"{stats.get('p99_ms', float('nan')):>9.1f}")
+        if stats.get("error_statuses"):
+            print(f"{'':<10} errors by status: {stats['error_statuses']}")
+    server = result.get("server")
+    if server:
+        print(f"\nserver RSS peak {server['rss_peak_mb']:.0f} MB (mean {server['rss_mean_mb']:.0f} MB), "
+              f"CPU mean {server['cpu_mean_percent']:.0f}% (peak {server['cpu_peak_percent']:.0f}%)")
+    else:
+        print("\nserver RSS/CPU not measured (external server, or neither psutil nor /proc available)")
+
+async def main_async(args) -> int:
+    rng = random.Random(args.seed)
+    fake_ollama = server = log_file = None
+    base_url = args.url
+    if not base_url:
+        ollama_port = args.ollama_port or free_port()
+        if args.llm == "ollama":
+            fake_ollama = serve_fake_ollama("127.0.0.1", ollama_port, args.model, args.ttft, args.tokens_per_second)
+            threading.Thread(target=fake_ollama.serve_forever, name="fake-ollama", daemon=True).start()
+        args.port = args.port or free_port()
+        log_file = open(os.path.join(args.workdir, "api.log"), "w")
+        server = start_api(args, f"http://127.0.0.1:{ollama_port}", log_file)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+            await wait_until_ready(client, server, args.startup_timeout)
+            if args.seed_documents:
+                print(f"Seeding {args.seed_documents} documents...", file=sys.stderr)
+                await seed_corpus(client, rng, args.seed_documents)
+
+            sampler = ResourceSampler(server.pid) if server is not None else None
+            if sampler:
+                sampler.start()
+            print(f"Running {args.rps} req/s for {args.duration}s, mix {args.mix}", file=sys.stderr)
+            samples, elapsed = await run_load(client, args, rng)
+            result = summarize(samples, elapsed)
+            result["server"] = sampler.stop() if sampler else None
+    except RuntimeError as e:
+        print(f"Load test failed: {e}", file=sys.stderr)
+        if log_file is not None:
+            log_file.flush()
+            with open(log_file.name) as f:
+                print(f.read()[-4000:], file=sys.stderr)
+        return 1
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if fake_ollama is not None:
+            fake_ollama.shutdown()
+        if log_file is not None:
+            log_file.close()
+
+    result["config"] = {
+        "rps": args.rps, "duration": args.duration, "mix": args.mix, "seed_documents": args.seed_documents,
+        "llm": args.llm, "ttft": args.ttft, "tokens_per_second": args.tokens_per_second,
+    }
+    print_report(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != result["config"]:
+            print("\nWarning: the baseline was recorded with a different configuration", file=sys.stderr)
+        regressions = compare(result, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\nREGRESSIONS against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for r in regressions:
+                print(f"  {r['group']:<10} {r['metric']:<17} {r['baseline']:>10.2f} -> {r['current']:>10.2f}")
+            return 1
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end HTTP load test with embedded Qdrant and a fake LLM")
+    parser.add_argument("--url", default=None, help="Test an already running API instead of starting one")
+    parser.add_argument("--port", type=int, default=0, help="Port of the API started by the test (0 = any free port)")
+    parser.add_argument("--rps", type=float, default=10.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Share per endpoint ({DEFAULT_MIX})")
+    parser.add_argument("--seed-documents", type=int, default=200, help="Documents uploaded before the run")
+    parser.add_argument("--connections", type=int, default=100, help="Client connection pool size")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--llm", choices=["ollama", "fake"], default="ollama",
+                        help="ollama: the fake Ollama server over HTTP; fake: the in-process fake provider")
+    parser.add_argument("--ollama-port", type=int, default=0, help="Port of the fake Ollama server (0 = any free port)")
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Fake Ollama seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--baseline", help="Compare against this saved result; exit code 1 on regression")
+    parser.add_argument("--save-baseline", help="Save the result as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Latency changes below this are noise")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="load-test-") as workdir:
+        args.workdir = workdir
+        sys.exit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
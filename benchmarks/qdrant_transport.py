@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Compare Qdrant ingestion and search throughput over REST and gRPC.
+
+Uses random vectors shaped like the app's (1024-d dense + sparse) against a
+scratch collection, so the numbers reflect the transport rather than the
+embedding models. Needs a running Qdrant with both ports reachable:
+
+    python benchmarks/qdrant_transport.py --host localhost --points 5000 --queries 1000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient, models
+
+DENSE = "thenlper/gte-large"
+SPARSE = "miniCOIL"
+
+def random_dense(rng: np.random.Generator, dim: int) -> list:
+    vector = rng.standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def random_sparse(rng: np.random.Generator, nnz: int) -> models.SparseVector:
+    indices = np.unique(rng.integers(0, 30000, nnz))
+    return models.SparseVector(indices=indices.tolist(), values=rng.random(len(indices)).tolist())
+
+def make_points(rng: np.random.Generator, count: int, dim: int) -> list:
+    return [
+        models.PointStruct(
+            id=str(uuid.uuid4()),
+            vector={DENSE: random_dense(rng, dim), SPARSE: random_sparse(rng, 40)},
+            payload={"document": "x" * 800, "metadata": {"source": "benchmark"}, "tenant_id": "default"},
+        )
+        for _ in range(count)
+    ]
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def run_transport(args, transport: str, points: list, queries: list) -> dict:
+    client = AsyncQdrantClient(
+        host=args.host,
+        port=args.rest_port,
+        grpc_port=args.grpc_port,
+        prefer_grpc=transport == "grpc",
+        timeout=60,
+        pool_size=args.concurrency,
+    )
+    collection = f"transport_benchmark_{transport}_{uuid.uuid4().hex[:8]}"
+    await client.create_collection(
+        collection_name=collection,
+        vectors_config={DENSE: models.VectorParams(size=args.dim, distance=models.Distance.COSINE)},
+        sparse_vectors_config={SPARSE: models.SparseVectorParams(modifier=models.Modifier.IDF)},
+    )
+    try:
+        # Ingestion: batches upserted with bounded parallelism, like aindex_documents_hybrid
+        semaphore = asyncio.Semaphore(args.upsert_parallel)
+        async def upsert(batch):
+            async with semaphore:
+                await client.upsert(collection_name=collection, points=batch)
+        batches = [points[i:i + args.batch_size] for i in range(0, len(points), args.batch_size)]
+        start = time.perf_counter()
+        await asyncio.gather(*(upsert(batch) for batch in batches))
+        ingest_seconds = time.perf_counter() - start
+
+        # Search: the app's hybrid prefetch query, issued by concurrent clients
+        latencies = []
+        pending = iter(queries)
+        async def searcher():
+            for dense, sparse in pending:
+                started = time.perf_counter()
+                await client.query_points(
+                    collection_name=collection,
+                    prefetch=[
+                        models.Prefetch(query=dense, using=DENSE, limit=20),
+                        models.Prefetch(query=sparse, using=SPARSE, limit=20),
+                    ],
+                    query=dense,
+                    using=DENSE,
+                    with_payload=True,
+                    limit=4,
+                )
+                latencies.append(time.perf_counter() - started)
+        start = time.perf_counter()
+        await asyncio.gather(*(searcher() for _ in range(args.concurrency)))
+        search_seconds = time.perf_counter() - start
+    finally:
+        await client.delete_collection(collection)
+        await client.close()
+
+    return {
+        "transport": transport,
+        "ingest_points_per_s": len(points) / ingest_seconds,
+        "search_qps": len(queries) / search_seconds,
+        "search_p50_ms": statistics.median(latencies) * 1000,
+        "search_p95_ms": percentile(latencies, 0.95) * 1000,
+    }
+
+async def main_async(args):
+    rng = np.random.default_rng(args.seed)
+    points = make_points(rng, args.points, args.dim)
+    queries = [(random_dense(rng, args.dim), random_sparse(rng, 8)) for _ in range(args.queries)]
+
+    results = []
+    for transport in args.transports.split(","):
+        results.append(await run_transport(args, transport.strip(), points, queries))
+
+    print(f"{'transport':<10} {'ingest pts/s':>13} {'search qps':>11} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in results:
+        print(f"{r['transport']:<10} {r['ingest_points_per_s']:>13.0f} {r['search_qps']:>11.0f} "
+              f"{r['search_p50_ms']:>8.1f} {r['search_p95_ms']:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Qdrant REST vs gRPC throughput")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--rest-port", type=int, default=6333)
+    parser.add_argument("--grpc-port", type=int, default=6334)
+    parser.add_argument("--transports", default="rest,grpc")
+    parser.add_argument("--points", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--upsert-parallel", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
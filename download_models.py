@@ -2,30 +2,69 @@
 """
 Script to pre-download FastEmbed models during Docker build.
 This ensures models are available immediately when the container starts.
+
+The models are read from the same environment variables as app/config.py
+(DENSE_MODEL_NAME, SPARSE_MODEL_NAME, RERANK_MODEL_NAME, DENSE_MODEL_FILE, ...),
+so build with matching --build-arg values when the defaults are changed.
 """
 
 import os
-from fastembed import TextEmbedding
+from fastembed import TextEmbedding, SparseTextEmbedding
+from fastembed.rerank.cross_encoder import TextCrossEncoder
+from fastembed.common.model_description import ModelSource, PoolingType
+
+# Same defaults as app/config.py, which cannot be imported here (the app is not copied yet)
+DENSE_MODEL_NAME = os.getenv("DENSE_MODEL_NAME", "thenlper/gte-large")
+SPARSE_MODEL_NAME = os.getenv("SPARSE_MODEL_NAME", "Qdrant/minicoil-v1")
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "Xenova/ms-marco-MiniLM-L-6-v2")
+DENSE_MODEL_FILE = os.getenv("DENSE_MODEL_FILE", "")
+DENSE_MODEL_DIM = int(os.getenv("DENSE_MODEL_DIM", "0")) or None
+DENSE_MODEL_POOLING = os.getenv("DENSE_MODEL_POOLING", "mean")
+
+TEST_TEXT = ["This is a test sentence."]
+
+def register_dense_model():
+    """Register a DENSE_MODEL_FILE model with fastembed (see app.embeddings.register_dense_model)"""
+    listed = {m["model"].lower() for m in TextEmbedding.list_supported_models()}
+    if not DENSE_MODEL_FILE or DENSE_MODEL_NAME.lower() in listed:
+        return
+    if not DENSE_MODEL_DIM:
+        raise ValueError("DENSE_MODEL_DIM is required with DENSE_MODEL_FILE")
+    TextEmbedding.add_custom_model(
+        model=DENSE_MODEL_NAME,
+        pooling=PoolingType.CLS if DENSE_MODEL_POOLING == "cls" else PoolingType.MEAN,
+        normalization=True,
+        sources=ModelSource(hf=DENSE_MODEL_NAME),
+        dim=DENSE_MODEL_DIM,
+        model_file=DENSE_MODEL_FILE,
+    )
 
 def download_models():
-    """Download the required FastEmbed models."""
+    """Download the configured FastEmbed models."""
     print("Pre-downloading FastEmbed models...")
-    
+
     try:
-        # Download the thenlper/gte-large model used in the application
-        print("Downloading thenlper/gte-large model...")
-        embedding_model = TextEmbedding(model_name="thenlper/gte-large")
-        print("✓ thenlper/gte-large model downloaded successfully")
-        
-        # Test the model to ensure it's working
-        test_text = ["This is a test sentence."]
-        embeddings = list(embedding_model.embed(test_text))
-        print(f"✓ Model test successful - embedding dimension: {len(embeddings[0])}")
-        
+        register_dense_model()
+
+        print(f"Downloading dense model {DENSE_MODEL_NAME}...")
+        dense_model = TextEmbedding(model_name=DENSE_MODEL_NAME)
+        embeddings = list(dense_model.embed(TEST_TEXT))
+        print(f"✓ {DENSE_MODEL_NAME} works - embedding dimension: {len(embeddings[0])}")
+
+        print(f"Downloading sparse model {SPARSE_MODEL_NAME}...")
+        sparse_model = SparseTextEmbedding(model_name=SPARSE_MODEL_NAME)
+        sparse = list(sparse_model.embed(TEST_TEXT))
+        print(f"✓ {SPARSE_MODEL_NAME} works - {len(sparse[0].indices)} non-zero terms")
+
+        print(f"Downloading rerank model {RERANK_MODEL_NAME}...")
+        reranker = TextCrossEncoder(model_name=RERANK_MODEL_NAME)
+        scores = list(reranker.rerank(TEST_TEXT[0], TEST_TEXT))
+        print(f"✓ {RERANK_MODEL_NAME} works - test score: {scores[0]:.3f}")
+
     except Exception as e:
         print(f"Error downloading models: {e}")
         raise
 
 if __name__ == "__main__":
     download_models()
-    print("All models downloaded successfully!") 
\ No newline at end of file
+    print("All models downloaded successfully!")
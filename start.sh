@@ -4,8 +4,28 @@ set -e
 echo "Starting FastAPI..."
 echo "Models are pre-downloaded, starting services..."
 
+if [ -n "$EMBEDDING_SERVICE_SOCKET" ]; then
+    echo "Starting shared embedding service on $EMBEDDING_SERVICE_SOCKET..."
+    python -m app.embedding_service --socket "$EMBEDDING_SERVICE_SOCKET" &
+    EMBEDDING_PID=$!
+    WAITED=0
+    while [ ! -S "$EMBEDDING_SERVICE_SOCKET" ]; do
+        if ! kill -0 "$EMBEDDING_PID" 2>/dev/null; then
+            echo "Embedding service exited before opening its socket"
+            exit 1
+        fi
+        if [ "$WAITED" -ge "${EMBEDDING_SERVICE_START_TIMEOUT:-300}" ]; then
+            echo "Embedding service did not open its socket within ${WAITED}s"
+            kill "$EMBEDDING_PID"
+            exit 1
+        fi
+        sleep 1
+        WAITED=$((WAITED + 1))
+    done
+fi
+
 echo "Starting uvicorn server..."
-uvicorn app.main:app --host 0.0.0.0 --port 8000 --log-level info &
+python -m app.server --host 0.0.0.0 --port 8000 --workers "${API_WORKERS:-1}" &
 FASTAPI_PID=$!
 
 echo "Waiting for FastAPI to start..."
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+
+# The app reads its configuration at import time: no Qdrant server, Ollama or Groq in tests,
+# and embeddings come from the embedding service the client fixture starts on this socket
+os.environ.setdefault("QDRANT_MODE", "memory")
+os.environ.setdefault("DEFAULT_PROVIDER", "fake")
+os.environ.setdefault("LOG_FORMAT", "text")
+os.environ.setdefault("EMBEDDING_SERVICE_SOCKET", os.path.join(tempfile.mkdtemp(prefix="rag-tests-"), "embeddings.sock"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embeddings, so the API runs without downloading models"""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _bucket(self, word: str, size: int) -> int:
+        return int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "big") % size
+
+    def _dense(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[self._bucket(word, self.dim)] += 1
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def _sparse(self, text: str):
+        from qdrant_client.models import SparseVector
+        counts = {}
+        for word in text.lower().split():
+            index = self._bucket(word, 1 << 20)
+            counts[index] = counts.get(index, 0) + 1.0
+        return SparseVector(indices=list(counts), values=list(counts.values()))
+
+    def embed_documents(self, texts):
+        return [self._dense(t) for t in texts], [self._sparse(t) for t in texts]
+
+    embed_queries = embed_documents
+
+    def embed_sparse_queries(self, texts):
+        return [], [self._sparse(t) for t in texts]
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient of the API on embedded Qdrant, the fake provider and a hashing embedding service"""
+    from fastapi.testclient import TestClient
+    from app.config import EMBEDDING_SERVICE_SOCKET
+    from app.embeddings import dense_dimension
+    from app.embedding_service import EmbeddingService
+
+    service = EmbeddingService(HashingEmbedder(dense_dimension()))
+    threading.Thread(target=asyncio.run, args=(service.serve(EMBEDDING_SERVICE_SOCKET),), daemon=True).start()
+    deadline = time.monotonic() + 5
+    while not os.path.exists(EMBEDDING_SERVICE_SOCKET) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    """Poll condition until it holds or timeout seconds pass"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
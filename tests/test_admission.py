@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from app.admission import AdmissionRejected, Limiter, llm_limiter
+from conftest import wait_for
+
+def test_full_queue_is_rejected_with_retry_after():
+    limiter = Limiter("test-queue", max_concurrency=1, max_queue=1, timeout=5)
+    limiter.acquire()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), limiter.release()))
+    waiter.start()
+    assert wait_for(lambda: limiter._waiting == 1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.acquire()
+    assert rejected.value.status_code == 429
+    assert int(rejected.value.headers["Retry-After"]) >= 1
+
+    limiter.release()
+    waiter.join(timeout=5)
+    assert limiter._active == 0
+
+def test_wait_past_the_deadline_is_rejected_with_503():
+    limiter = Limiter("test-deadline", max_concurrency=1, max_queue=4, timeout=0.1)
+    with limiter.slot():
+        with pytest.raises(AdmissionRejected) as rejected:
+            limiter.acquire()
+    assert rejected.value.status_code == 503
+    assert "Retry-After" in rejected.value.headers
+    assert limiter._waiting == 0
+
+def test_check_rejects_a_wait_expected_to_time_out():
+    limiter = Limiter("test-check", max_concurrency=1, max_queue=4, timeout=1)
+    limiter.check()
+    limiter._avg_service_time = 10.0
+    with limiter.slot():
+        with pytest.raises(AdmissionRejected) as rejected:
+            limiter.check()
+    assert rejected.value.status_code == 503
+    assert int(rejected.value.headers["Retry-After"]) >= 10
+    # check() never takes a slot
+    assert limiter._active == 0
+
+@pytest.fixture
+def saturated_llm(monkeypatch):
+    """Hold every slot of the default model's limiter, with no room to queue"""
+    import app.endpoints
+
+    monkeypatch.setattr(app.endpoints, "FALLBACK_PROVIDER", None)
+    limiter = llm_limiter("fake")
+    monkeypatch.setattr(limiter, "max_queue", 0)
+    for _ in range(limiter.max_concurrency):
+        limiter.acquire()
+    yield limiter
+    for _ in range(limiter.max_concurrency):
+        limiter.release()
+
+def test_overloaded_stream_is_refused_before_it_starts(client, saturated_llm):
+    with client.stream("POST", "/query/stream", json={"question": "Is the model overloaded?"}) as response:
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+def test_overloaded_query_is_refused(client, saturated_llm):
+    document = {"content": "The admission limiter queues generations per model.", "metadata": {"source": "limits.txt"}}
+    client.post("/upload", json=[document], headers={"X-Tenant-ID": "admission"})
+    # The context found means the answer needs the model, which has no slot to give
+    response = client.post("/query", json={"question": "What does the admission limiter queue?"},
+                           headers={"X-Tenant-ID": "admission"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
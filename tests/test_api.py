@@ -0,0 +1,41 @@
+import json
+
+from app.config import FAKE_LLM_RESPONSES
+
+DOCUMENT = (
+    "Qdrant is a vector database written in Rust. It stores dense and sparse vectors "
+    "and answers hybrid queries that fuse both rankings. Collections can be served "
+    "through aliases, so a reindex swaps them without downtime."
+)
+
+def test_health(client):
+    response = client.get("/health")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "healthy"
+    assert body["qdrant_mode"] == "memory"
+    assert body["default_provider"] == "fake"
+
+def test_upload_then_query(client):
+    response = client.post("/upload", json=[{"content": DOCUMENT, "metadata": {"source": "qdrant.txt"}}])
+    assert response.status_code == 200
+    assert response.json()["chunks_created"] >= 1
+
+    response = client.post("/query", json={"question": "What is Qdrant written in?", "sources_mode": "full"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["answer"] in FAKE_LLM_RESPONSES
+    assert body["route"] == "rag"
+    assert any("Rust" in source["page_content"] for source in body["sources"])
+
+def test_query_stream(client):
+    client.post("/upload", json=[{"content": DOCUMENT, "metadata": {"source": "qdrant.txt"}}])
+
+    with client.stream("POST", "/query/stream", json={"question": "How does a reindex avoid downtime?"}) as response:
+        assert response.status_code == 200
+        events = [json.loads(line) for line in response.iter_lines() if line]
+
+    tokens = "".join(event["content"] for event in events if event["type"] == "token")
+    assert events[-1]["type"] == "done"
+    assert tokens == events[-1]["answer"]
+    assert events[-1]["answer"] in FAKE_LLM_RESPONSES
@@ -0,0 +1,38 @@
+from qdrant_client import models
+
+
+def _chunks_of(source, tenant_id):
+    from app.vector_store import qdrant_client, resolve_collection, tenant_filter
+
+    points, _ = qdrant_client.scroll(
+        collection_name=resolve_collection(tenant_id),
+        scroll_filter=models.Filter(must=[
+            tenant_filter(tenant_id),
+            models.FieldCondition(key="metadata.source", match=models.MatchValue(value=source)),
+        ]),
+        with_payload=True,
+        limit=1000,
+    )
+    return points
+
+
+def _ingest(root, tenant_id):
+    from app.bulk_ingest import BulkIngest
+
+    ingest = BulkIngest(str(root), tenant_id, str(root / "manifest.jsonl"), extract_workers=1, upsert_workers=1)
+    assert ingest.run() == 0
+
+
+def test_changed_file_replaces_its_old_chunks(client, tmp_path):
+    tenant_id = "bulk-changed"
+    path = tmp_path / "notes.txt"
+    path.write_text("\n\n".join(f"Paragraph {i} about the old lighthouse keeper. " * 20 for i in range(20)))
+    _ingest(tmp_path, tenant_id)
+    assert len(_chunks_of("notes.txt", tenant_id)) > 2
+
+    path.write_text("A single short paragraph about the new harbour master.")
+    _ingest(tmp_path, tenant_id)
+
+    chunks = _chunks_of("notes.txt", tenant_id)
+    assert len(chunks) == 1
+    assert "harbour master" in chunks[0].payload.get("document", "")
@@ -0,0 +1,121 @@
+import json
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.coalescing import SingleFlight, StreamFlight
+from conftest import wait_for
+
+DOCUMENT = "Hybrid search fuses dense and sparse rankings with reciprocal rank fusion."
+
+def test_single_flight_runs_identical_calls_once():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert [result for result, _ in results] == ["result"] * 3
+    assert [shared for _, shared in results] == [False, True, True]
+
+def test_single_flight_leader_cancellation_spares_followers():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        leader = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == ("result", True)
+
+def test_stream_flight_replays_to_late_subscribers():
+    async def source():
+        for i in range(3):
+            yield i
+            await asyncio.sleep(0.01)
+
+    async def collect(flight):
+        return [event async for event in flight.subscribe("key", source)]
+
+    async def main():
+        flight = StreamFlight()
+        first = asyncio.ensure_future(collect(flight))
+        await asyncio.sleep(0.015)
+        return await asyncio.gather(first, collect(flight))
+
+    assert asyncio.run(main()) == [[0, 1, 2], [0, 1, 2]]
+
+def test_stream_flight_stops_producer_without_subscribers():
+    produced = []
+
+    async def source():
+        for i in range(100):
+            produced.append(i)
+            yield i
+            await asyncio.sleep(0.01)
+
+    async def main():
+        flight = StreamFlight()
+        events = flight.subscribe("key", source)
+        await events.__anext__()
+        await events.aclose()
+        await asyncio.sleep(0.05)
+        return flight.in_flight("key")
+
+    assert asyncio.run(main()) is False
+    assert len(produced) < 10
+
+@pytest.mark.parametrize("coalescing", [True, False])
+def test_disconnected_stream_releases_its_llm_slot(client, monkeypatch, coalescing):
+    import app.hedging
+    import app.endpoints
+    from app.admission import llm_limiter
+    from app.models import QueryRequest
+
+    # A fake model slow enough that the client leaves mid-answer
+    generated = []
+    slow_answer = "word " * 400
+
+    def slow_llm(*args, **kwargs):
+        model = FakeListChatModel(responses=[slow_answer], sleep=0.01)
+        original = model._stream
+        def tracked(*a, **k):
+            for chunk in original(*a, **k):
+                generated.append(chunk)
+                yield chunk
+        object.__setattr__(model, "_stream", tracked)
+        return model
+
+    monkeypatch.setattr(app.hedging, "get_llm", slow_llm)
+    monkeypatch.setattr(app.endpoints, "QUERY_COALESCING", coalescing)
+    client.post("/upload", json=[{"content": DOCUMENT}])
+    limiter = llm_limiter("fake")
+
+    async def disconnect_after_first_token():
+        response = await app.endpoints.query_documents_stream(
+            QueryRequest(question=f"How does hybrid search rank? ({coalescing})", provider="fake")
+        )
+        body = response.body_iterator
+        async for line in body:
+            if json.loads(line)["type"] == "token":
+                break
+        await body.aclose()
+
+    asyncio.run(disconnect_after_first_token())
+    assert wait_for(lambda: limiter._active == 0)
+    # Generation stopped well before the end of the answer
+    assert len(generated) < len(slow_answer) / 2
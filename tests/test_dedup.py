@@ -0,0 +1,83 @@
+from langchain_core.documents import Document
+
+from app.dedup import Deduplicator
+
+FOOTER = ("Confidential. This document is the property of the company and may not be copied, "
+          "distributed or shown to third parties without written permission of the legal department.")
+OTHER = "Quarterly revenue grew in every region, led by strong demand for the new storage products."
+
+def _documents(*texts: str, source: str = "a.pdf"):
+    return [Document(page_content=text, metadata={"source": source, "page": page}) for page, text in enumerate(texts)]
+
+def test_skip_drops_near_duplicates(tmp_path):
+    dedup = Deduplicator(str(tmp_path / "dedup.sqlite"), mode="skip")
+
+    kept, ids, dropped = dedup.filter(_documents(FOOTER, OTHER, FOOTER + " Page 2."), "acme", ["1", "2", "3"])
+
+    assert [doc.page_content for doc in kept] == [FOOTER, OTHER]
+    assert ids == ["1", "2"]
+    assert dropped == 1
+    # Already indexed chunks are duplicates too, across uploads and restarts
+    reopened = Deduplicator(str(tmp_path / "dedup.sqlite"), mode="skip")
+    assert reopened.filter(_documents(FOOTER + " Page 3."), "acme", ["4"])[2] == 1
+    assert reopened.duplicates_of("1") == []
+
+def test_chunks_are_only_compared_within_their_tenant(tmp_path):
+    dedup = Deduplicator(str(tmp_path / "dedup.sqlite"), mode="skip")
+    dedup.filter(_documents(FOOTER), "acme", ["1"])
+
+    kept, _, dropped = dedup.filter(_documents(FOOTER), "globex", ["2"])
+
+    assert len(kept) == 1
+    assert dropped == 0
+
+def test_reindexing_a_chunk_under_its_own_id_is_not_a_duplicate(tmp_path):
+    dedup = Deduplicator(str(tmp_path / "dedup.sqlite"), mode="skip")
+    dedup.filter(_documents(FOOTER), "acme", ["1"])
+
+    assert dedup.filter(_documents(FOOTER), "acme", ["1"])[2] == 0
+
+def test_link_records_duplicates_against_the_canonical_chunk(tmp_path):
+    dedup = Deduplicator(str(tmp_path / "dedup.sqlite"), mode="link")
+    dedup.filter(_documents(FOOTER), "acme", ["1"])
+
+    kept, _, dropped = dedup.filter(_documents(FOOTER + " Page 2.", source="b.pdf"), "acme", ["2"])
+
+    assert kept == [] and dropped == 1
+    [link] = dedup.duplicates_of("1")
+    assert link["id"] == "2"
+    assert link["metadata"] == {"source": "b.pdf", "page": 0}
+    assert link["similarity"] >= dedup.threshold
+
+def test_forgotten_chunks_are_no_longer_canonical(tmp_path):
+    dedup = Deduplicator(str(tmp_path / "dedup.sqlite"), mode="link")
+    dedup.filter(_documents(FOOTER), "acme", ["1"])
+    dedup.filter(_documents(FOOTER, source="b.pdf"), "acme", ["2"])
+
+    dedup.forget(["1"])
+
+    assert dedup.duplicates_of("1") == []
+    assert dedup.filter(_documents(FOOTER), "acme", ["3"])[2] == 0
+
+def test_off_keeps_everything(tmp_path):
+    dedup = Deduplicator(str(tmp_path / "dedup.sqlite"), mode="off")
+    documents = _documents(FOOTER, FOOTER)
+
+    assert dedup.filter(documents, "acme", ["1", "2"]) == (documents, ["1", "2"], 0)
+    assert not dedup.exists()
+
+def test_upload_reports_dropped_duplicates(client, tmp_path, monkeypatch):
+    from app.dedup import deduplicator
+
+    monkeypatch.setattr(deduplicator, "path", str(tmp_path / "dedup.sqlite"))
+    monkeypatch.setattr(deduplicator, "mode", "skip")
+    monkeypatch.setattr(deduplicator, "_connection", None)
+    headers = {"X-Tenant-ID": "dedup-upload"}
+
+    first = client.post("/upload", json=[{"content": FOOTER, "metadata": {"source": "a.pdf"}}], headers=headers)
+    second = client.post("/upload", json=[{"content": FOOTER, "metadata": {"source": "b.pdf"}},
+                                          {"content": OTHER, "metadata": {"source": "b.pdf"}}], headers=headers)
+
+    assert first.json()["duplicates_dropped"] == 0
+    assert second.json()["duplicates_dropped"] == 1
+    assert second.json()["chunks_created"] == 1
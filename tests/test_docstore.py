@@ -0,0 +1,49 @@
+import json
+import sqlite3
+
+from langchain_core.documents import Document
+
+from app.docstore import DocStore
+
+TEXT = "Chunk text that repeats itself. " * 50
+
+def test_sqlite_records_are_compressed(tmp_path):
+    store = DocStore(str(tmp_path / "docstore.sqlite"))
+    store.put_many([("a", "default", Document(page_content=TEXT, metadata={"source": "a.txt"}))])
+
+    stored = sqlite3.connect(tmp_path / "docstore.sqlite").execute("SELECT data FROM records").fetchone()[0]
+    assert len(stored) < len(TEXT) / 4
+    document = store.get_many(["a", "missing"])["a"]
+    assert document.page_content == TEXT
+    assert document.metadata == {"source": "a.txt"}
+
+def test_uncompressed_store_is_migrated(tmp_path):
+    path = tmp_path / "docstore.sqlite"
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE parents (id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, "
+                   "text TEXT NOT NULL, metadata TEXT NOT NULL)")
+    legacy.execute("INSERT INTO parents VALUES (?, ?, ?, ?)", ("a", "acme", TEXT, json.dumps({"page": 1})))
+    legacy.commit()
+    legacy.close()
+
+    store = DocStore(str(path))
+    assert store.get_many(["a"])["a"] == Document(page_content=TEXT, metadata={"page": 1})
+    store.delete_tenant("acme")
+    assert store.get_many(["a"]) == {}
+    tables = sqlite3.connect(path).execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    assert ("parents",) not in tables
+
+def test_restore_migrates_an_older_backup(tmp_path):
+    backup = tmp_path / "old.backup"
+    legacy = sqlite3.connect(backup)
+    legacy.execute("CREATE TABLE parents (id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, "
+                   "text TEXT NOT NULL, metadata TEXT NOT NULL)")
+    legacy.execute("INSERT INTO parents VALUES ('a', 'default', 'old text', '{}')")
+    legacy.commit()
+    legacy.close()
+
+    store = DocStore(str(tmp_path / "docstore.sqlite"))
+    store.put_many([("b", "default", Document(page_content="replaced"))])
+    store.restore(str(backup))
+    assert set(store.get_many(["a", "b"])) == {"a"}
+    assert store.get_many(["a"])["a"].page_content == "old text"
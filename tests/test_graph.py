@@ -0,0 +1,71 @@
+import pytest
+from langchain_core.documents import Document
+
+from app.models import QueryRequest
+
+@pytest.fixture
+def no_llm(monkeypatch):
+    """Fail any LLM call, so a route that should not need the model proves it"""
+    import app.graph
+    import app.hedging
+
+    calls = []
+    def get_llm(*args, **kwargs):
+        calls.append(args)
+        raise AssertionError("the LLM was called")
+    monkeypatch.setattr(app.graph, "get_llm", get_llm)
+    monkeypatch.setattr(app.hedging, "get_llm", get_llm)
+    return calls
+
+def _state(question: str, **fields) -> dict:
+    from app.endpoints import _graph_input
+
+    return _graph_input(QueryRequest(question=question, **fields))
+
+def test_empty_retrieval_answers_without_the_llm(client, no_llm):
+    from app.config import NO_CONTEXT_RESPONSE
+
+    question = "What is in a knowledge base nobody uploaded to?"
+    response = client.post("/query", json={"question": question}, headers={"X-Tenant-ID": "graph-empty"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["route"] == "no_context"
+    assert body["answer"] == NO_CONTEXT_RESPONSE.format(query=question)
+    assert no_llm == []
+
+def test_low_scores_route_to_no_context(monkeypatch):
+    import app.graph
+
+    monkeypatch.setattr(app.graph, "MIN_RELEVANCE_SCORE", 0.5)
+    context = [Document(page_content="A barely related chunk.")]
+
+    assert app.graph.route_after_search({"context": context, "scores": [0.2]}) == "no_context"
+    assert app.graph.route_after_search({"context": context, "scores": [0.7]}) == "generate"
+    # Sparse-only scores are not on the dense scale the threshold is set for
+    assert app.graph.route_after_search({"context": context, "scores": [0.2], "retrieval_mode": "fast"}) == "generate"
+    assert app.graph.route_after_search({"context": [Document(page_content="  ")], "scores": [0.9]}) == "no_context"
+
+def test_small_talk_skips_retrieval(client, monkeypatch):
+    import app.graph
+
+    def search(state):
+        raise AssertionError("small talk was searched for")
+    monkeypatch.setattr(app.graph, "search", search)
+    monkeypatch.setattr(app.graph, "asearch", search)
+    monkeypatch.setattr(app.graph, "SMALL_TALK_ROUTING", True)
+    graph = app.graph.create_graph()
+
+    result = graph.invoke(_state("Hello there!", provider="fake"))
+
+    assert result["route"] == "small_talk"
+    assert result["answer"]
+    assert result["context"] == []
+
+def test_small_talk_classifier():
+    from app.graph import is_small_talk
+
+    assert is_small_talk("hi")
+    assert is_small_talk("Thanks so much!")
+    assert not is_small_talk("Hi, what does the reindex endpoint do?")
+    assert not is_small_talk("How are you storing sparse vectors in the collection?")
@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import contextvars
+
+import pytest
+
+from app.hedging import stream_generation
+from conftest import wait_for
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from fake_ollama import serve as serve_fake_ollama  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "What is the capital of France?"}]
+
+@pytest.fixture
+def fake_ollama():
+    """Start fake Ollama servers: fake_ollama(name, ttft) -> (candidate, server)"""
+    servers = []
+
+    def start(name: str, ttft: float):
+        # A long answer keeps the loser's stream open until it is aborted
+        server = serve_fake_ollama("127.0.0.1", 0, name, ttft, tokens_per_second=50,
+                                   response=" ".join([f"{name}-answer"] * 200))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        candidate = {"provider": "ollama", "model_name": name, "base_url": f"http://127.0.0.1:{server.server_port}"}
+        return candidate, server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def first_tokens(generation, count: int = 3):
+    """The candidate that served the first tokens, and their text; closes the generation"""
+    served_by, text = None, ""
+    try:
+        for candidate, chunk in generation:
+            served_by = candidate
+            text += chunk.content
+            count -= 1
+            if count <= 0:
+                break
+    finally:
+        generation.close()
+    return served_by, text
+
+@pytest.mark.parametrize("mode", ["hedge", "failover"])
+def test_fallback_wins_when_primary_misses_the_budget(fake_ollama, mode):
+    primary, primary_server = fake_ollama("slow", ttft=1.5)
+    fallback, fallback_server = fake_ollama("fast", ttft=0.05)
+
+    served_by, text = first_tokens(stream_generation(MESSAGES, primary, fallback=fallback, budget=0.2, mode=mode))
+
+    assert served_by is fallback
+    assert text.startswith("fast-answer")
+    # The losing primary's stream is cut off rather than generated to the end
+    assert wait_for(lambda: primary_server.stats["aborted"] == 1)
+    assert primary_server.stats["completed"] == 0
+
+def test_hedged_primary_still_wins_the_race(fake_ollama):
+    primary, primary_server = fake_ollama("primary", ttft=0.5)
+    fallback, fallback_server = fake_ollama("fallback", ttft=1.5)
+
+    served_by, _ = first_tokens(stream_generation(MESSAGES, primary, fallback=fallback, budget=0.2, mode="hedge"))
+
+    # Both raced after the budget ran out; the primary produced its first token first
+    assert served_by is primary
+    assert fallback_server.stats["requests"] == 1
+    assert wait_for(lambda: fallback_server.stats["aborted"] == 1)
+    assert fallback_server.stats["completed"] == 0
+
+def test_failover_abandons_the_primary(fake_ollama):
+    primary, primary_server = fake_ollama("primary", ttft=0.5)
+    fallback, _ = fake_ollama("fallback", ttft=1.0)
+
+    served_by, _ = first_tokens(stream_generation(MESSAGES, primary, fallback=fallback, budget=0.2, mode="failover"))
+
+    # The primary would have answered sooner, but failover gave up on it at the budget
+    assert served_by is fallback
+    assert wait_for(lambda: primary_server.stats["aborted"] == 1)
+
+def test_fallback_is_not_started_within_the_budget(fake_ollama):
+    primary, _ = fake_ollama("primary", ttft=0.05)
+    fallback, fallback_server = fake_ollama("fallback", ttft=0.05)
+
+    served_by, _ = first_tokens(stream_generation(MESSAGES, primary, fallback=fallback, budget=1.0, mode="hedge"))
+
+    assert served_by is primary
+    assert fallback_server.stats["requests"] == 0
+
+def test_racers_log_with_the_request_id(fake_ollama, monkeypatch):
+    import app.hedging
+    from app.logging_config import request_id_var, start_request
+
+    seen = []
+    get_llm = app.hedging.get_llm
+    def recording_get_llm(*args, **kwargs):
+        seen.append(request_id_var.get())
+        return get_llm(*args, **kwargs)
+    monkeypatch.setattr(app.hedging, "get_llm", recording_get_llm)
+    primary, _ = fake_ollama("primary", ttft=1.0)
+    fallback, _ = fake_ollama("fallback", ttft=0.05)
+
+    def serve_request():
+        request_id = start_request()
+        first_tokens(stream_generation(MESSAGES, primary, fallback=fallback, budget=0.2, mode="hedge"))
+        return request_id
+    request_id = contextvars.copy_context().run(serve_request)
+
+    assert seen == [request_id, request_id]
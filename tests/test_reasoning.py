@@ -0,0 +1,74 @@
+import json
+
+from app.reasoning import ReasoningParser, is_reasoning_model, opens_reasoning, observe_reasoning
+
+def feed_all(parser: ReasoningParser, chunks):
+    parts = []
+    for chunk in chunks:
+        parts += parser.feed(chunk)
+    return parts + parser.close()
+
+def test_direct_answer_of_unlisted_reasoning_model_streams_as_answer():
+    for model in ("qwen3:8b", "gpt-oss:20b"):
+        assert not opens_reasoning({"provider": "ollama", "model_name": model})
+    parser = ReasoningParser(opened=opens_reasoning({"provider": "ollama", "model_name": "qwen3:8b"}))
+    parts = feed_all(parser, ["Paris is", " the capital", " of France."])
+    assert parts == [("answer", "Paris is"), ("answer", " the capital"), ("answer", " of France.")]
+    assert not parser.in_reasoning
+    assert parser.reasoning == ""
+
+def test_bare_close_of_opening_model_is_reasoning():
+    parser = ReasoningParser(opened=opens_reasoning({"provider": "ollama", "model_name": "deepseek-r1:7b"}))
+    parts = feed_all(parser, ["The user asks", " about France.</th", "ink>\n\nParis."])
+    # Held back until </think> confirms it, then returned once
+    assert parts == [("reasoning", "The user asks about France."), ("answer", "Paris.")]
+    assert parser.closed_implicitly
+
+def test_bare_close_without_opened_moves_earlier_text_to_reasoning():
+    parser = ReasoningParser()
+    parts = feed_all(parser, ["Let me think.", "</think>", "Paris."])
+    assert parts[0] == ("answer", "Let me think.")
+    assert parser.reasoning == "Let me think."
+    assert parser.answer == "Paris."
+
+def test_opened_model_without_close_answers_once():
+    parser = ReasoningParser(opened=True)
+    parts = feed_all(parser, ["The answer", " is 42."])
+    # What a streaming client receives: the text once, as the answer
+    assert parts == [("answer", "The answer is 42.")]
+    assert parser.answer == "The answer is 42."
+    assert parser.reasoning == ""
+
+def test_stopping_opened_reasoning_returns_what_was_held():
+    parser = ReasoningParser(opened=True)
+    assert parser.feed("Thinking about") == []
+    assert parser.stop_reasoning() == [("reasoning", "Thinking about")]
+    assert parser.feed("Paris.") + parser.close() == [("answer", "Paris.")]
+
+def test_stream_of_opening_model_without_reasoning(client):
+    from app.config import FAKE_LLM_RESPONSES
+    client.post("/upload", json=[{"content": "Paris is the capital of France."}])
+    # The fake provider answers directly; a deepseek-r1 name makes the parser assume an opened block
+    with client.stream("POST", "/query/stream", json={
+        "question": "What is the capital of France?", "provider": "fake", "model_name": "deepseek-r1:7b"
+    }) as response:
+        events = [json.loads(line) for line in response.iter_lines() if line]
+
+    streamed = [(event["type"], event["content"]) for event in events if event["type"] in ("token", "reasoning")]
+    assert [kind for kind, _ in streamed] == ["token"]
+    assert streamed[0][1] == events[-1]["answer"]
+    assert events[-1]["answer"] in FAKE_LLM_RESPONSES
+
+def test_only_a_bare_close_marks_a_model_as_opening():
+    explicit = {"provider": "ollama", "model_name": "explicit-thinker"}
+    parser = ReasoningParser()
+    feed_all(parser, ["<think>hmm</think>", "Paris."])
+    observe_reasoning(explicit, parser)
+    assert is_reasoning_model(explicit)
+    assert not opens_reasoning(explicit)
+
+    implicit = {"provider": "ollama", "model_name": "implicit-thinker"}
+    parser = ReasoningParser()
+    feed_all(parser, ["hmm</think>", "Paris."])
+    observe_reasoning(implicit, parser)
+    assert opens_reasoning(implicit)
@@ -0,0 +1,71 @@
+import pytest
+from fastapi import HTTPException
+from langchain_core.documents import Document
+
+from app.config import COLLECTION_NAME
+
+TENANT = "reindexed"
+
+def _index(*texts: str):
+    from app.vector_store import index_documents_hybrid
+
+    index_documents_hybrid([Document(page_content=text, metadata={"source": "reindex.txt"}) for text in texts],
+                           tenant_id=TENANT)
+
+def _search(query: str):
+    from app.vector_store import hybrid_search_with_scores
+
+    return [doc.page_content for doc, _ in hybrid_search_with_scores(query, limit=10, tenant_id=TENANT)]
+
+def test_reindex_swaps_the_alias_to_a_new_version(client):
+    from app import vector_store
+    from app.reindex import Reindexer
+
+    _index("A chunk that survives the reindex.")
+    before = vector_store.index_aliases()[COLLECTION_NAME]
+
+    reindexer = Reindexer()
+    status = reindexer.start()
+    reindexer._thread.join(timeout=30)
+
+    assert reindexer.status["state"] == "completed"
+    assert vector_store.index_aliases()[COLLECTION_NAME] == f"{COLLECTION_NAME}.v{status['version']}" != before
+    assert vector_store.rebuilding == {}
+    assert _search("chunk that survives") == ["A chunk that survives the reindex."]
+
+def test_uploads_during_a_rebuild_reach_the_new_version(client):
+    from app import vector_store
+
+    version, _ = vector_store.begin_rebuild()
+    try:
+        _index("A chunk uploaded while the reindex ran.")
+    finally:
+        vector_store.finish_rebuild(version)
+
+    # Nothing copied the live version over: the upload was mirrored into the rebuild
+    assert vector_store.index_aliases()[COLLECTION_NAME] == f"{COLLECTION_NAME}.v{version}"
+    assert "A chunk uploaded while the reindex ran." in _search("chunk uploaded while the reindex ran")
+
+def test_only_one_rebuild_at_a_time(client):
+    from app import vector_store
+
+    version, _ = vector_store.begin_rebuild()
+    try:
+        with pytest.raises(HTTPException) as refused:
+            vector_store.begin_rebuild()
+        assert refused.value.status_code == 409
+        assert client.delete("/clear-collection").status_code == 409
+    finally:
+        vector_store.finish_rebuild(version, swap=False)
+    assert not vector_store.qdrant_client.collection_exists(f"{COLLECTION_NAME}.v{version}")
+
+def test_clear_swaps_to_an_empty_version(client):
+    from app import vector_store
+
+    _index("A chunk that the clear removes.")
+    before = vector_store.index_aliases()[COLLECTION_NAME]
+
+    assert client.delete("/clear-collection").status_code == 200
+
+    assert vector_store.index_aliases()[COLLECTION_NAME] != before
+    assert _search("chunk that the clear removes") == []
@@ -0,0 +1,63 @@
+import pytest
+from fastapi import HTTPException
+from langchain_core.documents import Document
+
+TENANT = "retrieval-modes"
+CHUNKS = [
+    "Sparse vectors answer keyword lookups such as error codes.",
+    "Dense vectors capture the meaning of a whole question.",
+    "A cross-encoder reranks the fused candidates in deep mode.",
+]
+
+@pytest.fixture(scope="module")
+def indexed(client):
+    from app.vector_store import index_documents_hybrid
+
+    index_documents_hybrid([Document(page_content=text, metadata={"source": "modes.txt"}) for text in CHUNKS],
+                           tenant_id=TENANT)
+
+def test_auto_policy():
+    from app.vector_store import choose_retrieval_mode, resolve_retrieval_mode
+
+    assert choose_retrieval_mode("ERR-4012") == "fast"
+    assert choose_retrieval_mode("sparse vectors") == "fast"
+    assert choose_retrieval_mode("How are dense vectors used?") == "balanced"
+    assert choose_retrieval_mode("Compare sparse and dense retrieval") == "deep"
+    assert resolve_retrieval_mode("sparse vectors", "balanced") == "balanced"
+    with pytest.raises(HTTPException) as rejected:
+        resolve_retrieval_mode("sparse vectors", "fastest")
+    assert rejected.value.status_code == 400
+
+def test_fast_mode_skips_the_dense_model(indexed, monkeypatch):
+    from app import vector_store
+
+    def embed_query(query):
+        raise AssertionError("fast mode embedded a dense query")
+    monkeypatch.setattr(vector_store.embedder, "embed_query", embed_query)
+
+    results = vector_store.hybrid_search_with_scores("keyword lookups error codes", limit=1, tenant_id=TENANT,
+                                                     retrieval_mode="fast")
+
+    assert results[0][0].page_content == CHUNKS[0]
+
+def test_deep_mode_reranks_the_candidates(indexed, monkeypatch):
+    from app import vector_store
+
+    class Reranker:
+        def rerank(self, query, texts):
+            return [1.0 if "cross-encoder" in text else 0.0 for text in texts]
+    monkeypatch.setattr(vector_store, "_get_reranker", Reranker)
+
+    results = vector_store.hybrid_search_with_scores("vectors", limit=2, tenant_id=TENANT, retrieval_mode="deep")
+
+    assert len(results) == 2
+    assert results[0][0].page_content == CHUNKS[2]
+    assert results[0][0].metadata["rerank_score"] == 1.0
+
+def test_latency_is_tracked_per_mode(indexed):
+    from app import vector_store
+    from app.metrics import metrics
+
+    before = metrics.summary("retrieval_seconds", mode="balanced")["count"]
+    vector_store.hybrid_search_with_scores("meaning of a question", tenant_id=TENANT, retrieval_mode="balanced")
+    assert metrics.summary("retrieval_seconds", mode="balanced")["count"] == before + 1
@@ -0,0 +1,77 @@
+import time
+import threading
+
+import pytest
+
+from app.shared_state import SqliteStore, StateSync
+from conftest import wait_for
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two workers' views of one shared SQLite store"""
+    path = str(tmp_path / "state.sqlite")
+    return StateSync(SqliteStore(path), interval=0), StateSync(SqliteStore(path), interval=0)
+
+def test_changes_reach_the_other_workers(workers):
+    first, second = workers
+    seen_by_first, seen_by_second = [], []
+    first.subscribe("corpus", seen_by_first.append)
+    second.subscribe("corpus", seen_by_second.append)
+
+    first.publish("corpus", {"version": 1})
+    first.poll()
+    second.poll()
+    second.poll()
+
+    # Only the other worker is notified, once per change
+    assert seen_by_first == []
+    assert seen_by_second == [{"version": 1}]
+    assert second.get("corpus") == {"version": 1}
+
+def test_updates_are_atomic_across_workers(workers):
+    def bump(sync):
+        for _ in range(25):
+            sync.update("counter", lambda state: {"count": state.get("count", 0) + 1})
+    threads = [threading.Thread(target=bump, args=(sync,)) for sync in workers for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert workers[0].get("counter") == {"count": 100}
+
+def test_lock_excludes_the_other_workers(workers):
+    first, second = workers
+    events = []
+    def take():
+        with second.lock("layout"):
+            events.append("second")
+    with first.lock("layout"):
+        waiter = threading.Thread(target=take)
+        waiter.start()
+        time.sleep(0.2)
+        events.append("first done")
+    waiter.join(timeout=5)
+
+    assert events == ["first done", "second"]
+
+def test_live_holder_keeps_its_lease(workers, monkeypatch):
+    import app.shared_state
+
+    monkeypatch.setattr(app.shared_state, "SHARED_LOCK_TIMEOUT", 0.3)
+    first, second = workers
+    with first.lock("layout"):
+        # Well past the timeout, the lease is still renewed
+        time.sleep(0.8)
+        assert not second.store.acquire("layout", "other", 0.3)
+    assert second.store.acquire("layout", "other", 0.3)
+
+def test_dead_holder_lease_expires(workers):
+    first, second = workers
+    assert first.store.acquire("layout", "crashed-worker", 0.2)
+    assert not second.store.acquire("layout", "other", 0.2)
+    # Only the holder can release it
+    second.store.release("layout", "other")
+    assert not second.store.acquire("layout", "other", 0.2)
+
+    assert wait_for(lambda: second.store.acquire("layout", "other", 0.2))
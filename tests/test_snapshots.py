@@ -0,0 +1,23 @@
+import pytest
+from langchain_core.documents import Document
+
+from app.config import COLLECTION_NAME
+
+def test_failed_restore_puts_the_previous_index_back(client, tmp_path):
+    from app import vector_store
+    from app.docstore import docstore
+    from app.snapshots import DOCSTORE_NAME, _go_live
+
+    docstore.put_many([("snapshot-live", "default", Document(page_content="Live record"))])
+    aliases = vector_store.index_aliases()
+    restored = f"{COLLECTION_NAME}.v{vector_store.next_index_version()}"
+    vector_store._create_collection(restored, shared=True)
+    # A docstore backup that cannot be read fails the restore after the aliases were swapped
+    (tmp_path / DOCSTORE_NAME).write_bytes(b"not a docstore")
+
+    with vector_store.layout_lock(), pytest.raises(Exception):
+        _go_live({COLLECTION_NAME: restored}, {"docstore": {"file": DOCSTORE_NAME}}, str(tmp_path))
+
+    assert vector_store.index_aliases() == aliases
+    assert docstore.get_many(["snapshot-live"])["snapshot-live"].page_content == "Live record"
+    vector_store.drop_collections([restored], delay=0)
@@ -0,0 +1,53 @@
+from langchain_core.documents import Document
+
+from app.config import COLLECTION_NAME
+
+def _index(tenant_id: str, *texts: str):
+    from app.vector_store import index_documents_hybrid
+
+    index_documents_hybrid([Document(page_content=text, metadata={"source": f"{tenant_id}.txt"}) for text in texts],
+                           tenant_id=tenant_id)
+
+def _search(tenant_id: str, query: str):
+    from app.vector_store import hybrid_search_with_scores
+
+    return [doc.page_content for doc, _ in hybrid_search_with_scores(query, limit=10, tenant_id=tenant_id)]
+
+def test_tenants_only_search_their_own_chunks(client):
+    _index("tenant-red", "The red team deploys on Mondays.")
+    _index("tenant-blue", "The blue team deploys on Fridays.")
+
+    assert _search("tenant-red", "when does the team deploy") == ["The red team deploys on Mondays."]
+    assert _search("tenant-blue", "when does the team deploy") == ["The blue team deploys on Fridays."]
+
+def test_clearing_a_tenant_keeps_the_others(client):
+    _index("tenant-clear", "Chunk of the tenant being cleared.")
+    _index("tenant-kept", "Chunk of the tenant that stays.")
+
+    response = client.delete("/clear-collection", headers={"X-Tenant-ID": "tenant-clear"})
+
+    assert response.status_code == 200
+    assert _search("tenant-clear", "chunk of the tenant") == []
+    assert _search("tenant-kept", "chunk of the tenant") == ["Chunk of the tenant that stays."]
+
+def test_large_tenant_moves_to_its_own_collection(client, monkeypatch):
+    from app import vector_store
+
+    monkeypatch.setattr(vector_store, "TENANT_DEDICATED_THRESHOLD", 2)
+    _index("tenant-large", "First chunk of a large tenant.")
+    assert "tenant-large" not in vector_store.dedicated_tenants
+    _index("tenant-large", "Second chunk of a large tenant.", "Third chunk of a large tenant.")
+
+    assert "tenant-large" in vector_store.dedicated_tenants
+    shared = vector_store.qdrant_client.count(collection_name=COLLECTION_NAME,
+                                              count_filter=vector_store.tenant_filter("tenant-large"), exact=True)
+    assert shared.count == 0
+    assert len(_search("tenant-large", "chunk of a large tenant")) == 3
+
+    # Clearing a dedicated tenant drops its collection
+    vector_store.clear_tenant("tenant-large")
+    assert "tenant-large" not in vector_store.dedicated_tenants
+
+def test_unsafe_tenant_id_is_refused(client):
+    response = client.post("/query", json={"question": "Anything?"}, headers={"X-Tenant-ID": "../other"})
+    assert response.status_code == 400